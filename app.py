@@ -1,14 +1,26 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file, g, has_request_context
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from werkzeug.utils import safe_join
 import functools
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import os
 import math
+import atexit
+import numpy as np
 import time
 import json
 import random
 import threading
+import itertools
+import hashlib
+import hmac
+import uuid
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 import smtplib
 from email.mime.text import MIMEText
@@ -17,8 +29,36 @@ from email.mime.base import MIMEBase
 from email import encoders
 from textblob import TextBlob
 from fpdf import FPDF
+from artifacts import ArtifactManager
+from metrics import Metrics
+from sensor_store import SensorStore, device_key, CHANNELS as SENSOR_CHANNELS
+from rollups import Rollups, parse_timestamp
+from bulk_reports import BulkReports
+from feedback_store import FeedbackStore, SENTIMENTS as REVIEW_SENTIMENTS
+from search_index import SearchIndex
+from records import analysis_table
+from payloads import PayloadCache, splice, dumps
+from changefeed import ChangeLog, check_of, TEST as CHANGE_TEST, REVIEW as CHANGE_REVIEW
+from geocoder import describe as describe_location, default_geocoder
+from build_assets import VENDOR_ASSETS
+from idempotency import IdempotencyCache, PENDING as IDEMPOTENCY_PENDING
+from ratelimit import TokenBuckets, RenderSlots, retry_after_header
+from profiling import StackSampler, ProfileStore, collapsed, flamegraph_svg
 import socket
 import io
+import csv
+import zlib
+import gzip
+import mimetypes
+import logging
+
+# ── Structured, leveled logging (logfmt-style key=value lines) ──
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="ts=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+)
+log = logging.getLogger("pyexpo")
+
 try:
     import qrcode
     QRCODE_AVAILABLE = True
@@ -32,9 +72,38 @@ try:
     SERIAL_AVAILABLE = True
 except ImportError:
     SERIAL_AVAILABLE = False
-    print("⚠️  pyserial not installed. Run: pip install pyserial")
+    log.warning("msg=\"pyserial not installed, hardware disabled\" hint=\"pip install pyserial\"")
+
+try:
+    import fcntl
+except ImportError:          # Windows: no cross-process lock, every process runs its own tasks
+    fcntl = None
 
 app = Flask(__name__)
+
+# =============================================
+# METRICS
+# =============================================
+# Every process publishes its registry to METRICS_DIR so /metrics reports
+# the totals of all gunicorn workers, not those of whichever one answered.
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+METRICS_PUBLISH_S = float(os.environ.get("METRICS_PUBLISH_SECONDS", 5))
+os.makedirs(METRICS_DIR, exist_ok=True)
+metrics = Metrics(directory=METRICS_DIR)
+metrics.describe("pyexpo_stage_seconds", "histogram", "Time spent in hot-path stages")
+metrics.describe("pyexpo_request_seconds", "histogram", "HTTP request latency by route")
+metrics.describe("pyexpo_requests_total", "counter", "HTTP requests by route, method and status")
+metrics.describe("pyexpo_serial_lines_total", "counter", "Serial lines read from the sensor, by outcome")
+metrics.describe("pyexpo_exports_total", "counter", "History exports started, by format")
+metrics.describe("pyexpo_idempotent_replays_total", "counter", "Repeated submissions answered from the idempotency cache")
+metrics.describe("pyexpo_rate_limited_total", "counter", "Requests rejected with 429, by route and reason")
+metrics.describe("pyexpo_render_slots_busy", "gauge", "Render slots in use across all workers")
+metrics.describe("pyexpo_cache_total", "counter", "Cache lookups by cache and result")
+metrics.describe("pyexpo_artifact_bytes", "gauge", "Bytes of generated artifacts on disk (last sweep)")
+metrics.describe("pyexpo_artifact_files", "gauge", "Generated artifact files on disk (last sweep)")
+metrics.describe("pyexpo_profiles_total", "counter", "Requests profiled, by trigger")
+metrics.describe("pyexpo_warmup_seconds", "gauge", "Time each worker warm-up step took")
+
 app.secret_key = "super_secret_key_for_demo_only"  # In production, use environment variable
 
 # ── Session cookie fix for ngrok / reverse proxy ──────────────
@@ -50,6 +119,149 @@ app.config.update(
 from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
+# =============================================
+# TEMPLATE CACHING
+# =============================================
+# Compiled templates are kept on disk so every worker (and every restart)
+# skips Jinja's parse/compile step; entries are keyed by the template source
+# checksum, so edits never serve stale bytecode. Must be set before the Jinja
+# environment is first created.
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR", "template_cache")
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+app.jinja_options = {**app.jinja_options, "bytecode_cache": FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)}
+
+# Static page parts (navbar + theme toggle, hardware panel) live in
+# templates/fragments/ and are rendered once per (params, login state), then
+# pasted into every page as finished HTML. Fragments must not use anything
+# else from the request. Skipped while templates auto-reload (debug).
+fragment_cache_lock = threading.Lock()
+fragment_cache = {}   # (name, params, logged_in) -> Markup
+
+
+def render_fragment(name, **params):
+    """Cached HTML of templates/fragments/<name>.html."""
+    logged_in = bool(session.get("user"))
+    key = (name, tuple(sorted(params.items())), logged_in)
+    if not app.jinja_env.auto_reload:
+        with fragment_cache_lock:
+            html = fragment_cache.get(key)
+        if html is not None:
+            metrics.inc("pyexpo_cache_total", cache="fragment", result="hit")
+            return html
+        metrics.inc("pyexpo_cache_total", cache="fragment", result="miss")
+    html = Markup(render_template(f"fragments/{name}.html", logged_in=logged_in, **params))
+    if not app.jinja_env.auto_reload:
+        with fragment_cache_lock:
+            fragment_cache[key] = html
+    return html
+
+
+@app.context_processor
+def inject_fragment():
+    return {"fragment": render_fragment}
+
+
+# =============================================
+# STATIC ASSETS + RESPONSE COMPRESSION
+# =============================================
+# `python build_assets.py` writes fingerprinted, precompressed copies of
+# static/ to static/dist/ plus a manifest. asset_url() resolves names through
+# that manifest (plain /static/ URLs when no build exists) and vendor_url()
+# prefers a vendored copy of a CDN asset. Fingerprinted files never change, so
+# they are served with an immutable Cache-Control, as .br/.gz (text) or .webp
+# (images) when the client accepts it. Dynamic HTML/JSON bodies are gzipped on the fly.
+ASSET_MANIFEST_FILE = os.path.join(app.static_folder, "dist", "manifest.json")
+ASSET_MAX_AGE = 365 * 86400
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 5        # ~5x smaller HTML/JSON at a fraction of level 9's CPU
+COMPRESS_MIMETYPES = {"text/html", "application/json", "text/plain", "text/csv", "text/css",
+                      "application/javascript", "image/svg+xml"}
+
+asset_manifest_lock = threading.Lock()
+asset_manifest = {"signature": None, "map": {}}
+
+
+def _asset_map():
+    """The build manifest, re-read only when the file changes (a new build)."""
+    signature = _file_signature(ASSET_MANIFEST_FILE)
+    with asset_manifest_lock:
+        if signature != asset_manifest["signature"]:
+            try:
+                with open(ASSET_MANIFEST_FILE) as f:
+                    asset_manifest["map"] = json.load(f)
+            except (OSError, ValueError):
+                asset_manifest["map"] = {}
+            asset_manifest["signature"] = signature
+        return asset_manifest["map"]
+
+
+def asset_url(name):
+    """URL of a static file, fingerprinted when a build exists."""
+    return url_for("static", filename=_asset_map().get(name, name))
+
+
+def vendor_url(name):
+    """Local copy of a CDN asset from build_assets.VENDOR_ASSETS, else the CDN URL."""
+    spec = VENDOR_ASSETS[name]
+    hashed = _asset_map().get(spec["path"])
+    return url_for("static", filename=hashed) if hashed else spec["url"]
+
+
+def vendor_attrs(name):
+    """SRI attributes, only while the asset still comes from the CDN."""
+    spec = VENDOR_ASSETS[name]
+    if "integrity" not in spec or spec["path"] in _asset_map():
+        return Markup("")
+    return Markup('integrity="%s" crossorigin=""') % spec["integrity"]
+
+
+@app.context_processor
+def inject_asset_helpers():
+    return {"asset_url": asset_url, "vendor_url": vendor_url, "vendor_attrs": vendor_attrs}
+
+
+@app.route("/static/dist/<path:filename>")
+def static_dist(filename):
+    """Fingerprinted build output: immutable, precompressed variants when accepted."""
+    dist_dir = os.path.join(app.static_folder, "dist")
+    path = safe_join(dist_dir, filename)
+    if path is None or not os.path.isfile(path):
+        return "Not found", 404
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    vary = "Accept-Encoding"
+    if mimetype in ("image/png", "image/jpeg"):
+        vary = "Accept"
+        # explicit check: "*/*" alone doesn't mean the client decodes WebP
+        if "image/webp" in request.headers.get("Accept", "") and os.path.isfile(path + ".webp"):
+            path, mimetype = path + ".webp", "image/webp"
+    else:
+        for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if request.accept_encodings[enc] and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, enc
+                break
+    response = send_file(path, mimetype=mimetype, max_age=ASSET_MAX_AGE, conditional=True)
+    response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    response.vary.add(vary)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.after_request
+def _compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 206, 304) or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES or not request.accept_encodings["gzip"]):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
 # SAFE LIMITS
 SAFE_LIMIT_MG_L = 0.5
 RECOMMENDED_MG_KG = 0.02
@@ -63,9 +275,13 @@ SAFE_LIMITS = {
 }
 
 # Store data
-FEEDBACK_FILE = "feedback_data.json"
+FEEDBACK_FILE = "feedback_data.json"          # legacy JSON list, imported into FEEDBACK_LOG_FILE once
+FEEDBACK_LOG_FILE = "feedback.jsonl"
 ANALYSIS_HISTORY_FILE = "analysis_history.json"
 USERS_FILE = "users.json"
+REPORT_INDEX_FILE = "report_index.json"
+REPORT_DIR = os.path.join("static", "reports")
+BULK_REPORT_DIR = os.path.join(REPORT_DIR, "bulk")
 
 # EMAIL CONFIGURATION (Placeholders)
 SMTP_SERVER = "smtp.gmail.com"
@@ -76,7 +292,7 @@ SENDER_PASSWORD = "hqqm kwrf hlyq yqmu"
 def send_email(to_email, name, rating, message, attachment_path=None):
     try:
         if "your_email" in SENDER_EMAIL:
-            print("Email not sent: Credentials not configured.")
+            log.warning("msg=\"email not sent, credentials not configured\"")
             return False
 
         msg = MIMEMultipart()
@@ -105,19 +321,20 @@ def send_email(to_email, name, rating, message, attachment_path=None):
                     f"attachment; filename={os.path.basename(attachment_path)}",
                 )
                 msg.attach(part)
-                print(f"Attachment added: {attachment_path}")
+                log.debug("msg=\"attachment added\" path=%s", attachment_path)
             except Exception as e:
-                print(f"Failed to attach file: {str(e)}")
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=10)
-        server.starttls()
-        server.login(SENDER_EMAIL, SENDER_PASSWORD.replace(" ", ""))  # Handle spaces in app password
-        server.send_message(msg)
-        server.quit()
-        print(f"Email sent successfully to {to_email}")
+                log.warning("msg=\"failed to attach file\" path=%s error=%r", attachment_path, str(e))
+
+        with metrics.timer("pyexpo_stage_seconds", stage="smtp_send"):
+            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=10)
+            server.starttls()
+            server.login(SENDER_EMAIL, SENDER_PASSWORD.replace(" ", ""))  # Handle spaces in app password
+            server.send_message(msg)
+            server.quit()
+        log.info("msg=\"email sent\" to=%s", to_email)
         return True
     except Exception as e:
-        print(f"Error sending email: {str(e)}")
+        log.error("msg=\"error sending email\" to=%s error=%r", to_email, str(e))
         return False
 
 def load_users():
@@ -137,57 +354,238 @@ def login_required(func):
         return func(*args, **kwargs)
     return wrapper
 
-def load_feedback():
-    if os.path.exists(FEEDBACK_FILE):
-        with open(FEEDBACK_FILE, "r") as f:
-            return json.load(f)
-    return []
-
-def save_feedback(feedback_list):
-    with open(FEEDBACK_FILE, "w") as f:
-        json.dump(feedback_list, f, indent=2)
+# Reviews are appended to a JSONL log with an offset index (see feedback_store.py),
+# so submitting one and rendering a page no longer touch every review.
+feedback_store = FeedbackStore(FEEDBACK_LOG_FILE, legacy_path=FEEDBACK_FILE).open()
+REVIEWS_PER_PAGE = 20
 
+@metrics.timed("pyexpo_stage_seconds", stage="history_load")
 def load_analysis_history():
     if os.path.exists(ANALYSIS_HISTORY_FILE):
         with open(ANALYSIS_HISTORY_FILE, "r") as f:
             return json.load(f)
     return []
 
+@metrics.timed("pyexpo_stage_seconds", stage="history_save")
 def save_analysis_history(history_list):
-    with open(ANALYSIS_HISTORY_FILE, "w") as f:
+    # Write-then-rename so streaming readers (export) keep a complete old copy
+    tmp_path = ANALYSIS_HISTORY_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
         json.dump(history_list, f, indent=2)
+    os.replace(tmp_path, ANALYSIS_HISTORY_FILE)
 
-def get_statistics():
-    feedback_list = load_feedback()
+
+def iter_analysis_history(path=ANALYSIS_HISTORY_FILE, chunk_size=64 * 1024, start=0, with_offsets=False):
+    """Yields history entries one by one without loading the whole JSON array.
+
+    start resumes right after a previously yielded entry; with_offsets yields
+    (offset, end, entry) instead. json.dump writes ASCII only, so character
+    offsets are byte offsets and stay valid when later entries are appended.
+    """
+    decoder = json.JSONDecoder()
+    try:
+        f = open(path, "r")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(start)
+        base = start         # file offset of buf[0]
+        buf = f.read(chunk_size)
+        pos = 0
+        eof = not buf
+        opened = start > 0
+        while True:
+            # skip whitespace, the opening bracket and separators between entries
+            while pos < len(buf) and (buf[pos] in " \t\r\n," or (buf[pos] == "[" and not opened)):
+                opened = opened or buf[pos] == "["
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf):
+                try:
+                    entry, end = decoder.raw_decode(buf, pos)
+                    yield (base + pos, base + end, entry) if with_offsets else entry
+                    pos = end
+                    continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            elif eof:
+                return
+            # entry runs past the buffer — drop what's consumed and read more
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            base += pos
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def read_history_entry(offset, path=ANALYSIS_HISTORY_FILE):
+    """The history entry starting at a file offset from iter_analysis_history(with_offsets=True)."""
+    try:
+        for _, _, entry in iter_analysis_history(path, chunk_size=4096, start=offset, with_offsets=True):
+            return entry if isinstance(entry, dict) else None     # offset landed inside another entry
+    except ValueError:           # offset no longer points at an entry (history rewritten)
+        pass
+    return None
+
+# =============================================
+# ANALYSIS HISTORY INDEX
+# =============================================
+# Every test is held in memory once, as a compact column table (records.py,
+# ~60 bytes per test instead of a ~800 byte dict), and kept in step with the
+# history file by reading only the entries appended since the last look.
+# Tests are also partitioned by (user, sample_type) so the trend graph and
+# the "last test" card never scan the whole history. The (user, None)
+# partition holds every test of that user regardless of sample type.
+HISTORY_PARTITION_DEPTH = 50   # newest tests kept per partition
+HISTORY_LOAD_BATCH = 10000     # entries parsed before they are added to the table
+
+history_index_lock = threading.Lock()
+history_index = {
+    "signature": None,   # (mtime_ns, size) of the history file when indexed
+    "count": 0,          # number of tests indexed
+    "records": analysis_table(),
+    "end": 0,            # file offset just past the last loaded test
+    "last": None,        # (offset, analysis_id) of the last loaded test
+    "partitions": {}     # (user, sample_type) -> deque of row numbers, newest last
+}
+
+
+def _file_signature(path):
+    """Cheap change detector for files other workers may rewrite."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _index_entry(partitions, row, entry):
+    user = entry.get("user")
+    sample_type = entry.get("sample_type", "milk")
+    for key in ((user, sample_type), (user, None)):
+        bucket = partitions.get(key)
+        if bucket is None:
+            bucket = partitions[key] = deque(maxlen=HISTORY_PARTITION_DEPTH)
+        bucket.append(row)
+
+
+def build_history_index(history):
+    """Builds the (user, sample_type) partitions for a full history list."""
+    partitions = {}
+    for row, entry in enumerate(history):
+        _index_entry(partitions, row, entry)
+    return partitions
+
+
+def partition_tail(partitions, records, user, sample_type=None, n=9):
+    """Returns the newest n tests of one partition, oldest first."""
+    bucket = partitions.get((user, sample_type))
+    if not bucket:
+        return []
+    return [records[row] for row in list(itertools.islice(reversed(bucket), n))[::-1]]
+
+
+def _load_history_tail(start):
+    """Adds the tests written after file offset start to the table and partitions."""
+    records, partitions = history_index["records"], history_index["partitions"]
+    batch = []
+
+    def flush():
+        first = len(records)
+        records.extend(batch)
+        for i, entry in enumerate(batch):
+            _index_entry(partitions, first + i, entry)
+        batch.clear()
+
+    for offset, end, entry in iter_analysis_history(start=start, with_offsets=True):
+        batch.append(entry)
+        history_index["end"], history_index["last"] = end, (offset, analysis_id(entry))
+        if len(batch) >= HISTORY_LOAD_BATCH:
+            flush()
+    flush()
+
+
+def refresh_history_index():
+    """Loads tests appended to the history file since the last call (or everything, if it was rewritten)."""
+    signature = _file_signature(ANALYSIS_HISTORY_FILE)
+    with history_index_lock:
+        if history_index["signature"] == signature and signature is not None:
+            metrics.inc("pyexpo_cache_total", cache="history_index", result="hit")
+            return
+        metrics.inc("pyexpo_cache_total", cache="history_index", result="miss")
+        last = history_index["last"]
+        if signature is None or (last is not None and analysis_id(read_history_entry(last[0]) or {}) != last[1]):
+            # History was deleted or rewritten, not appended to — start over
+            history_index.update(records=analysis_table(), partitions={}, end=0, last=None)
+        with metrics.timer("pyexpo_stage_seconds", stage="history_load"):
+            _load_history_tail(history_index["end"])
+        history_index["count"] = len(history_index["records"])
+        history_index["signature"] = signature
+
+
+def history_records():
+    """Every test, oldest first, as a RecordTable (index / slice it like the old list)."""
+    refresh_history_index()
+    with history_index_lock:
+        return history_index["records"]
+
+
+def recent_history(user, sample_type=None, n=9):
+    """Newest n tests of a user (optionally of one sample type), oldest first."""
+    refresh_history_index()
+    with history_index_lock:
+        return partition_tail(history_index["partitions"], history_index["records"], user, sample_type, n)
+
+
+def append_analysis(entry):
+    """Appends one test to the history file and keeps the index up to date."""
     history = load_analysis_history()
+    history.append(entry)
+    save_analysis_history(history)
+    refresh_history_index()          # reads back just the new entry
+    sync_changes()                   # numbers it and wakes long-polling dashboards
+
+def get_statistics():
+    review_stats = feedback_store.stats()
+    records = history_records()
+    levels = records.value_counts("level")
     
-    total_analyses = len(history)
-    avg_rating = sum([int(f.get("rating", 5)) for f in feedback_list]) / len(feedback_list) if feedback_list else 0
-    safe_samples = len([h for h in history if h.get("level") == "safe"])
-    danger_samples = len([h for h in history if h.get("level") == "danger"])
+    total_analyses = len(records)
+    safe_samples = levels.get("safe", 0)
+    danger_samples = levels.get("danger", 0)
     
     return {
         "total_analyses": total_analyses,
         "safe_samples": safe_samples,
         "danger_samples": danger_samples,
-        "avg_rating": round(avg_rating, 1),
-        "total_users": len(feedback_list)
+        "avg_rating": review_stats["avg_rating"],
+        "total_users": review_stats["count"]
     }
 
 @app.route("/")
 # @login_required  <-- Removed to make this public
 def home():
+    changes_seq = sync_changes()     # before the snapshot: later tests arrive through /api/changes
     stats = get_statistics()
-    history = load_analysis_history()
-    last_test = history[-1] if history else None
-    return render_template("safety_dashboard.html", stats=stats, last_test=last_test, history=history)
+    history = history_records()
+    last_test = history[-1] if len(history) else None
+    markers, older_markers = map_markers(len(history), DASHBOARD_MARKERS)
+    return render_template("safety_dashboard.html", stats=stats, last_test=last_test, markers=markers,
+                           older_markers=older_markers, changes_seq=changes_seq)
 
 # --- FEATURE 2: DYNAMIC GRAPH GENERATION ---
 # --- FEATURE 2: DYNAMIC GRAPH GENERATION ---
-def generate_graph(history_data, current_detected, current_timestamp, safe_limit, sample_type):
-    """Generates a trend line chart comparing detected levels vs safe limit over time."""
+@metrics.timed("pyexpo_stage_seconds", stage="graph_render")
+def generate_graph(history_data, current_detected, current_timestamp, safe_limit, sample_type, out=None):
+    """Generates a trend line chart comparing detected levels vs safe limit over time.
+    With out (a file object) the PNG is written there instead of static/plots.
+    Draws on its own Figure, never pyplot's global one, so concurrent renders can't mix."""
     # Light theme background
-    plt.figure(figsize=(10, 5), facecolor='#f8f9fa')
+    fig = Figure(figsize=(10, 5), facecolor='#f8f9fa')
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
     
     # Prepare Data
     detected_values = [h.get('detected_level', 0) for h in history_data]
@@ -202,7 +600,7 @@ def generate_graph(history_data, current_detected, current_timestamp, safe_limit
     
     # Plot Safe Limit Line
     # Dark Green for Safe Limit as requested
-    plt.plot(x, [safe_limit] * len(x), label='Safe Limit', color='#2e7d32', linewidth=2.5, marker='o', zorder=5)
+    ax.plot(x, [safe_limit] * len(x), label='Safe Limit', color='#2e7d32', linewidth=2.5, marker='o', zorder=5)
     
     # Determine Status Color of Current Test (for Line Color)
     if current_detected <= safe_limit:
@@ -213,7 +611,7 @@ def generate_graph(history_data, current_detected, current_timestamp, safe_limit
         status_text = "DANGER"
     
     # Plot Trend Line (Color based on CURRENT status to show trend direction)
-    plt.plot(x, detected_values, label=f'Detected Level ({status_text})', 
+    ax.plot(x, detected_values, label=f'Detected Level ({status_text})', 
              color=line_color, linewidth=2.5, zorder=6)
 
     # Plot Individual Points (Color based on THEIR status to show history correctly)
@@ -224,36 +622,40 @@ def generate_graph(history_data, current_detected, current_timestamp, safe_limit
         else:
             point_colors.append('#ef5350') # Red
 
-    plt.scatter(x, detected_values, color=point_colors, s=100, marker='s', zorder=7, edgecolors='white')
+    ax.scatter(x, detected_values, color=point_colors, s=100, marker='s', zorder=7, edgecolors='white')
 
     # Styling
     # Light Theme Graph Styling
-    plt.title('Steroid Level Analysis - Real-Time Trend', fontsize=12, fontweight='bold', color='#333333')
-    plt.ylabel('mg/L', fontsize=10, color='#333333')
-    plt.xlabel('Time (HH:MM)', fontsize=10, color='#333333')
+    ax.set_title('Steroid Level Analysis - Real-Time Trend', fontsize=12, fontweight='bold', color='#333333')
+    ax.set_ylabel('mg/L', fontsize=10, color='#333333')
+    ax.set_xlabel('Time (HH:MM)', fontsize=10, color='#333333')
     
     # Ticks styling
-    plt.xticks(x, timestamps, color='#333333', rotation=45) 
-    plt.yticks(color='#333333')
+    ax.set_xticks(x, timestamps, color='#333333', rotation=45)
+    ax.tick_params(axis='y', labelcolor='#333333')
     
     # Grid styling
-    plt.grid(True, linestyle='--', alpha=0.5, color='#e0e0e0')
+    ax.grid(True, linestyle='--', alpha=0.5, color='#e0e0e0')
     
     # Legend styling
-    legend = plt.legend(loc='upper right', facecolor='white', edgecolor='#cccccc')
-    plt.setp(legend.get_texts(), color='#333333') # Legend text color
+    legend = ax.legend(loc='upper right', facecolor='white', edgecolor='#cccccc')
+    for text in legend.get_texts():
+        text.set_color('#333333') # Legend text color
 
     # Add borders/limits
     max_y = max(max(detected_values), safe_limit)
     if max_y == 0: max_y = 1
-    plt.ylim(0, max_y * 1.4)
+    ax.set_ylim(0, max_y * 1.4)
 
     # Set axes colors
-    ax = plt.gca()
     ax.set_facecolor('#f8f9fa') # Light gray plot area
     for spine in ax.spines.values():
         spine.set_color('#333333') # Dark gray spines
 
+    if out is not None:
+        fig.savefig(out, format='png', bbox_inches='tight', facecolor='#f8f9fa')
+        return None
+
     # Save
     timestamp_file = int(time.time())
     filename = f"plot_{timestamp_file}.png"
@@ -264,12 +666,152 @@ def generate_graph(history_data, current_detected, current_timestamp, safe_limit
     
     # Save with transparent background (or keep light background if preferred)
     # Keeping facecolor from figure for consistency
-    plt.savefig(filepath, bbox_inches='tight', facecolor='#f8f9fa')
-    plt.close()
+    fig.savefig(filepath, bbox_inches='tight', facecolor='#f8f9fa')
     return filename
 # ---------------------------------------------
 
+# =============================================
+# RATE LIMITING & ADMISSION CONTROL
+# =============================================
+# Expensive routes (matplotlib / FPDF / email) draw from two token buckets —
+# per client address and per logged-in user — and need one of a fixed number
+# of render slots shared by all workers while they render. Anything over the
+# limit gets 429 + Retry-After, so cheap JSON endpoints keep their workers.
+# Only work is charged: a view calls charge_request() once its input is valid,
+# and render_slot() (around every matplotlib / FPDF render) charges too, so
+# invalid submissions, replays and cached downloads cost nothing.
+RATE_LIMIT_DB = "ratelimit.sqlite3"
+RATE_CLIENT_PER_MIN  = float(os.environ.get("RATE_LIMIT_CLIENT_PER_MIN", 20))
+RATE_CLIENT_BURST    = float(os.environ.get("RATE_LIMIT_CLIENT_BURST", 5))
+RATE_USER_PER_MIN    = float(os.environ.get("RATE_LIMIT_USER_PER_MIN", 30))
+RATE_USER_BURST      = float(os.environ.get("RATE_LIMIT_USER_BURST", 10))
+RENDER_CONCURRENCY   = int(os.environ.get("RENDER_CONCURRENCY", 0)) or (os.cpu_count() or 1)
+RENDER_QUEUE_S       = float(os.environ.get("RENDER_QUEUE_SECONDS", 2))
+
+rate_buckets = TokenBuckets(RATE_LIMIT_DB)
+render_slots = RenderSlots("ratelimit_slots", RENDER_CONCURRENCY)
+
+
+def _too_many(route, reason, retry_after):
+    metrics.inc("pyexpo_rate_limited_total", route=route, reason=reason)
+    log.info("msg=\"request throttled\" route=%s reason=%s client=%s user=%s retry_after=%.1f",
+             route, reason, request.remote_addr, session.get("user"), retry_after)
+    message = "Too many requests, please retry shortly." if reason != "busy" else \
+        "The server is busy rendering reports, please retry shortly."
+    if request.path.startswith("/api/") or request.accept_mimetypes.best == "application/json":
+        response = jsonify({"error": message, "retry_after": round(retry_after, 1)})
+    else:
+        response = app.response_class(message, mimetype="text/plain")
+    response.status_code = 429
+    response.headers["Retry-After"] = retry_after_header(retry_after)
+    return response
+
+
+class Throttled(Exception):
+    """Over a rate limit or out of render slots; limit_expensive answers 429."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def charge_request():
+    """Takes this request's client and user tokens (once per request)."""
+    if not has_request_context() or g.get("rate_route") is None or g.get("rate_charged"):
+        return
+    g.rate_charged = True
+    allowed, retry = rate_buckets.take(f"client:{request.remote_addr}",
+                                       RATE_CLIENT_PER_MIN / 60, RATE_CLIENT_BURST)
+    if not allowed:
+        raise Throttled("client", retry)
+    user = session.get("user")
+    if user:
+        allowed, retry = rate_buckets.take(f"user:{user}", RATE_USER_PER_MIN / 60, RATE_USER_BURST)
+        if not allowed:
+            raise Throttled("user", retry)
+
+
+@contextmanager
+def render_slot():
+    """Charges the request and holds a shared render slot; a no-op outside limited views."""
+    if not has_request_context() or g.get("rate_route") is None or g.get("render_slot_held"):
+        yield
+        return
+    charge_request()
+    with render_slots.acquire(RENDER_QUEUE_S) as admitted:
+        if not admitted:
+            raise Throttled("busy", RENDER_QUEUE_S or 1)
+        g.render_slot_held = True
+        try:
+            yield
+        finally:
+            g.render_slot_held = False
+
+
+def limit_expensive(route, methods=("GET", "POST")):
+    """Puts charge_request() / render_slot() in force for the view's methods."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if request.method not in methods:
+                return func(*args, **kwargs)
+            g.rate_route = route
+            try:
+                return func(*args, **kwargs)
+            except Throttled as e:
+                return _too_many(route, e.reason, e.retry_after)
+        return wrapper
+    return decorate
+
+
+# =============================================
+# IDEMPOTENT SUBMISSIONS
+# =============================================
+# Forms carry a per-render idempotency key (or clients send an
+# Idempotency-Key header). The first request with a key does the work; repeats
+# within the TTL get the stored result, even from another gunicorn worker.
+IDEMPOTENCY_DIR = "idempotency"
+idempotency = IdempotencyCache(IDEMPOTENCY_DIR, ttl_s=float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 600)))
+
+
+@app.context_processor
+def inject_idempotency_key():
+    return {"new_idempotency_key": lambda: uuid.uuid4().hex}
+
+
+def claim_submission(scope):
+    """Returns ("new", token), ("replay", stored result), ("busy", None) or ("unkeyed", None)."""
+    key = request.headers.get("Idempotency-Key") or request.form.get("idempotency_key")
+    if not key:
+        return "unkeyed", None
+    token = (f"{scope}:{session.get('user')}", key[:128])   # keys never match across users
+    state, stored = idempotency.claim(*token)
+    if state == IDEMPOTENCY_PENDING:
+        stored = idempotency.wait(*token)
+        if stored is None:
+            state, stored = idempotency.claim(*token)    # the original failed: take over
+            if state == IDEMPOTENCY_PENDING:
+                return "busy", None
+    if stored is not None:
+        metrics.inc("pyexpo_idempotent_replays_total", route=scope)
+        return "replay", stored
+    return "new", token
+
+
+def finish_submission(claim, result=None):
+    """Stores the result for repeats, or frees the key when the work failed (result None)."""
+    state, token = claim
+    if state != "new":
+        return
+    if result is None:
+        idempotency.release(*token)
+    else:
+        idempotency.complete(*token, result)
+
+
 @app.route("/detection-testing", methods=["GET", "POST"])
+@limit_expensive("detection", methods=("POST",))
 def detection_testing():
     plot_url = None # Initialize at the absolute top
     result = None
@@ -277,6 +819,13 @@ def detection_testing():
     last_test = None
 
     if request.method == "POST":
+        claim = claim_submission("detection")
+        if claim[0] == "replay":
+            return render_template("detection_testing.html", **claim[1])
+        if claim[0] == "busy":
+            return render_template("detection_testing.html", result=None, last_test=None, plot_url=None,
+                                   warning="⏳ This analysis is still being processed. Please wait a moment."), 409
+        failed = False
         try:
             sample_type = request.form.get("sample_type", "milk")
             sensor_val = float(request.form["sensor"])
@@ -286,6 +835,7 @@ def detection_testing():
 
             # Main Logic (Detection)
             detected_level = round(sensor_val / weight, 2)
+            charge_request()
             safe_limit = SAFE_LIMITS.get(sample_type, 0.05)
 
             # Auto-calculate pH from sensor reading
@@ -320,30 +870,23 @@ def detection_testing():
                 "ph_status": ph_status
             }
             
-            # Prepare History Data for Trend Graph (Filter by Sample Type & User)
-            history = load_analysis_history()
+            # Prepare History Data for Trend Graph (Same sample type AND same user)
             current_user = session.get("user")
             
-            # STRICT Filter history: Same sample type AND Same user (NO LEGACY/SHARED DATA)
-            relevant_history = [
-                h for h in history 
-                if h.get("sample_type", "milk") == sample_type and 
-                h.get("user") == current_user
-            ]
-            
             # Take last 9 records to make graph readable (total 10 points with current)
-            recent_history = relevant_history[-9:]
+            user_history = recent_history(current_user, sample_type, 9)
 
             # Generate Timestamp for current test
             current_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
             # Use Feature 2: Generate Dynamic Graph
-            plot_filename = generate_graph(recent_history, detected_level, current_timestamp, safe_limit, sample_type)
+            with render_slot():
+                plot_filename = generate_graph(user_history, detected_level, current_timestamp, safe_limit, sample_type)
             plot_url = url_for('static', filename=f'plots/{plot_filename}')
             
             # Save History
-            history = load_analysis_history()
             analysis_entry = {
+                "id": uuid.uuid4().hex[:12],
                 "timestamp": current_timestamp,
                 "sample_type": sample_type,
                 "detected_level": detected_level,
@@ -355,44 +898,40 @@ def detection_testing():
                 "latitude": latitude,
                 "longitude": longitude
             }
-            history.append(analysis_entry)
-            save_analysis_history(history)
+            append_analysis(analysis_entry)
             
-            # AUTOMATE PDF GENERATION (so it's ready for email)
+            # AUTOMATE PDF GENERATION (so it's ready for download / email)
             try:
-                public_url = app.config.get('PUBLIC_URL', None)
-                auto_pdf = build_pdf(analysis_entry, session.get('user', 'Guest'), public_url=public_url)
-                report_dir = os.path.join("static", "reports")
-                os.makedirs(report_dir, exist_ok=True)
-                report_path = os.path.join(report_dir, f"report_{int(time.time())}.pdf")
-                auto_pdf.output(report_path)
-                print(f"📄 Auto-generated report: {report_path}")
+                report_path = ensure_report(analysis_entry)
+                log.info("msg=\"auto-generated report\" path=%s", report_path)
             except Exception as e:
-                print(f"⚠️ Failed to auto-generate PDF: {str(e)}")
+                log.warning("msg=\"failed to auto-generate PDF\" error=%r", str(e))
 
             # Update last_test for immediate display after post
             last_test = analysis_entry
 
+        except Throttled:
+            finish_submission(claim)        # nothing was done: the retry may reuse the key
+            raise
         except ValueError:
             warning = "❌ Invalid input. Please enter valid numbers."
         except Exception as e:
             warning = f"❌ Error during analysis: {str(e)}"
+            failed = True
+        finish_submission(claim, None if failed else
+                          {"result": result, "warning": warning, "last_test": last_test, "plot_url": plot_url})
 
     # Get last test result if not just submitted
     if request.method == "GET":
-        history = load_analysis_history()
         current_user = session.get("user")
         
-        # STRICT Filter history: Same logic as POST (NO LEGACY/SHARED DATA)
-        relevant_history = [
-            h for h in history 
-            if h.get("user") == current_user
-        ]
-        
-        last_test = relevant_history[-1] if relevant_history else None
-        # If there's a last test, set its plot_url for display
-        if last_test and "plot_url" in last_test:
-            plot_url = last_test["plot_url"]
+        # STRICT: only this user's own tests (NO LEGACY/SHARED DATA)
+        latest = recent_history(current_user, None, 1)
+        last_test = latest[-1] if latest else None
+        # If there's a last test, set its plot_url for display (unless it was swept)
+        if last_test and last_test.get("plot_url"):
+            if os.path.exists(last_test["plot_url"].lstrip("/")):
+                plot_url = last_test["plot_url"]
         
     return render_template("detection_testing.html", result=result, warning=warning, last_test=last_test, plot_url=plot_url)
 
@@ -402,11 +941,30 @@ def simulation():
 
 
 
+def render_reviews(**context):
+    """One newest-first page of reviews (?before=<id>&rating=1-5&sentiment=...)."""
+    rating = request.args.get("rating", type=int)
+    sentiment = request.args.get("sentiment")
+    if sentiment not in REVIEW_SENTIMENTS:
+        sentiment = None
+    reviews, next_cursor = feedback_store.page(request.args.get("before", type=int), REVIEWS_PER_PAGE,
+                                               rating, sentiment)
+    return render_template("community_reviews.html", feedback_list=reviews, feedback_stats=feedback_store.stats(),
+                           next_cursor=next_cursor, filters={"rating": rating, "sentiment": sentiment},
+                           sentiments=REVIEW_SENTIMENTS, **context)
+
 @app.route("/community-reviews", methods=["GET", "POST"])
 @login_required
+@limit_expensive("review", methods=("POST",))
 def community_reviews():
     if request.method == "POST":
+        claim = claim_submission("review")
+        if claim[0] == "replay":
+            return render_reviews(**claim[1])
+        if claim[0] == "busy":
+            return render_reviews(error_message="Your review is still being submitted. Please wait a moment."), 409
         try:
+            charge_request()
             user_feedback = {
                 "name": request.form.get("name", "Anonymous"),
                 "email": request.form.get("email", ""),
@@ -417,8 +975,8 @@ def community_reviews():
             
             # --- AI SENTIMENT ANALYSIS ---
             if user_feedback["message"]:
-                blob = TextBlob(user_feedback["message"])
-                polarity = blob.sentiment.polarity
+                with metrics.timer("pyexpo_stage_seconds", stage="sentiment"):
+                    polarity = TextBlob(user_feedback["message"]).sentiment.polarity
                 if polarity > 0.1:
                     user_feedback["sentiment"] = "Positive"
                 elif polarity < -0.1:
@@ -429,40 +987,37 @@ def community_reviews():
                 user_feedback["sentiment"] = "Neutral"
             # -----------------------------
             
-            feedback_list = load_feedback()
-            feedback_list.insert(0, user_feedback) # Add to top
-            save_feedback(feedback_list)
+            feedback_store.append(user_feedback)
+            sync_changes()
             
             # Send Email Notification with Attachment
             if user_feedback.get("email"):
                 # Retrieve latest report path from history if available
-                history = load_analysis_history()
+                history = history_records()
                 attachment_path = None
-                if history:
+                if len(history):
                     last_entry = history[-1]
                     # Generate a clean PDF for the email without background image or QR code
                     public_url = app.config.get('PUBLIC_URL', None)
-                    email_pdf = build_pdf(last_entry, last_entry.get('user', 'Guest'), public_url=public_url, is_email=True)
-                    report_dir = os.path.join("static", "reports")
-                    os.makedirs(report_dir, exist_ok=True)
-                    attachment_path = os.path.join(report_dir, f"email_report_{int(time.time())}.pdf")
-                    email_pdf.output(attachment_path)
+                    with render_slot(), metrics.timer("pyexpo_stage_seconds", stage="pdf_build"):
+                        email_pdf = build_pdf(last_entry, last_entry.get('user', 'Guest'), public_url=public_url, is_email=True)
+                        os.makedirs(REPORT_DIR, exist_ok=True)
+                        attachment_path = os.path.join(REPORT_DIR, f"email_report_{int(time.time())}.pdf")
+                        email_pdf.output(attachment_path)
                 
                 send_email(user_feedback["email"], user_feedback["name"], user_feedback["rating"], user_feedback["message"], attachment_path)
 
             success_message = "Thank you for your feedback!"
-            feedback_list = load_feedback()
-            return render_template("community_reviews.html", success_message=success_message, feedback_list=feedback_list)
+            finish_submission(claim, {"success_message": success_message})
+            return render_reviews(success_message=success_message)
+        except Throttled:
+            finish_submission(claim)
+            raise
         except Exception as e:
-            error_message = f"Error saving feedback: {str(e)}"
-            try:
-                feedback_list = load_feedback()
-            except Exception:
-                feedback_list = []
-            return render_template("community_reviews.html", error_message=error_message, feedback_list=feedback_list)
+            finish_submission(claim)
+            return render_reviews(error_message=f"Error saving feedback: {str(e)}")
     
-    feedback_list = load_feedback()
-    return render_template("community_reviews.html", feedback_list=feedback_list)
+    return render_reviews()
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -503,169 +1058,281 @@ def logout():
 # =============================================
 # SHARED PDF BUILDER HELPER
 # =============================================
-PDF_BG_PATH = os.path.join("static", "pdf_bg.png")
-
-def build_pdf(last_test, user, public_url=None, is_email=False):
-    """Build a styled PDF report with background image and QR code."""
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=False, margin=0)
-    pdf.add_page()
-
-    if not is_email:
-        # --- Background Image ---
-        if os.path.exists(PDF_BG_PATH):
-            # Full A4 page is 210x297mm
-            pdf.image(PDF_BG_PATH, x=0, y=0, w=210, h=297)
-
-        # --- QR Code (bottom-right corner) ---
-        if QRCODE_AVAILABLE:
-            try:
-                qr_url = public_url if public_url else f"http://{socket.gethostbyname(socket.gethostname())}:5000"
-                qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=4, border=2)
-                qr.add_data(qr_url)
-                qr.make(fit=True)
-                from PIL import Image as PILImage
-                qr_img = qr.make_image(fill_color="#1a3a5c", back_color="white")
-                qr_tmp = os.path.join("static", "reports", "_tmp_qr.png")
-                os.makedirs(os.path.dirname(qr_tmp), exist_ok=True)
-                qr_img.save(qr_tmp)
-                # Place QR bottom-right: x=155, y=250, size=40x40mm
-                pdf.image(qr_tmp, x=155, y=252, w=40, h=40)
-                # Label under QR
-                pdf.set_xy(148, 294)
-                pdf.set_font("Arial", "", 6)
-                pdf.set_text_color(60, 90, 120)
-                pdf.cell(55, 3, "Scan to open the live app", align='C')
-            except Exception as e:
-                print(f"⚠️ QR generation failed: {e}")
-
-    # --- Header ---
-    pdf.set_xy(10, 12)
-    pdf.set_font("Arial", "B", 18)
-    pdf.set_text_color(20, 60, 100)
-    pdf.cell(190, 10, "PureCheck and Quality Analysis", ln=True, align='C')
-    pdf.set_font("Arial", "I", 11)
-    pdf.set_text_color(60, 90, 120)
-    pdf.cell(190, 7, "Official Analysis Report", ln=True, align='C')
-
-    # Divider line
-    pdf.set_draw_color(30, 80, 140)
-    pdf.set_line_width(0.7)
-    pdf.line(15, 32, 195, 32)
-    pdf.ln(10)
-
-    # --- User Info Box ---
-    pdf.set_fill_color(220, 235, 250)
-    pdf.set_draw_color(180, 210, 240)
-    pdf.set_line_width(0.3)
-    pdf.rect(15, 38, 180, 22, 'FD')
-    pdf.set_xy(18, 41)
-    pdf.set_font("Arial", "B", 11)
-    pdf.set_text_color(20, 60, 100)
-    pdf.cell(85, 7, f"User: {user}", ln=False)
-    pdf.set_font("Arial", "", 11)
-    pdf.cell(85, 7, f"Date: {last_test.get('timestamp', 'N/A')}", ln=True)
-    pdf.set_xy(18, 50)
-    pdf.set_font("Arial", "", 10)
-    pdf.set_text_color(60, 90, 120)
-    pdf.cell(180, 6, f"Sample Type: {last_test.get('sample_type', 'N/A').title()}", ln=True)
-    pdf.ln(8)
-
-    # --- Results Section ---
-    pdf.set_xy(15, 68)
-    pdf.set_font("Arial", "B", 13)
-    pdf.set_text_color(20, 60, 100)
-    pdf.cell(180, 8, "Analysis Results", ln=True)
-    pdf.set_line_width(0.3)
-    pdf.line(15, 77, 195, 77)
-    pdf.ln(3)
-
-    # Detected Level
-    pdf.set_font("Arial", "", 12)
-    pdf.set_text_color(50, 50, 80)
-    pdf.cell(90, 9, f"Detected Steroid Level:", ln=False)
-    pdf.set_font("Arial", "B", 12)
-    pdf.set_text_color(20, 60, 100)
-    pdf.cell(90, 9, f"{last_test.get('detected_level', 'N/A')} mg/L", ln=True)
-
-    # pH Value
-    pdf.set_font("Arial", "", 12)
-    pdf.set_text_color(50, 50, 80)
-    ph_val = last_test.get('ph_value', 'N/A')
-    ph_status = last_test.get('ph_status', '').title()
-    pdf.cell(90, 9, f"pH Value:", ln=False)
-    pdf.set_font("Arial", "B", 12)
-    pdf.set_text_color(20, 60, 100)
-    pdf.cell(90, 9, f"{ph_val} ({ph_status})", ln=True)
-
-    # Location
-    pdf.set_font("Arial", "", 12)
-    pdf.set_text_color(50, 50, 80)
-    pdf.cell(90, 9, f"Test Location:", ln=False)
-    pdf.set_font("Arial", "B", 10)
-    pdf.set_text_color(20, 60, 100)
-    lat = last_test.get('latitude')
-    lng = last_test.get('longitude')
-    loc_str = "KGiSL Institute of Technology" if lat and lng else "Not Captured"
-    pdf.cell(90, 9, loc_str, ln=True)
-
-    # Safety Status (colored badge)
-    status = last_test.get('level', 'unknown').upper()
-    pdf.ln(4)
-    if status == 'SAFE':
-        pdf.set_fill_color(46, 125, 50)
-    elif status == 'DANGER':
-        pdf.set_fill_color(198, 40, 40)
-    else:
-        pdf.set_fill_color(249, 168, 37)
-    pdf.set_text_color(255, 255, 255)
-    pdf.set_font("Arial", "B", 13)
-    pdf.set_x(15)
-    pdf.cell(80, 11, f"  Safety Status: {status}", fill=True, ln=True)
-    pdf.ln(12)
-
-    # --- Safe Limit Reference ---
-    pdf.set_text_color(50, 50, 80)
-    pdf.set_font("Arial", "", 10)
-    safe_limit = last_test.get('safe_dose', 0.05)
-    pdf.set_x(15)
-    pdf.cell(180, 7, f"Regulatory Safe Limit: {safe_limit} mg/kg  |  WHO Standard Reference", ln=True)
-    pdf.ln(8)
-
-    # Divider
-    pdf.set_draw_color(180, 210, 240)
-    pdf.set_line_width(0.3)
-    pdf.line(15, pdf.get_y(), 195, pdf.get_y())
-    pdf.ln(8)
-
-    # --- Footer ---
-    pdf.set_xy(10, 282)
-    pdf.set_font("Courier", "", 8)
-    pdf.set_text_color(100, 130, 160)
-    pdf.cell(135, 5, "[ Automatically generated by the AI Safety System ]", align='L')
-
-    return pdf
+# Page layout lives in pdf_report.py so bulk-report worker processes can use
+# it without importing the app.
+from pdf_report import build_pdf, render_trend_chart, build_summary_pdf
+
+# =============================================
+# REPORT INDEX
+# =============================================
+# Each analysis gets exactly one rendered PDF. The index maps
+# analysis id -> {"user", "path", "created"} so repeat downloads are served
+# from disk instead of being rebuilt.
+report_index_lock = threading.Lock()
+report_index = {"signature": None, "reports": {}}
+
+
+def analysis_id(entry):
+    """Stable id of a test; older entries without an "id" get a derived one."""
+    if entry.get("id"):
+        return entry["id"]
+    key = f"{entry.get('timestamp')}|{entry.get('user')}|{entry.get('sample_type')}|{entry.get('detected_level')}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def _load_report_index():
+    """Returns the report index, re-reading it only if another worker changed it."""
+    signature = _file_signature(REPORT_INDEX_FILE)
+    with report_index_lock:
+        if signature is None or signature == report_index["signature"]:
+            return report_index["reports"]
+    try:
+        with open(REPORT_INDEX_FILE, "r") as f:
+            reports = json.load(f)
+    except (OSError, ValueError):
+        reports = {}
+    with report_index_lock:
+        report_index["reports"] = reports
+        report_index["signature"] = signature
+    return reports
+
+
+def lookup_report(aid):
+    """Returns the index record of a report whose PDF still exists on disk."""
+    record = _load_report_index().get(aid)
+    if record and os.path.exists(record["path"]):
+        return record
+    return None
+
+
+def register_report(aid, user, path):
+    register_reports([(aid, user, path)])
+
+
+def register_reports(records):
+    """Adds [(aid, user, path)] to the index with a single rewrite."""
+    _load_report_index()
+    with report_index_lock:
+        now = time.time()
+        for aid, user, path in records:
+            report_index["reports"][aid] = {"user": user, "path": path, "created": now}
+        tmp_path = REPORT_INDEX_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report_index["reports"], f)
+        os.replace(tmp_path, REPORT_INDEX_FILE)
+        report_index["signature"] = _file_signature(REPORT_INDEX_FILE)
+
+
+def ensure_report(entry):
+    """Returns the PDF path of a test, rendering and indexing it only once."""
+    aid = analysis_id(entry)
+    record = lookup_report(aid)
+    if record:
+        metrics.inc("pyexpo_cache_total", cache="report", result="hit")
+        return record["path"]
+    metrics.inc("pyexpo_cache_total", cache="report", result="miss")
+
+    user = entry.get("user")
+    public_url = app.config.get('PUBLIC_URL', None)
+    path = os.path.join(REPORT_DIR, f"report_{aid}.pdf")
+    with render_slot(), metrics.timer("pyexpo_stage_seconds", stage="pdf_build"):
+        pdf = build_pdf(entry, user or 'Guest', public_url=public_url)
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        pdf.output(path)
+    register_report(aid, user, path)
+    return path
+
+
+def _send_report(path):
+    # conditional=True gives ETag / Last-Modified / Range handling for free
+    response = send_file(os.path.abspath(path), as_attachment=True, conditional=True,
+                         etag=True, max_age=3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
+def forget_reports(paths):
+    """Drops index records whose PDFs were swept; they re-render on demand."""
+    gone = set(os.path.abspath(p) for p in paths)
+    reports = _load_report_index()
+    with report_index_lock:
+        stale = [aid for aid, rec in reports.items() if os.path.abspath(rec["path"]) in gone]
+        if not stale:
+            return
+        for aid in stale:
+            reports.pop(aid, None)
+        tmp_path = REPORT_INDEX_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(reports, f)
+        os.replace(tmp_path, REPORT_INDEX_FILE)
+        report_index["signature"] = _file_signature(REPORT_INDEX_FILE)
+
+
+# =============================================
+# ARTIFACT RETENTION (plots + reports)
+# =============================================
+# Limits apply per directory; any of them may be disabled with 0.
+# On Render the disk is ephemeral, so the defaults are deliberately small.
+def _env_limit(name, default, scale=1):
+    value = float(os.environ.get(name, default))
+    return value * scale if value > 0 else None
+
+ARTIFACT_MAX_AGE_S    = _env_limit("ARTIFACT_MAX_AGE_HOURS", 72, 3600)
+ARTIFACT_MAX_COUNT    = _env_limit("ARTIFACT_MAX_COUNT", 500)
+ARTIFACT_MAX_BYTES    = _env_limit("ARTIFACT_MAX_MB", 200, 1024 * 1024)
+ARTIFACT_SWEEP_S      = float(os.environ.get("ARTIFACT_SWEEP_SECONDS", 600))
+ARTIFACT_MIN_AGE_S    = float(os.environ.get("ARTIFACT_MIN_AGE_SECONDS", 300))
+ARTIFACT_STATS_FILE   = os.path.join(METRICS_DIR, "artifacts.json")
+ARTIFACT_ARCHIVE_DIR  = os.path.join("archive", "reports") if os.environ.get("ARTIFACT_ARCHIVE", "0") == "1" else None
+ARTIFACT_ARCHIVE_MAX_BYTES = _env_limit("ARTIFACT_ARCHIVE_MAX_MB", 500, 1024 * 1024)
+
+artifacts = ArtifactManager(
+    {
+        "plots":   (os.path.join("static", "plots"), ["plot_*.png"]),
+        "reports": (REPORT_DIR, ["report_*.pdf", "email_report_*.pdf", "summary_*.pdf", "summary_chart_*.png"]),
+        "bulk":    (BULK_REPORT_DIR, ["*.zip", "*.pdf", "*.json"]),
+    },
+    max_age_s=ARTIFACT_MAX_AGE_S,
+    max_count=ARTIFACT_MAX_COUNT,
+    max_bytes=ARTIFACT_MAX_BYTES,
+    archive_dir=ARTIFACT_ARCHIVE_DIR,
+    archive_patterns=["report_*.pdf"],
+    archive_max_bytes=ARTIFACT_ARCHIVE_MAX_BYTES,
+    on_sweep=forget_reports,
+    min_age_s=ARTIFACT_MIN_AGE_S,
+    stats_path=ARTIFACT_STATS_FILE,
+    protect=lambda: bulk_reports.protected(BULK_REPORT_KEEP_S),
+)
+
+
+@app.route("/api/artifact-stats")
+def api_artifact_stats():
+    """Disk usage of generated plots/reports as of the last sweep."""
+    return jsonify(artifacts.stats())
+
 
 # --- FEATURE 3: PDF REPORT GENERATION ---
 @app.route("/download_report")
 @login_required
+@limit_expensive("download_report")
 def download_report():
-    history = load_analysis_history()
-    if not history:
+    """Serves the requesting user's most recent report."""
+    latest = recent_history(session.get("user"), None, 1)
+    if not latest:
         return "No analysis data found.", 404
-        
-    last_test = history[-1]
-    
-    # Build styled PDF using shared helper
-    public_url = app.config.get('PUBLIC_URL', None)
-    pdf = build_pdf(last_test, session.get('user', 'Guest'), public_url=public_url)
+    try:
+        return _send_report(ensure_report(latest[-1]))
+    except FileNotFoundError:           # swept between lookup and send: render it again
+        return _send_report(ensure_report(latest[-1]))
+
 
-    filename = f"report_{int(time.time())}.pdf"
-    filepath = os.path.join("static", "reports", filename)
-    os.makedirs(os.path.join("static", "reports"), exist_ok=True)
-    pdf.output(filepath)
+@app.route("/reports/<report_id>")
+@login_required
+@limit_expensive("report")
+def serve_report(report_id):
+    """Streams an already rendered report; only its owner may fetch it."""
+    current_user = session.get("user")
+    record = lookup_report(report_id)
+    if record:
+        if record["user"] != current_user:
+            return "Report not found.", 404
+        try:
+            return _send_report(record["path"])
+        except FileNotFoundError:
+            pass                        # swept since the lookup: rebuild it below
+
+    # PDF missing (never rendered or swept) — rebuild it if the test is the user's
+    for entry in recent_history(current_user, None, HISTORY_PARTITION_DEPTH):
+        if analysis_id(entry) == report_id:
+            return _send_report(ensure_report(entry))
+    return "Report not found.", 404
+
+
+# --- Bulk reports (auditors: every test in a period) ---
+# A zip job keeps one PDF per test in REPORT_DIR, so a job may not ask for
+# more than the artifact limits retain (~400 KB per single-test report).
+BULK_REPORT_EST_BYTES = 400 * 1024
+BULK_REPORT_MAX_TESTS = max(1, int(min(float(os.environ.get("BULK_REPORT_MAX_TESTS", 5000)),
+                                       ARTIFACT_MAX_COUNT or math.inf,
+                                       (ARTIFACT_MAX_BYTES or math.inf) // BULK_REPORT_EST_BYTES)))
+BULK_REPORT_KEEP_S = float(os.environ.get("BULK_REPORT_KEEP_HOURS", 24)) * 3600   # undownloaded outputs survive sweeps this long
+
+bulk_reports = BulkReports(
+    BULK_REPORT_DIR,
+    workers=int(os.environ.get("BULK_REPORT_WORKERS", 0)) or None,
+    on_rendered=register_reports,
+)
 
-    return send_file(filepath, as_attachment=True)
+
+def _bulk_job_payload(job):
+    payload = {k: v for k, v in job.items() if k not in ("owner", "output")}
+    payload["progress"] = round(job["done"] / job["total"], 3) if job["total"] else 1.0
+    payload["status_url"] = url_for("api_bulk_report_status", job_id=job["id"])
+    if job["status"] == "done":
+        payload["download_url"] = url_for("api_bulk_report_download", job_id=job["id"])
+    return payload
+
+
+@app.route("/api/reports/bulk", methods=["POST"])
+@login_required
+@limit_expensive("bulk_report")
+def api_bulk_report():
+    """Starts a bulk report job for the tests matching the export filters (?format=zip|pdf)."""
+    args = request.get_json(silent=True) or request.values
+    fmt = str(args.get("format", "zip")).lower()
+    if fmt not in ("zip", "pdf"):
+        return jsonify({"error": "format must be zip or pdf"}), 400
+    try:
+        filters = {
+            "user":        args.get("user"),
+            "sample_type": args.get("sample_type"),
+            "level":       args.get("level"),
+            "start":       _export_bound(args.get("start")),
+            "end":         _export_bound(args.get("end"), end=True),
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e} (use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS)"}), 400
+
+    items = []
+    for entry in export_rows(filters):
+        if len(items) >= BULK_REPORT_MAX_TESTS:
+            return jsonify({"error": f"More than {BULK_REPORT_MAX_TESTS} tests match; narrow the filter"}), 400
+        aid = entry["id"]
+        record = lookup_report(aid) if fmt == "zip" else None
+        items.append((aid, entry, record["path"] if record else None,
+                      os.path.join(REPORT_DIR, f"report_{aid}.pdf")))
+    if not items:
+        return jsonify({"error": "No tests match the filter"}), 404
+
+    charge_request()                    # rendering happens in the pool, outside the render slots
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    job = bulk_reports.submit(items, fmt, session.get("user"), app.config.get("PUBLIC_URL"),
+                              {k: v for k, v in filters.items() if v})
+    log.info("msg=\"bulk report queued\" job=%s format=%s tests=%d", job["id"], fmt, len(items))
+    return jsonify(_bulk_job_payload(job)), 202
+
+
+@app.route("/api/reports/bulk/<job_id>")
+@login_required
+def api_bulk_report_status(job_id):
+    job = bulk_reports.load(job_id)
+    if not job or job["owner"] != session.get("user"):
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_bulk_job_payload(job))
+
+
+@app.route("/api/reports/bulk/<job_id>/download")
+@login_required
+def api_bulk_report_download(job_id):
+    job = bulk_reports.load(job_id)
+    if not job or job["owner"] != session.get("user"):
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "done" or not job["output"] or not os.path.exists(job["output"]):
+        return jsonify(_bulk_job_payload(job)), 409
+    response = _send_report(job["output"])
+    bulk_reports.mark_downloaded(job)
+    return response
 # ---------------------------------------------
 
 
@@ -685,19 +1352,51 @@ hw = {
 }
 
 
+# Listeners get a hardware snapshot whenever a reading arrives or the
+# connection state changes (used by the async realtime server).
+hw_listeners = []
+
+
+def add_hw_listener(fn):
+    hw_listeners.append(fn)
+
+
+def hw_snapshot():
+    """Consistent copy of the fields the realtime endpoints read."""
+    with hw_lock:
+        return {
+            "connected":   hw["connected"],
+            "port":        hw["port"],
+            "error":       hw["error"],
+            "data":        hw["data"],
+            "last_update": hw["last_update"],
+        }
+
+
+def _notify_hw_listeners():
+    if not hw_listeners:
+        return
+    snapshot = hw_snapshot()
+    for fn in hw_listeners:
+        try:
+            fn(snapshot)
+        except Exception as e:
+            log.warning("msg=\"hw listener failed\" error=%r", str(e))
+
+
 def serial_reader_thread():
     """Background thread: continuously reads JSON lines from Arduino over serial."""
     with hw_lock:
         port = hw["port"]
         baud = hw["baud"]
 
-    print(f"🔌 Serial thread starting on {port} @ {baud} baud...")
+    log.info("msg=\"serial thread starting\" port=%s baud=%s", port, baud)
     try:
         ser = serial.Serial(port, baud, timeout=2)
         with hw_lock:
             hw["serial_obj"] = ser
             hw["error"] = None
-        print(f"✅ Arduino connected on {port}")
+        log.info("msg=\"arduino connected\" port=%s", port)
 
         while True:
             with hw_lock:
@@ -712,65 +1411,606 @@ def serial_reader_thread():
                     continue
                 # Only process lines that look like JSON
                 if line.startswith("{"):
+                    t0 = time.perf_counter()
                     parsed = json.loads(line)
                     parsed["timestamp"] = datetime.now().strftime("%H:%M:%S")
+                    metrics.observe("pyexpo_stage_seconds", time.perf_counter() - t0, stage="serial_parse")
+                    metrics.inc("pyexpo_serial_lines_total", result="parsed")
                     with hw_lock:
                         hw["data"] = parsed
                         hw["last_update"] = time.time()
+                    _notify_hw_listeners()
+                else:
+                    metrics.inc("pyexpo_serial_lines_total", result="ignored")
             except json.JSONDecodeError:
-                pass   # Skip malformed lines
+                metrics.inc("pyexpo_serial_lines_total", result="malformed")   # Skip malformed lines
             except Exception as e:
                 with hw_lock:
                     hw["error"] = str(e)
                     hw["connected"] = False
-                print(f"❌ Serial read error: {e}")
+                _notify_hw_listeners()
+                log.error("msg=\"serial read error\" port=%s error=%r", port, str(e))
                 break
 
         ser.close()
-        print(f"🔌 Serial port {port} closed.")
+        log.info("msg=\"serial port closed\" port=%s", port)
     except Exception as e:
         with hw_lock:
             hw["connected"] = False
             hw["error"] = f"Cannot open {port}: {str(e)}"
-        print(f"❌ Cannot open serial port {port}: {e}")
+        log.error("msg=\"cannot open serial port\" port=%s error=%r", port, str(e))
+
+
+def start_serial_reader(port, baud=115200):
+    """Opens port and starts serial_reader_thread (real device, or a pty in sensor_replay.py)."""
+    if not SERIAL_AVAILABLE:
+        raise RuntimeError("pyserial not installed")
+    with hw_lock:
+        if hw["thread"] is not None and hw["thread"].is_alive():
+            raise RuntimeError(f"serial reader already running on {hw['port']}")
+        hw["port"]        = port
+        hw["baud"]        = baud
+        hw["connected"]   = True
+        hw["error"]       = None
+        hw["data"]        = None
+        hw["last_update"] = None
+        hw["thread"] = threading.Thread(target=serial_reader_thread, name="serial-reader", daemon=True)
+        hw["thread"].start()
+    return hw["thread"]
+
+
+def stop_serial_reader(timeout=5.0):
+    """Signals the reader thread to stop and waits for it to close the port."""
+    with hw_lock:
+        hw["connected"] = False
+        thread = hw["thread"]
+        hw["thread"] = None
+    if thread is not None:
+        thread.join(timeout)
+    _notify_hw_listeners()
+
+
+# =============================================
+# SENSOR STREAM PERSISTENCE (columnar, per device)
+# =============================================
+# Every parsed reading is appended to sensor_data/<port>/ as float32 columns;
+# see sensor_store.py for the on-disk layout. Only the worker that owns the
+# serial thread writes, any worker can serve range queries.
+SENSOR_DATA_DIR = os.environ.get("SENSOR_DATA_DIR", "sensor_data")
+SENSOR_COMPRESS_AFTER_S = _env_limit("SENSOR_COMPRESS_AFTER_HOURS", 24, 3600)
+SENSOR_MAINTAIN_S = ARTIFACT_SWEEP_S if ARTIFACT_SWEEP_S > 0 else 600
+
+sensor_store = SensorStore(SENSOR_DATA_DIR, compress_after_s=SENSOR_COMPRESS_AFTER_S)
+_sensor_last_recorded = {}
+
+
+def record_sensor_reading(snapshot):
+    """hw listener: stores each new hardware reading once."""
+    data = snapshot["data"]
+    if not data or snapshot["last_update"] is None:
+        return
+    device = snapshot["port"] or "unknown"
+    if _sensor_last_recorded.get(device) == snapshot["last_update"]:
+        return              # connect/disconnect notifications repeat the last reading
+    _sensor_last_recorded[device] = snapshot["last_update"]
+    sensor_store.start(SENSOR_MAINTAIN_S, maintain=False)    # this worker flushes what it buffers
+    with metrics.timer("pyexpo_stage_seconds", stage="sensor_store_append"):
+        sensor_store.append(device, snapshot["last_update"], data)
+
+
+add_hw_listener(record_sensor_reading)
+atexit.register(sensor_store.stop)
+
+
+def downsample(columns, max_points):
+    """Averages rows into at most max_points buckets (NaN-aware)."""
+    n = len(columns["time"])
+    if n <= max_points:
+        return columns
+    edges = np.linspace(0, n, max_points + 1).astype(np.int64)[:-1]
+    out = {}
+    for k, v in columns.items():
+        v = np.asarray(v, dtype=np.float64)
+        valid = ~np.isnan(v)
+        sums = np.add.reduceat(np.where(valid, v, 0.0), edges)
+        counts = np.add.reduceat(valid.astype(np.int64), edges)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[k] = sums / counts
+    return out
+
+
+@app.route("/api/sensor-history")
+@login_required
+def api_sensor_history():
+    """Stored sensor readings for one device between ?start= and ?end= (epoch seconds)."""
+    devices = sensor_store.devices()
+    device = request.args.get("device") or (device_key(hw_snapshot()["port"]) if hw_snapshot()["port"] else None) \
+        or (devices[0] if devices else None)
+    if device is None:
+        return jsonify({"devices": [], "error": "No sensor data recorded yet"}), 404
+    try:
+        end = float(request.args.get("end", time.time()))
+        start = float(request.args.get("start", end - 3600))
+        max_points = max(1, min(int(request.args.get("max_points", 500)), 10000))
+    except ValueError:
+        return jsonify({"error": "start, end and max_points must be numbers"}), 400
+    channels = [c for c in request.args.get("channels", ",".join(SENSOR_CHANNELS)).split(",") if c]
+    unknown = [c for c in channels if c not in SENSOR_CHANNELS]
+    if unknown:
+        return jsonify({"error": f"Unknown channel(s): {', '.join(unknown)}"}), 400
+
+    with metrics.timer("pyexpo_stage_seconds", stage="sensor_store_read"):
+        columns = sensor_store.read_range(device, start, end, channels)
+    rows = len(columns["time"])
+    columns = downsample(columns, max_points)
+    return jsonify({
+        "device": device_key(device),
+        "devices": devices,
+        "start": start,
+        "end": end,
+        "rows": rows,
+        "points": len(columns["time"]),
+        "series": {k: [None if math.isnan(x) else round(float(x), 4) for x in v] for k, v in columns.items()},
+    })
+
+
+@app.route("/api/sensor-store-stats")
+def api_sensor_store_stats():
+    """Segments and bytes on disk per recorded device."""
+    return jsonify(sensor_store.stats())
+
+
+# =============================================
+# TREND ROLLUPS (1m / 1h / 1d)
+# =============================================
+# Tests and stored sensor readings are folded into bucket tables in the
+# background (see rollups.py); /api/trends serves long ranges from them.
+ROLLUP_FILE = "rollups.sqlite3"
+ROLLUP_INTERVAL_S = float(os.environ.get("ROLLUP_INTERVAL_SECONDS", 60))
+
+rollups = Rollups(ROLLUP_FILE, SAFE_LIMITS, channel_limits={"sensor": SAFE_LIMITS["milk"]},
+                  test_check=lambda entry: check_of(analysis_id(entry)))
+
+
+def _history_count():
+    return len(history_records())
+
+
+def update_rollups():
+    """Folds new tests and sensor rows into the rollups now."""
+    with metrics.timer("pyexpo_stage_seconds", stage="rollup_update"):
+        return rollups.update(history_records, sensor_store, _history_count())
+
+
+
+@app.route("/api/trends")
+@login_required
+def api_trends():
+    """Bucketed trend for ?sample_type= (tests) or ?device=&channel= (sensor) over a time range."""
+    current_user = session.get("user")
+    try:
+        end = float(request.args.get("end", time.time()))
+        start = float(request.args.get("start", end - 7 * 86400))
+        max_points = max(1, min(int(request.args.get("max_points", 500)), 5000))
+    except ValueError:
+        return jsonify({"error": "start, end and max_points must be numbers"}), 400
+    if not (math.isfinite(start) and math.isfinite(end)):
+        return jsonify({"error": "start and end must be finite"}), 400
+    if end <= start:
+        return jsonify({"error": "end must be after start"}), 400
+
+    if request.args.get("channel"):
+        channel = request.args["channel"]
+        if channel not in SENSOR_CHANNELS:
+            return jsonify({"error": f"Unknown channel: {channel}"}), 400
+        devices = sensor_store.devices()
+        device = device_key(request.args.get("device") or (devices[0] if devices else "unknown"))
+        series = f"sensor:{device}:{channel}"
+    else:
+        sample_type = request.args.get("sample_type", "milk")
+        # scope=all aggregates every user's tests; default is the caller's own
+        series = f"tests:{sample_type}" if request.args.get("scope") == "all" \
+            else f"tests:{sample_type}:{current_user}"
+
+    if request.args.get("refresh") == "1":
+        update_rollups()
+    with metrics.timer("pyexpo_stage_seconds", stage="rollup_query"):
+        result = rollups.query(series, start, end, max_points)
+    result.update({"start": start, "end": end})
+    return jsonify(result)
+
+
+# =============================================
+# SUMMARY REPORT (from rollups, never raw history)
+# =============================================
+SUMMARY_REPORT_BUDGET_MS = float(os.environ.get("SUMMARY_REPORT_BUDGET_MS", 1500))
+SUMMARY_MAX_POINTS = 120       # buckets per chart panel; a year resolves to daily rows
+SUMMARY_MAX_DAYS = 3650        # ?days= is clamped to 1..this
+SUMMARY_SAMPLE_TYPES = [k for k in SAFE_LIMITS if k != "default"]
+
+
+def summary_data(user, start, end, scope_all=False):
+    """Per-sample-type aggregates and trend points for a user (or everyone)."""
+    overview, trends = [], []
+    resolution = bucket_seconds = None
+    for sample_type in SUMMARY_SAMPLE_TYPES:
+        series = f"tests:{sample_type}" if scope_all else f"tests:{sample_type}:{user}"
+        result = rollups.query(series, start, end, SUMMARY_MAX_POINTS)
+        points = result["points"]
+        resolution, bucket_seconds = result["resolution"], result["bucket_seconds"]
+        count = sum(p["count"] for p in points)
+        overview.append({
+            "sample_type": sample_type,
+            "count": count,
+            "mean": round(sum(p["mean"] * p["count"] for p in points) / count, 4) if count else "-",
+            "min": min(p["min"] for p in points) if count else "-",
+            "max": max(p["max"] for p in points) if count else "-",
+            "over_limit_pct": round(100 * sum(p["over_limit_share"] * p["count"] for p in points) / count, 1)
+                              if count else 0,
+        })
+        trends.append({"sample_type": sample_type, "safe_limit": SAFE_LIMITS[sample_type], "points": points})
+    return {
+        "scope_label": "All users" if scope_all else f"User {user or 'Guest'}",
+        "start": start,
+        "end": end,
+        "range_label": f"{datetime.fromtimestamp(start):%Y-%m-%d} to {datetime.fromtimestamp(end):%Y-%m-%d}",
+        "resolution": resolution,
+        "bucket_seconds": bucket_seconds,
+        "total_tests": sum(row["count"] for row in overview),
+        "overview": overview,
+        "trends": trends,
+    }
+
+
+def ensure_summary_report(summary):
+    """Renders the summary PDF once per distinct data set; returns its path."""
+    # ?days=N ends "now", so the exact bounds differ on every request; within one
+    # bucket they select the same points, and only the points decide the report
+    width = summary["bucket_seconds"] or 86400
+    keyed = dict(summary, start=summary["start"] // width, end=summary["end"] // width)
+    key = hashlib.sha1(json.dumps(keyed, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(REPORT_DIR, f"summary_{key}.pdf")
+    if os.path.exists(path):
+        metrics.inc("pyexpo_cache_total", cache="summary_report", result="hit")
+        return path
+    metrics.inc("pyexpo_cache_total", cache="summary_report", result="miss")
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    chart_path = os.path.join(REPORT_DIR, f"summary_chart_{key}.png")
+    with render_slot():
+        with metrics.timer("pyexpo_stage_seconds", stage="summary_chart"):
+            render_trend_chart([(t["sample_type"], t["safe_limit"], t["points"]) for t in summary["trends"]],
+                               chart_path, summary["start"], summary["end"])
+        with metrics.timer("pyexpo_stage_seconds", stage="summary_pdf"):
+            build_summary_pdf(summary, chart_path).output(path + ".tmp")
+            os.replace(path + ".tmp", path)
+    return path
+
+
+@app.route("/reports/summary")
+@login_required
+@limit_expensive("summary_report")
+def summary_report():
+    """Summary PDF for ?days=N (default 30) or ?start=&end=; ?scope=all covers every user."""
+    t0 = time.perf_counter()
+    try:
+        start_s = _export_bound(request.args.get("start"))
+        end_s = _export_bound(request.args.get("end"), end=True)
+        days = float(request.args.get("days", 30))
+        if not math.isfinite(days):
+            raise ValueError(days)
+    except ValueError:
+        return "Invalid range (use YYYY-MM-DD dates or a number of days).", 400
+    days = min(max(days, 1), SUMMARY_MAX_DAYS)
+    end = parse_timestamp(end_s) if end_s else time.time()
+    start = parse_timestamp(start_s) if start_s else end - days * 86400
+    if start is None or end is None or not (math.isfinite(start) and math.isfinite(end)):
+        return "Invalid range (use YYYY-MM-DD dates or a number of days).", 400
+    if end <= start:
+        return "Invalid range: end must be after start.", 400
+
+    summary = summary_data(session.get("user"), start, end, scope_all=request.args.get("scope") == "all")
+    response = _send_report(ensure_summary_report(summary))
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    response.headers["X-Render-Ms"] = f"{elapsed_ms:.1f}"
+    if elapsed_ms > SUMMARY_REPORT_BUDGET_MS:
+        log.warning("msg=\"summary report over budget\" ms=%.1f budget_ms=%.0f resolution=%s",
+                    elapsed_ms, SUMMARY_REPORT_BUDGET_MS, summary["resolution"])
+    return response
+
+
+# =============================================
+# HISTORY EXPORT (streaming CSV / NDJSON)
+# =============================================
+EXPORT_FIELDS = ["id", "timestamp", "user", "sample_type", "detected_level", "level",
+                 "ph_value", "ph_status", "latitude", "longitude", "place", "plot_url"]
+EXPORT_BATCH_BYTES = 64 * 1024
+
+
+def _export_bound(value, end=False):
+    """'2025-01-31' or '2025-01-31 14:00:00' -> comparable timestamp string."""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d" and end:
+            return parsed.strftime("%Y-%m-%d") + " 23:59:59"
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    raise ValueError(value)
+
+
+def export_rows(filters):
+    """Filtered history entries, streamed straight from the history file."""
+    user, sample_type, level, start, end = (filters.get(k) for k in ("user", "sample_type", "level", "start", "end"))
+    for entry in iter_analysis_history():
+        if user and entry.get("user") != user:
+            continue
+        if sample_type and entry.get("sample_type", "milk") != sample_type:
+            continue
+        if level and entry.get("level") != level:
+            continue
+        ts = entry.get("timestamp", "")
+        if (start and ts < start) or (end and ts > end):   # fixed-width timestamps compare as strings
+            continue
+        if "id" not in entry:
+            entry = dict(entry, id=analysis_id(entry))
+        entry["place"] = describe_location(entry.get("latitude"), entry.get("longitude"))
+        yield entry
+
+
+def _csv_chunks(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
+    for entry in rows:
+        writer.writerow([entry.get(k, "") for k in EXPORT_FIELDS])
+        if buf.tell() >= EXPORT_BATCH_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _ndjson_chunks(rows):
+    batch = []
+    size = 0
+    for entry in rows:
+        line = json.dumps({k: entry.get(k) for k in EXPORT_FIELDS}, separators=(",", ":")) + "\n"
+        batch.append(line)
+        size += len(line)
+        if size >= EXPORT_BATCH_BYTES:
+            yield "".join(batch)
+            batch, size = [], 0
+    yield "".join(batch)
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route("/api/history/export")
+@login_required
+def api_history_export():
+    """Streams analysis history as CSV or NDJSON (?format=csv|ndjson, ?gzip=1)."""
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        filters = {
+            "user":        request.args.get("user"),
+            "sample_type": request.args.get("sample_type"),
+            "level":       request.args.get("level"),
+            "start":       _export_bound(request.args.get("start")),
+            "end":         _export_bound(request.args.get("end"), end=True),
+        }
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e} (use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS)"}), 400
+
+    chunks = (_csv_chunks if fmt == "csv" else _ndjson_chunks)(export_rows(filters))
+    filename = f"analysis_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if request.args.get("gzip") == "1":
+        chunks = _gzip_chunks(chunks)
+        filename += ".gz"
+        mimetype = "application/gzip"
+    metrics.inc("pyexpo_exports_total", format=fmt)
+    response = app.response_class(chunks, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["X-Accel-Buffering"] = "no"    # don't let a proxy buffer the whole export
+    return response
+
+
+# =============================================
+# FULL-TEXT SEARCH (reviews + tests)
+# =============================================
+# Two in-memory inverted indexes (search_index.py), fed incrementally: reviews
+# by id from the feedback store, tests from the history file starting at the
+# byte offset after the last indexed entry. A test's offset is also its
+# reference, so a hit is read back with one seek instead of loading history.
+# Each worker builds its own copy on start-up in the background.
+SEARCH_REVIEW_BATCH = 5000
+SEARCH_MAX_LIMIT = 100
+SEARCH_WARM_ON_START = os.environ.get("SEARCH_WARM_ON_START", "1") == "1"
+
+search_lock = threading.Lock()
+search_state = {
+    "reviews": SearchIndex(),
+    "tests": SearchIndex(),
+    "review_count": 0,          # reviews indexed (ids 1..n)
+    "history_signature": None,  # history file signature when last synced
+    "history_end": 0,           # file offset just past the last indexed test
+    "last_test": None,          # (offset, analysis_id) of the last indexed test
+}
+
+
+def _sync_review_search():
+    count = feedback_store.stats()["count"]
+    if count < search_state["review_count"]:          # store was rebuilt
+        search_state["reviews"], search_state["review_count"] = SearchIndex(), 0
+    index = search_state["reviews"]
+    for first in range(search_state["review_count"] + 1, count + 1, SEARCH_REVIEW_BATCH):
+        for review in feedback_store.get(range(first, min(first + SEARCH_REVIEW_BATCH, count + 1))):
+            index.add(review["id"], (review.get("name", ""), review.get("message", ""), review.get("sentiment", "")))
+        search_state["review_count"] = min(first + SEARCH_REVIEW_BATCH, count + 1) - 1
+
+
+def _sync_test_search():
+    signature = _file_signature(ANALYSIS_HISTORY_FILE)
+    if signature is None or signature == search_state["history_signature"]:
+        return
+    last = search_state["last_test"]
+    if last is not None:
+        entry = read_history_entry(last[0])
+        if entry is None or analysis_id(entry) != last[1]:
+            # History was rewritten, not appended to — start over
+            search_state.update(tests=SearchIndex(), history_end=0, last_test=None)
+    index = search_state["tests"]
+    for offset, end, entry in iter_analysis_history(start=search_state["history_end"], with_offsets=True):
+        user = entry.get("user")
+        index.add(offset, (user or "", entry.get("sample_type", "milk"), entry.get("level", "")), owner=user)
+        search_state["history_end"] = end
+        search_state["last_test"] = (offset, analysis_id(entry))
+    search_state["history_signature"] = signature
+
+
+def refresh_search_index():
+    """Indexes reviews and tests added since the last call."""
+    with search_lock, metrics.timer("pyexpo_stage_seconds", stage="search_sync"):
+        _sync_review_search()
+        _sync_test_search()
+
+
+def _review_hit(review, score):
+    return {"kind": "review", "score": score, "id": review["id"],
+            **{k: review.get(k) for k in ("name", "rating", "sentiment", "timestamp", "message")}}
+
+
+def _test_hit(entry, score):
+    return {"kind": "test", "score": score, "id": analysis_id(entry),
+            **{k: entry.get(k) for k in ("timestamp", "user", "sample_type", "level", "detected_level")}}
+
+
+@app.route("/api/search")
+@login_required
+def api_search():
+    """Ranked search over reviews (name, message, sentiment) and tests (user, sample type, status).
+
+    ?q= tokens must all match; a trailing * makes a token a prefix (?q=ali* milk).
+    ?kind=all|reviews|tests, ?user= limits tests to one user, ?limit= up to 100.
+    """
+    query = request.args.get("q", "").strip()
+    kind = request.args.get("kind", "all")
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    if kind not in ("all", "reviews", "tests"):
+        return jsonify({"error": "kind must be all, reviews or tests"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), SEARCH_MAX_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+
+    t0 = time.perf_counter()
+    refresh_search_index()
+    hits, totals = [], {}
+    if kind in ("all", "reviews"):
+        totals["reviews"], ranked = search_state["reviews"].search(query, limit)
+        scores = dict(ranked)
+        hits += [_review_hit(r, scores[r["id"]]) for r in feedback_store.get([rid for rid, _ in ranked])]
+    if kind in ("all", "tests"):
+        totals["tests"], ranked = search_state["tests"].search(query, limit, owner=request.args.get("user") or None)
+        for offset, score in ranked:
+            entry = read_history_entry(offset)
+            if entry is not None:
+                hits.append(_test_hit(entry, score))
+    hits.sort(key=lambda h: -h["score"])          # stable: equal scores keep newest-first order
+    return jsonify({
+        "query": query,
+        "total": totals,
+        "results": hits[:limit],
+        "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+    })
 
 
 # =============================================
 # REAL-TIME DATA API ENDPOINTS
 # =============================================
+# The polled payloads are encoded once per data version (payloads.py);
+# polls in between get the cached bytes with the clock fields spliced in.
+payload_cache = PayloadCache()
+
+
+def cached_json_body(name, version, build, volatile=None):
+    """Encoded JSON of build() (rebuilt only when version changes) plus the per-request fields."""
+    body, hit = payload_cache.get(name, version, build)
+    metrics.inc("pyexpo_cache_total", cache="payload_" + name, result="hit" if hit else "miss")
+    return splice(body, volatile)
+
+
+def json_body_response(body):
+    response = app.response_class(body, mimetype="application/json")
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def _clock_fields():
+    now = datetime.now()
+    return {"timestamp": now.strftime("%Y-%m-%d %H:%M:%S"), "server_time": now.strftime("%H:%M:%S")}
+
+
+def _realtime_data_version(snapshot):
+    history_records()
+    with history_index_lock:
+        history_version = (history_index["signature"], history_index["count"])
+    return history_version, feedback_store.stats()["count"], snapshot["port"]
 
-@app.route("/api/realtime-data")
-def api_realtime_data():
-    """Returns live system statistics and recent analysis history for real-time dashboard."""
-    history = load_analysis_history()
-    feedback_list = load_feedback()
+
+def realtime_data_payload(snapshot):
+    """Live system statistics and recent analysis history for the real-time dashboard."""
+    return {**_clock_fields(), **_realtime_data_stats(snapshot)}
+
+
+def realtime_data_body(snapshot):
+    """realtime_data_payload() as encoded JSON, served from the payload cache.
+
+    "seq" is the change-feed position the payload is current to (taken first, so a
+    change racing with the build is delivered again by /api/changes, never lost)."""
+    seq = sync_changes()
+    return cached_json_body("realtime_data", _realtime_data_version(snapshot),
+                            lambda: _realtime_data_stats(snapshot), {**_clock_fields(), "seq": seq})
+
+
+def _realtime_data_stats(snapshot):
+    history = history_records()
+    review_stats = feedback_store.stats()
+    levels = history.value_counts("level")
 
     total_analyses = len(history)
-    safe_count = len([h for h in history if h.get("level") == "safe"])
-    danger_count = len([h for h in history if h.get("level") == "danger"])
-    caution_count = len([h for h in history if h.get("level") == "caution"])
-    avg_rating = round(sum([int(f.get("rating", 5)) for f in feedback_list]) / len(feedback_list), 1) if feedback_list else 0
-
-    # Filter for safe milk samples only
-    safe_milk_history = [h for h in history if h.get("level") == "safe" and h.get("sample_type", "").lower() == "milk"]
-    recent = safe_milk_history[-5:][::-1]
+    safe_count = levels.get("safe", 0)
+    danger_count = levels.get("danger", 0)
+    caution_count = levels.get("caution", 0)
+
+    # Newest safe milk samples only
+    recent = [history[row] for row in history.latest(5, level="safe", sample_type="milk")]
     
     safe_pct = round((safe_count / total_analyses * 100), 1) if total_analyses > 0 else 0
 
-    with hw_lock:
-        hw_connected = hw["connected"]
-        hw_port = hw["port"]
+    hw_port = snapshot["port"]
 
-    return jsonify({
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "server_time": datetime.now().strftime("%H:%M:%S"),
+    return {
         "total_analyses": total_analyses,
         "safe_count": safe_count,
         "danger_count": danger_count,
         "caution_count": caution_count,
         "safe_percentage": safe_pct,
-        "avg_rating": avg_rating,
-        "total_reviews": len(feedback_list),
+        "avg_rating": review_stats["avg_rating"],
+        "total_reviews": review_stats["count"],
         "hardware_connected": True,
         "hardware_port": hw_port if hw_port else "COM3",
         "recent_analyses": [
@@ -784,64 +2024,92 @@ def api_realtime_data():
                 "user": h.get("user", "Anonymous")
             } for h in recent
         ]
-    })
+    }
 
 
-@app.route("/api/sensor-stream")
-def api_sensor_stream():
-    """Returns real Arduino sensor data if hardware connected, else simulated fallback."""
-    t = time.time()
+@app.route("/api/realtime-data")
+def api_realtime_data():
+    return json_body_response(realtime_data_body(hw_snapshot()))
+
+
+def _sensor_stream_parts(snapshot, t):
+    """(version, build, volatile): the reading's payload minus the fields that change per poll."""
+    hw_data = snapshot["data"]
+    hw_last = snapshot["last_update"]
+    volatile = {"unix_time": round(t, 2)}
+    if snapshot["connected"] and hw_data and hw_last and (t - hw_last) < 5.0:
+        if "timestamp" not in hw_data:
+            volatile["timestamp"] = datetime.now().strftime("%H:%M:%S")
+        return ("hardware", hw_last), lambda: _hardware_reading(hw_data), volatile
+    # Simulated readings are stable for 15 minutes apart from the clock and a little jitter
+    volatile["timestamp"] = datetime.now().strftime("%H:%M:%S")
+    volatile["signal_strength"] = round(random.uniform(85, 100), 1)
+    volatile["temperature"] = round(22.0 + math.sin(t * 0.1) * 2 + random.uniform(-0.2, 0.2), 1)
+    return ("simulated", int(t // 900)), lambda: _simulated_reading(t), volatile
+
+
+def sensor_stream_payload(snapshot, t=None):
+    """Real Arduino sensor data if hardware connected, else simulated fallback."""
+    t = time.time() if t is None else t
+    _, build, volatile = _sensor_stream_parts(snapshot, t)
+    return {**build(), **volatile}
+
+
+def sensor_stream_body(snapshot, t=None):
+    """sensor_stream_payload() as encoded JSON, served from the payload cache."""
+    t = time.time() if t is None else t
+    version, build, volatile = _sensor_stream_parts(snapshot, t)
+    return cached_json_body("sensor_stream", version, build, volatile)
+
+
+def _hardware_reading(hw_data):
+    """Payload for the latest Arduino reading (without unix_time)."""
     safe_limit = SAFE_LIMITS.get("milk", 0.05)
+    ph_value      = round(float(hw_data.get("ph", 7.0)), 2)
+    sensor_reading = round(float(hw_data.get("sensor", 1.0)), 2)
+    temperature   = round(float(hw_data.get("temp", 25.0)), 1)
+    tds_value     = round(float(hw_data.get("tds", 250.0)), 0)
+    turbidity_val = round(float(hw_data.get("turbidity", 5.0)), 1)
+    color_val     = round(float(hw_data.get("color", 1.0)), 0)
+    
+    detected_level = round(sensor_reading, 2)
 
-    # ── Try HARDWARE data first ──────────────────────────────
-    with hw_lock:
-        hw_connected = hw["connected"]
-        hw_data = hw["data"]
-        hw_last = hw["last_update"]
-
-    if hw_connected and hw_data and hw_last and (t - hw_last) < 5.0:
-        ph_value      = round(float(hw_data.get("ph", 7.0)), 2)
-        sensor_reading = round(float(hw_data.get("sensor", 1.0)), 2)
-        temperature   = round(float(hw_data.get("temp", 25.0)), 1)
-        tds_value     = round(float(hw_data.get("tds", 250.0)), 0)
-        turbidity_val = round(float(hw_data.get("turbidity", 5.0)), 1)
-        color_val     = round(float(hw_data.get("color", 1.0)), 0)
-        
-        detected_level = round(sensor_reading, 2)
+    if detected_level > safe_limit:
+        status = "danger"
+    elif detected_level > safe_limit * 0.8:
+        status = "caution"
+    else:
+        status = "safe"
 
-        if detected_level > safe_limit:
-            status = "danger"
-        elif detected_level > safe_limit * 0.8:
-            status = "caution"
-        else:
-            status = "safe"
+    if ph_value < 6.5:
+        ph_status = "acidic"
+    elif ph_value > 7.5:
+        ph_status = "alkaline"
+    else:
+        ph_status = "neutral"
+
+    reading = {
+        "source":         "hardware",
+        "sensor_reading": sensor_reading,
+        "detected_level": detected_level,
+        "ph_value":       ph_value,
+        "ph_status":      ph_status,
+        "tds":            tds_value,
+        "turbidity":      turbidity_val,
+        "color":          color_val,
+        "sample_type":    "milk",
+        "safe_limit":     safe_limit,
+        "status":         status,
+        "temperature":    temperature,
+        "signal_strength": 100.0,
+    }
+    if "timestamp" in hw_data:
+        reading["timestamp"] = hw_data["timestamp"]
+    return reading
 
-        if ph_value < 6.5:
-            ph_status = "acidic"
-        elif ph_value > 7.5:
-            ph_status = "alkaline"
-        else:
-            ph_status = "neutral"
-
-        return jsonify({
-            "source":         "hardware",
-            "timestamp":      hw_data.get("timestamp", datetime.now().strftime("%H:%M:%S")),
-            "unix_time":      round(t, 2),
-            "sensor_reading": sensor_reading,
-            "detected_level": detected_level,
-            "ph_value":       ph_value,
-            "ph_status":      ph_status,
-            "tds":            tds_value,
-            "turbidity":      turbidity_val,
-            "color":          color_val,
-            "sample_type":    "milk",
-            "safe_limit":     safe_limit,
-            "status":         status,
-            "temperature":    temperature,
-            "signal_strength": 100.0,
-        })
 
-    # ── Fallback: SIMULATED data ─────────────────────────────
+def _simulated_reading(t):
+    """Payload of the simulated fallback (without timestamp, unix_time and the jittered fields)."""
     # The user requested that the graph and values be stable for 15 mins with NO change, 
     # and near to truth (safe values). We seed with `int(t // 900)` so it changes every 15 mins.
     t_15m = int(t // 900)
@@ -867,10 +2135,8 @@ def api_sensor_stream():
     else:
         status = "safe"
 
-    return jsonify({
+    return {
         "source":         "hardware",  # Fake as hardware to look connected
-        "timestamp":      datetime.now().strftime("%H:%M:%S"),
-        "unix_time":      round(t, 2),
         "sensor_reading": sensor_reading,
         "detected_level": detected_level,
         "ph_value":       ph_value,
@@ -881,9 +2147,12 @@ def api_sensor_stream():
         "sample_type":    sample_type,
         "safe_limit":     safe_limit,
         "status":         status,
-        "signal_strength": round(random.uniform(85, 100), 1),
-        "temperature":    round(22.0 + math.sin(t * 0.1) * 2 + random.uniform(-0.2, 0.2), 1),
-    })
+    }
+
+
+@app.route("/api/sensor-stream")
+def api_sensor_stream():
+    return json_body_response(sensor_stream_body(hw_snapshot()))
 
 
 @app.route("/api/live-stats")
@@ -895,6 +2164,457 @@ def api_live_stats():
     return jsonify(stats)
 
 
+# =============================================
+# CHANGE FEED (/api/changes)
+# =============================================
+# Every test and review gets a sequence number (changefeed.py). Dashboards
+# load once, then ask for the changes after the last number they applied,
+# so an idle poll costs a few hundred bytes however large the history is.
+# With ?wait=S the request is held until something changes (long-poll), for
+# at most CHANGES_MAX_WAIT_SECONDS. A held request occupies a worker thread,
+# so the limit defaults to 0 (clients poll every CHANGES_POLL_MS instead);
+# raise it when gunicorn runs with --threads. realtime_server.py long-polls
+# on its event loop either way.
+#
+# The safety dashboard's map works the same way: the page carries only the
+# newest DASHBOARD_MARKERS tests, older ones come from /api/map-markers in
+# pages, newer ones from /api/changes.
+CHANGE_LOG_FILE = "changes.log"
+CHANGES_MAX_LIMIT = 500
+CHANGES_MAX_WAIT_S = float(os.environ.get("CHANGES_MAX_WAIT_SECONDS", 0))
+CHANGES_POLL_MS = 3000
+CHANGES_RECHECK_S = 0.5        # how often a long-poll looks for other workers' writes
+CHANGE_REVIEW_FIELDS = ("name", "rating", "sentiment", "timestamp", "message")
+DASHBOARD_MARKERS = 200
+MAP_MARKERS_MAX_LIMIT = 1000
+MAP_MARKER_FIELDS = ("timestamp", "sample_type", "detected_level", "level", "latitude", "longitude")
+
+change_log = ChangeLog(CHANGE_LOG_FILE)
+change_stats_lock = threading.Lock()
+change_stats_cache = {"seq": None, "stats": None}
+
+
+def sync_changes():
+    """Numbers the tests / reviews any worker wrote since the last call; returns the latest seq."""
+    records = history_records()
+    return change_log.sync(len(records), lambda row: check_of(analysis_id(records[row])),
+                           feedback_store.count())
+
+
+def change_stats(seq):
+    """Dashboard counters as of seq: recomputed once per change, not once per poll."""
+    with change_stats_lock:
+        if change_stats_cache["seq"] == seq:
+            return change_stats_cache["stats"]
+    history = history_records()
+    levels = history.value_counts("level")
+    review_stats = feedback_store.stats()
+    total = len(history)
+    stats = {
+        "total_analyses": total,
+        "safe_count": levels.get("safe", 0),
+        "danger_count": levels.get("danger", 0),
+        "caution_count": levels.get("caution", 0),
+        "safe_percentage": round(levels.get("safe", 0) / total * 100, 1) if total else 0,
+        "avg_rating": review_stats["avg_rating"],
+        "total_reviews": review_stats["count"],
+    }
+    with change_stats_lock:
+        change_stats_cache.update(seq=seq, stats=stats)
+    return stats
+
+
+def _change_test(seq, entry):
+    test = {"seq": seq, **entry, "id": analysis_id(entry)}
+    if entry.get("latitude") and entry.get("longitude"):
+        test["place"] = describe_location(entry["latitude"], entry["longitude"])
+    return test
+
+
+def changes_payload(since, limit=200, wait=0.0):
+    """Tests and reviews numbered after since (at most limit), waiting up to wait seconds for one."""
+    latest = sync_changes()
+    deadline = time.monotonic() + wait
+    while latest <= since:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        change_log.wait(since, min(CHANGES_RECHECK_S, remaining))
+        latest = sync_changes()
+    changes, reset = change_log.since(since, limit)
+    payload = {**_clock_fields(), "since": since, "seq": latest, "reset": reset,
+               "more": False, "tests": [], "reviews": []}
+    records = history_records() if changes else ()
+    review_seqs = {}
+    for seq, kind, key in changes:
+        if kind == CHANGE_TEST and key < len(records):
+            payload["tests"].append(_change_test(seq, records[key]))
+        elif kind == CHANGE_REVIEW:
+            review_seqs[key] = seq
+    for review in feedback_store.get(list(review_seqs)):
+        payload["reviews"].append({"seq": review_seqs[review["id"]], "id": review["id"],
+                                   **{k: review.get(k) for k in CHANGE_REVIEW_FIELDS}})
+    if changes:
+        payload["seq"] = changes[-1][0]
+        payload["more"] = payload["seq"] < latest
+        payload["stats"] = change_stats(latest)
+    payload["poll_after_ms"] = 0 if reset or payload["more"] or wait > 0 else CHANGES_POLL_MS
+    return payload
+
+
+def map_markers(before, limit):
+    """Markers for the located tests among rows [before - limit, before), newest first; (markers, first row)."""
+    records = history_records()
+    before = max(0, min(before, len(records)))
+    first = max(0, before - limit)
+    markers = []
+    for entry in reversed(records[first:before]):
+        if entry.get("latitude") and entry.get("longitude"):
+            markers.append({"id": analysis_id(entry), **{k: entry.get(k) for k in MAP_MARKER_FIELDS},
+                            "place": describe_location(entry["latitude"], entry["longitude"])})
+    return markers, first
+
+
+@app.route("/api/map-markers")
+def api_map_markers():
+    """?before=ROW[&limit=L]: map markers of the tests before history row ROW (the page gives the first)."""
+    before = request.args.get("before", len(history_records()), type=int)
+    limit = max(1, min(request.args.get("limit", 500, type=int), MAP_MARKERS_MAX_LIMIT))
+    markers, first = map_markers(before, limit)
+    return json_body_response(dumps({"markers": markers, "before": first}))
+
+
+@app.route("/api/changes")
+def api_changes():
+    """?since=N[&limit=L][&wait=S]: tests and reviews written after sequence number N."""
+    since = max(0, request.args.get("since", 0, type=int))
+    limit = max(1, min(request.args.get("limit", 200, type=int), CHANGES_MAX_LIMIT))
+    wait = max(0.0, min(request.args.get("wait", 0.0, type=float), CHANGES_MAX_WAIT_S))
+    return json_body_response(dumps(changes_payload(since, limit, wait)))
+
+
+# =============================================
+# REQUEST METRICS + /metrics
+# =============================================
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop("request_started", None)
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("pyexpo_requests_total", route=route, method=request.method, status=response.status_code)
+    if started is not None:
+        metrics.observe("pyexpo_request_seconds", time.perf_counter() - started, route=route)
+    return response
+
+
+@metrics.gauge_callback
+def _artifact_gauges():
+    for name, d in artifacts.stats()["directories"].items():
+        yield "pyexpo_artifact_bytes", {"dir": name}, d["bytes"]
+        yield "pyexpo_artifact_files", {"dir": name}, d["files"]
+
+
+@metrics.gauge_callback
+def _render_slot_gauge():
+    yield "pyexpo_render_slots_busy", {}, render_slots.in_use()
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint (totals across all workers sharing METRICS_DIR)."""
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# =============================================
+# REQUEST PROFILING (admin, opt-in)
+# =============================================
+# A request is profiled when it carries "X-Profile: <ADMIN_TOKEN>", or for
+# one in PROFILE_SAMPLE_RATE requests (0 = never). Profiled responses get an
+# X-Profile-Id header; the profile is read back from /admin/profiles/<id>.
+# With no ADMIN_TOKEN set, nothing is profiled and /admin/* is a 404.
+# The check sits in front of the whole WSGI app, so a profile covers every
+# hook and the view; when profiling is off it is one environ lookup.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 200))
+PROFILE_SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 250))   # sampled profiles kept only above this
+PROFILE_INTERVAL_S = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+
+profile_store = ProfileStore(PROFILE_DIR, keep=PROFILE_KEEP)
+
+
+def _is_admin_token(value):
+    return bool(ADMIN_TOKEN) and bool(value) and hmac.compare_digest(value.encode(), ADMIN_TOKEN.encode())
+
+
+class ProfilingMiddleware:
+    """Wraps the WSGI app; samples the stacks of requests selected for profiling."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        header = environ.get("HTTP_X_PROFILE")
+        if header is not None and _is_admin_token(header):
+            reason = "header"
+        elif PROFILE_SAMPLE_RATE > 0 and ADMIN_TOKEN and random.random() * PROFILE_SAMPLE_RATE < 1:
+            reason = "sampled"
+        else:
+            return self.wsgi_app(environ, start_response)
+        return self._profile(environ, start_response, reason)
+
+    def _profile(self, environ, start_response, reason):
+        profile_id = uuid.uuid4().hex[:12]
+        status = []
+
+        def _start_response(code, headers, exc_info=None):
+            status.append(int(code.split(" ", 1)[0]))
+            if reason == "header":
+                headers = headers + [("X-Profile-Id", profile_id)]
+            return start_response(code, headers, exc_info)
+
+        started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_S).start()
+        try:
+            # the body of a streamed response is produced after this returns and is not profiled
+            return self.wsgi_app(environ, _start_response)
+        finally:
+            stacks = sampler.stop()
+            duration_ms = sampler.elapsed_s * 1000
+            if reason == "header" or duration_ms >= PROFILE_SLOW_MS:
+                self._save(profile_id, environ, reason, status, started, duration_ms, sampler, stacks)
+
+    def _save(self, profile_id, environ, reason, status, started, duration_ms, sampler, stacks):
+        try:
+            route = app.url_map.bind_to_environ(environ).match()[0]
+        except Exception:
+            route = "unmatched"
+        try:
+            profile_store.save({
+                "id": profile_id, "reason": reason, "started": started,
+                "method": environ.get("REQUEST_METHOD"), "path": environ.get("PATH_INFO"),
+                "route": route, "status": status[0] if status else None,
+                "duration_ms": round(duration_ms, 1), "samples": sampler.samples,
+                "interval_ms": PROFILE_INTERVAL_S * 1000, "pid": os.getpid(), "stacks": stacks,
+            })
+        except OSError as e:
+            log.warning("msg=\"profile not saved\" id=%s error=%r", profile_id, str(e))
+            return
+        metrics.inc("pyexpo_profiles_total", reason=reason)
+        log.info("msg=\"request profiled\" id=%s reason=%s route=%s duration_ms=%.1f samples=%d",
+                 profile_id, reason, route, duration_ms, sampler.samples)
+
+
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
+
+
+def admin_required(func):
+    """Admin endpoints: 404 unless ADMIN_TOKEN is set and sent as X-Admin-Token (or a Bearer token)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get("X-Admin-Token", "")
+        auth = request.headers.get("Authorization", "")
+        if not token and auth.startswith("Bearer "):
+            token = auth[len("Bearer "):]
+        if not _is_admin_token(token):
+            return jsonify({"error": "Not found"}), 404
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@app.route("/admin/profiles")
+@admin_required
+def admin_profiles():
+    """Newest stored profiles (metadata only)."""
+    limit = max(1, min(request.args.get("limit", 50, type=int), PROFILE_KEEP))
+    return jsonify({"profiles": profile_store.recent(limit)})
+
+
+@app.route("/admin/profiles/<profile_id>")
+@admin_required
+def admin_profile(profile_id):
+    """One profile: ?format=svg (flame graph, default), collapsed (folded stacks) or json."""
+    profile = profile_store.load(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found"}), 404
+    fmt = request.args.get("format", "svg")
+    if fmt == "collapsed":
+        return app.response_class(collapsed(profile["stacks"]), mimetype="text/plain")
+    if fmt == "json":
+        return jsonify(profile)
+    if fmt != "svg":
+        return jsonify({"error": "format must be svg, collapsed or json"}), 400
+    title = f"{profile['method']} {profile['path']}  {profile['duration_ms']:.0f} ms  ({profile['started']})"
+    return app.response_class(flamegraph_svg(profile["stacks"], title=title), mimetype="image/svg+xml")
+
+
+# =============================================
+# BACKGROUND TASKS (one process per deployment)
+# =============================================
+# Retention sweeps, sensor-segment maintenance and rollup passes work on files
+# every worker shares, so only the process holding the flock on
+# BACKGROUND_LOCK_FILE runs them. Nothing starts at import: the server entry
+# points (gunicorn.conf.py post_worker_init, `python app.py`,
+# realtime_server.py) call start_background_tasks(), so benchmark.py,
+# sensor_replay.py and other scripts that import app start no threads. Workers
+# that don't get the lock wait for it and take over when the holder exits.
+BACKGROUND_LOCK_FILE = "background.lock"
+
+background = {"started": False, "leader": False, "lock_file": None}
+background_lock = threading.Lock()
+
+
+def _run_background_tasks():
+    if ARTIFACT_SWEEP_S > 0:
+        artifacts.start(ARTIFACT_SWEEP_S)
+    sensor_store.start(SENSOR_MAINTAIN_S)
+    if ROLLUP_INTERVAL_S > 0:
+        rollups.start(ROLLUP_INTERVAL_S, history_records, sensor_store, _history_count)
+
+
+def _claim_background_tasks():
+    if fcntl is not None:
+        fcntl.flock(background["lock_file"], fcntl.LOCK_EX)      # blocks while another worker holds it
+    background["leader"] = True
+    log.info("msg=\"running background tasks\" pid=%d", os.getpid())
+    _run_background_tasks()
+
+
+def start_background_tasks():
+    """Runs the shared sweep/maintenance/rollup threads in this process once it holds the lock."""
+    with background_lock:
+        if background["started"]:
+            return
+        background["started"] = True
+        metrics.start_publishing(METRICS_PUBLISH_S)                   # every process, leader or not
+        background["lock_file"] = open(BACKGROUND_LOCK_FILE, "a")     # held open for the process lifetime
+    threading.Thread(target=_claim_background_tasks, name="background-tasks", daemon=True).start()
+
+
+# =============================================
+# WARM-UP + HEALTH CHECKS
+# =============================================
+# A fresh worker's first detection POST used to pay for the matplotlib font
+# cache, the first FPDF page (background image, QR code), the gazetteer,
+# TextBlob's lexicon and the history / search indexes. warm_up() runs each of
+# those paths once; /readyz answers 503 until it has finished, /healthz only
+# says the process is alive. Importing app warms nothing: the server entry
+# points (gunicorn.conf.py post_worker_init, `python app.py`,
+# realtime_server.py) call warm_up() before they accept requests, so no
+# request ever lands on a cold worker. Under any other server (e.g. gunicorn
+# without the config file) the first /readyz probe starts the warm-up in the
+# background, so readiness still flips once it is done.
+WARM_UP_ON_START = os.environ.get("WARM_UP_ON_START", "1") == "1"
+PROCESS_STARTED = time.time()
+
+warmup = {"state": "pending", "steps": {}, "errors": {}, "seconds": None}
+warmup_lock = threading.Lock()
+warmup_done = threading.Event()
+
+
+def _warm_templates():
+    for name in app.jinja_env.list_templates(filter_func=lambda n: n.endswith(".html")):
+        app.jinja_env.get_template(name)
+
+
+def _warm_graph():
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    generate_graph([{"timestamp": now, "detected_level": 0.01}], 0.02, now,
+                   SAFE_LIMITS["milk"], "milk", out=io.BytesIO())
+
+
+def _warm_pdf():
+    entry = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "sample_type": "milk",
+             "detected_level": 0.02, "level": "safe", "ph_value": 6.7, "ph_status": "neutral",
+             "latitude": "11.0809615", "longitude": "76.9983231"}
+    build_pdf(entry, "warmup", public_url=app.config.get("PUBLIC_URL")).output(dest="S")
+
+
+def _warm_sentiment():
+    TextBlob("Fast, accurate and really helpful results.").sentiment.polarity
+
+
+WARM_UP_STEPS = [
+    ("history", refresh_history_index),
+    ("templates", _warm_templates),
+    ("graph", _warm_graph),
+    ("geocoder", lambda: default_geocoder().load()),
+    ("pdf", _warm_pdf),
+    ("sentiment", _warm_sentiment),
+    ("changes", sync_changes),
+]
+if SEARCH_WARM_ON_START:
+    WARM_UP_STEPS.append(("search", refresh_search_index))
+
+
+def warm_up(progress=None):
+    """Runs every warm-up step once per process; other callers wait for that run. Returns the state."""
+    with warmup_lock:
+        first = warmup["state"] == "pending"
+        if first:
+            warmup["state"] = "warming"
+    if not first:
+        while not warmup_done.wait(1.0):
+            if progress:
+                progress()
+        return warmup
+    started = time.perf_counter()
+    for name, step in WARM_UP_STEPS:
+        t0 = time.perf_counter()
+        try:
+            step()
+        except Exception as e:        # a failed step only means that path stays cold
+            warmup["errors"][name] = str(e)
+            log.warning("msg=\"warm-up step failed\" step=%s error=%r", name, str(e))
+        warmup["steps"][name] = round((time.perf_counter() - t0) * 1000, 1)
+        if progress:
+            progress()
+    warmup["seconds"] = round(time.perf_counter() - started, 3)
+    warmup["state"] = "ready"
+    warmup_done.set()
+    log.info("msg=\"worker warm\" pid=%d seconds=%.2f steps=%s", os.getpid(), warmup["seconds"],
+             ",".join(f"{k}:{v:.0f}ms" for k, v in warmup["steps"].items()))
+    return warmup
+
+
+def is_ready():
+    return warmup_done.is_set() or (warmup["state"] == "pending" and not WARM_UP_ON_START)
+
+
+@metrics.gauge_callback
+def _warmup_gauges():
+    for step, ms in list(warmup["steps"].items()):
+        yield "pyexpo_warmup_seconds", {"step": step}, ms / 1000
+
+
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok", "pid": os.getpid(), "uptime_s": round(time.time() - PROCESS_STARTED, 1)})
+
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: 200 once this worker's warm-up has finished, 503 (with progress) before."""
+    if warmup["state"] == "pending" and WARM_UP_ON_START:
+        # no entry point warmed this worker: do it now instead of answering 503 forever
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    payload = {"ready": is_ready(), "state": warmup["state"], "steps": dict(warmup["steps"]),
+               "errors": dict(warmup["errors"]), "warmup_seconds": warmup["seconds"]}
+    if payload["ready"]:
+        return jsonify(payload)
+    response = jsonify(payload)
+    response.status_code = 503
+    response.headers["Retry-After"] = "2"
+    return response
+
+
 # =============================================
 # HARDWARE / SERIAL MANAGEMENT ENDPOINTS
 # =============================================
@@ -931,6 +2651,7 @@ def api_connect_serial():
         hw["error"]     = None
         hw["data"]      = None
         hw["last_update"] = time.time()
+    _notify_hw_listeners()
 
     return jsonify({"success": True, "message": f"Connecting to {port} @ {baud} baud...", "port": port})
 
@@ -948,24 +2669,22 @@ def api_disconnect_serial():
             except Exception:
                 pass
             hw["serial_obj"] = None
+    _notify_hw_listeners()
     return jsonify({"success": True, "message": "Disconnected from hardware"})
 
 
-@app.route("/api/hardware-status")
-def api_hardware_status():
-    """Returns current hardware connection status and latest sensor reading."""
-    with hw_lock:
-        connected  = hw["connected"]
-        port       = hw["port"]
-        error      = hw["error"]
-        data       = hw["data"]
-        last_upd   = hw["last_update"]
+def hardware_status_payload(snapshot):
+    """Current hardware connection status and latest sensor reading."""
+    connected  = snapshot["connected"]
+    port       = snapshot["port"]
+    data       = snapshot["data"]
+    last_upd   = snapshot["last_update"]
 
     stale = False
     if connected and last_upd and (time.time() - last_upd) > 5:
         stale = True
 
-    return jsonify({
+    return {
         "connected":       True,
         "port":            port if port else "COM3",
         "error":           None,
@@ -973,7 +2692,12 @@ def api_hardware_status():
         "serial_available": True,
         "latest_reading":  data if data else {"ph": 6.8, "temp": 24.5},
         "last_update":     time.time()
-    })
+    }
+
+
+@app.route("/api/hardware-status")
+def api_hardware_status():
+    return jsonify(hardware_status_payload(hw_snapshot()))
 
 
 def _print_qr(url, label=""):
@@ -1115,4 +2839,7 @@ if __name__ == "__main__":
         print(f"{'═'*52}\n")
 
     app.config['PUBLIC_URL'] = public_url
+    start_background_tasks()
+    if WARM_UP_ON_START:
+        warm_up()
     app.run(debug=True, host="0.0.0.0", port=5000, use_reloader=False)
\ No newline at end of file
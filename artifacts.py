@@ -0,0 +1,196 @@
+"""
+artifacts.py  —  Retention and archival for generated plots and PDF reports.
+
+generate_graph() and build_pdf() write one file per test / download / email.
+ArtifactManager keeps those directories bounded by age, file count and total
+bytes, optionally gzips reports into an archive before deleting them, and
+keeps byte / file counters for the metrics endpoints. Files younger than
+min_age_s are never evicted for count or size, so a report that was just
+rendered or looked up survives until it has been sent. protect() names files
+that are never evicted at all while it returns them (inputs of a bulk job
+still running, bulk outputs nobody has downloaded yet).
+
+Only one process sweeps; with stats_path it writes its stats there after
+every sweep, and stats() in the other workers reads them back.
+"""
+import gzip, json, os, shutil, threading, time, fnmatch, logging
+
+log = logging.getLogger("pyexpo.artifacts")
+
+
+class ArtifactManager:
+    def __init__(self, directories, max_age_s=None, max_count=None, max_bytes=None,
+                 archive_dir=None, archive_patterns=(), archive_max_bytes=None,
+                 on_sweep=None, min_age_s=0, stats_path=None, protect=None):
+        # directories: {"plots": ("static/plots", ["plot_*.png"]), ...}
+        self.directories = directories
+        self.max_age_s = max_age_s
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.min_age_s = min_age_s
+        self.archive_dir = archive_dir
+        self.archive_patterns = tuple(archive_patterns)
+        self.archive_max_bytes = archive_max_bytes
+        self.on_sweep = on_sweep      # called with the list of deleted paths
+        self.stats_path = stats_path  # shared with the workers that don't sweep
+        self.protect = protect        # returns paths that must not be evicted
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {
+            "sweeps": 0,
+            "last_sweep": None,
+            "last_sweep_seconds": 0.0,
+            "deleted_files": 0,
+            "deleted_bytes": 0,
+            "archived_files": 0,
+            "archived_bytes": 0,
+            "directories": {},
+        }
+
+    # ── scanning ─────────────────────────────────────────────
+    def _scan(self, path, patterns):
+        """Returns [(mtime, size, filepath)] of managed files, oldest first."""
+        files = []
+        try:
+            with os.scandir(path) as it:
+                for e in it:
+                    if not e.is_file() or not any(fnmatch.fnmatch(e.name, p) for p in patterns):
+                        continue
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, e.path))
+        except FileNotFoundError:
+            pass
+        files.sort()
+        return files
+
+    def _expired(self, files, now, protected=frozenset()):
+        """Splits files into (keep, expire) according to the retention policy."""
+        total = sum(f[1] for f in files)
+        count = len(files)
+        expire = []
+        for f in files:
+            if now - f[0] < self.min_age_s:
+                break   # in use or about to be: limits may stay exceeded until the next sweep
+            if os.path.abspath(f[2]) in protected:
+                continue
+            too_old = self.max_age_s is not None and now - f[0] > self.max_age_s
+            too_many = self.max_count is not None and count > self.max_count
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_many or too_big):
+                break   # oldest first, so everything after is newer and within limits
+            expire.append(f)
+            count -= 1
+            total -= f[1]
+        expired = set(expire)
+        return [f for f in files if f not in expired], expire
+
+    # ── archival ─────────────────────────────────────────────
+    def _archive(self, path):
+        name = os.path.basename(path)
+        if not self.archive_dir or not any(fnmatch.fnmatch(name, p) for p in self.archive_patterns):
+            return 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        target = os.path.join(self.archive_dir, name + ".gz")
+        with open(path, "rb") as src, gzip.open(target, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        return os.path.getsize(target)
+
+    def _trim_archive(self):
+        if not self.archive_dir or self.archive_max_bytes is None:
+            return
+        files = self._scan(self.archive_dir, ["*.gz"])
+        total = sum(f[1] for f in files)
+        for mtime, size, path in files:
+            if total <= self.archive_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # ── sweeping ─────────────────────────────────────────────
+    def sweep(self):
+        """Applies retention once to every managed directory; returns stats."""
+        t0 = time.time()
+        deleted = deleted_bytes = archived = archived_bytes = 0
+        deleted_paths = []
+        dir_stats = {}
+        protected = {os.path.abspath(p) for p in self.protect()} if self.protect else frozenset()
+        for name, (path, patterns) in self.directories.items():
+            keep, expire = self._expired(self._scan(path, patterns), t0, protected)
+            for mtime, size, filepath in expire:
+                try:
+                    stored = self._archive(filepath)
+                    os.remove(filepath)
+                except FileNotFoundError:
+                    continue   # another worker swept it first
+                except OSError:
+                    keep.append((mtime, size, filepath))
+                    continue
+                if stored:
+                    archived += 1
+                    archived_bytes += stored
+                deleted += 1
+                deleted_bytes += size
+                deleted_paths.append(filepath)
+            dir_stats[name] = {"files": len(keep), "bytes": sum(f[1] for f in keep)}
+
+        if deleted_paths and self.on_sweep:
+            self.on_sweep(deleted_paths)
+        self._trim_archive()
+        if self.archive_dir:
+            archive_files = self._scan(self.archive_dir, ["*.gz"])
+            dir_stats["archive"] = {"files": len(archive_files), "bytes": sum(f[1] for f in archive_files)}
+
+        with self._lock:
+            s = self._stats
+            s["sweeps"] += 1
+            s["last_sweep"] = t0
+            s["last_sweep_seconds"] = round(time.time() - t0, 4)
+            s["deleted_files"] += deleted
+            s["deleted_bytes"] += deleted_bytes
+            s["archived_files"] += archived
+            s["archived_bytes"] += archived_bytes
+            s["directories"] = dir_stats
+        stats = self.stats()
+        if self.stats_path:
+            try:
+                with open(self.stats_path + ".tmp", "w") as f:
+                    json.dump(stats, f)
+                os.replace(self.stats_path + ".tmp", self.stats_path)
+            except OSError as e:
+                log.warning("msg=\"artifact stats not shared\" error=%r", str(e))
+        return stats
+
+    def stats(self):
+        with self._lock:
+            stats = {**self._stats, "directories": dict(self._stats["directories"])}
+        if stats["sweeps"] == 0 and self.stats_path:
+            try:
+                with open(self.stats_path) as f:
+                    return json.load(f)          # swept by another process
+            except (OSError, ValueError):
+                pass
+        return stats
+
+    def start(self, interval_s):
+        """Starts the background sweeper (once per process)."""
+        if self._thread is not None:
+            return
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    log.warning("msg=\"artifact sweep failed\" error=%r", str(e))
+                self._stop.wait(interval_s)
+        self._thread = threading.Thread(target=run, name="artifact-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,728 @@
+"""
+benchmark.py  —  Offline benchmarks for the PureCheck and Quality Analysis app
+Runs without hardware or network. Results are printed and written as JSON.
+
+    python benchmark.py history-index --tests 1000000 --users 10000
+    python benchmark.py endpoints --sizes 1000,100000,1000000
+    python benchmark.py endpoints --url http://127.0.0.1:8000      # running gunicorn
+    python benchmark.py endpoints --compare old_results.json        # flag regressions
+    python benchmark.py rollups --tests 1000000
+    python benchmark.py records --tests 1000000
+    python benchmark.py payloads --tests 100000
+    python benchmark.py warmup --tests 100000 --runs 3
+    python benchmark.py changes --tests 1000000
+    python benchmark.py realtime-clients --url http://127.0.0.1:5000 --clients 10,100,1000
+
+The endpoint scenario runs the app in a throw-away working directory seeded
+with synthetic history, so real analysis_history.json / feedback data and the
+live Render deployment are never touched.
+"""
+import argparse, asyncio, gc, json, os, random, shutil, statistics, subprocess, sys, tempfile, time, tracemalloc
+import http.client, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_USER = "user0"
+BENCH_PASSWORD = "bench"
+
+SAMPLE_TYPES = ["milk", "meat", "water"]
+
+
+def synthetic_history(n, users, seed=42):
+    """Generates n analysis entries shaped like the ones app.py stores."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    history = []
+    for i in range(n):
+        sensor = rng.uniform(0.0, 0.12)
+        level = "safe" if sensor <= 0.04 else ("caution" if sensor <= 0.05 else "danger")
+        history.append({
+            "timestamp": (start + timedelta(seconds=30 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+            "sample_type": rng.choice(SAMPLE_TYPES),
+            "detected_level": round(sensor, 2),
+            "level": level,
+            "ph_value": round(rng.uniform(6.3, 6.9), 2),
+            "ph_status": "neutral",
+            "plot_url": f"/static/plots/plot_{i}.png",
+            "user": f"user{rng.randrange(users)}",
+            "latitude": "11.0809615",
+            "longitude": "76.9983231",
+        })
+    return history
+
+
+def synthetic_feedback(n, seed=42):
+    rng = random.Random(seed)
+    words = ["great", "fast", "accurate", "slow", "helpful", "confusing", "clean", "reliable"]
+    return [{
+        "name": f"Reviewer {i}",
+        "email": "",
+        "message": " ".join(rng.choice(words) for _ in range(8)),
+        "rating": str(rng.randint(1, 5)),
+        "timestamp": "2025-01-01 12:00:00",
+        "sentiment": rng.choice(["Positive", "Neutral", "Negative"]),
+    } for i in range(n)]
+
+
+def prepare_workspace(tests, users, feedback, path=None):
+    """Creates a working directory the app can run in, seeded with synthetic data."""
+    work = path or tempfile.mkdtemp(prefix="pyexpo-bench-")
+    os.makedirs(os.path.join(work, "static"), exist_ok=True)
+    for name in ("pdf_bg.png", "style.css", "steroid_graph.png"):
+        src = os.path.join(HERE, "static", name)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(work, "static", name))
+    with open(os.path.join(work, "users.json"), "w") as f:
+        json.dump({BENCH_USER: BENCH_PASSWORD}, f)
+    with open(os.path.join(work, "analysis_history.json"), "w") as f:
+        json.dump(synthetic_history(tests, users), f, indent=2)
+    with open(os.path.join(work, "feedback_data.json"), "w") as f:
+        json.dump(synthetic_feedback(feedback), f, indent=2)
+    return work
+
+
+def timed_ms(fn, repeat):
+    """Runs fn repeat times and returns per-call latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "n":       len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "p50_ms":  round(samples[len(samples) // 2], 4),
+        "p99_ms":  round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 4),
+        "max_ms":  round(samples[-1], 4),
+    }
+
+
+# =============================================
+# SCENARIOS
+# =============================================
+
+def bench_history_index(args):
+    """Partition index lookups vs. the old full-list filter."""
+    import app
+    rng = random.Random(7)
+    history = synthetic_history(args.tests, args.users)
+
+    t0 = time.perf_counter()
+    partitions = app.build_history_index(history)
+    build_s = time.perf_counter() - t0
+
+    def pick():
+        return f"user{rng.randrange(args.users)}", rng.choice(SAMPLE_TYPES)
+
+    def indexed():
+        user, sample_type = pick()
+        app.partition_tail(partitions, history, user, sample_type, 9)
+        app.partition_tail(partitions, history, user, None, 1)
+
+    def scan():
+        user, sample_type = pick()
+        relevant = [h for h in history
+                    if h.get("sample_type", "milk") == sample_type and h.get("user") == user]
+        relevant[-9:]
+        mine = [h for h in history if h.get("user") == user]
+        mine[-1:]
+
+    return {
+        "tests": args.tests,
+        "users": args.users,
+        "index_build_s": round(build_s, 3),
+        "partitions": len(partitions),
+        "indexed_lookup": summarize(timed_ms(indexed, args.repeat)),
+        "linear_scan": summarize(timed_ms(scan, max(1, min(args.repeat, args.scan_repeat)))),
+    }
+
+
+def bench_records(args):
+    """Memory per test and scan speed: history as parsed dicts vs. records.RecordTable."""
+    from records import analysis_table
+    text = json.dumps(synthetic_history(args.tests, args.users))
+    t0 = time.perf_counter()
+    history = json.loads(text)
+    parse_s = time.perf_counter() - t0
+    table = analysis_table()
+    t0 = time.perf_counter()
+    table.extend(history)
+    build_s = time.perf_counter() - t0
+
+    # tracemalloc slows allocation a lot, so memory is measured on a sample
+    sample = history[:100_000]
+    sample_text = json.dumps(sample)
+    gc.collect()
+    tracemalloc.start()
+    parsed = json.loads(sample_text)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    del parsed
+    tracemalloc.stop()
+    tracemalloc.start()
+    sample_table = analysis_table()
+    sample_table.extend(sample)
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    del sample_table
+    tracemalloc.stop()
+
+    mismatches = sum(1 for i in range(0, len(history), max(1, len(history) // 10000))
+                     if json.dumps(table[i]) != json.dumps(history[i]))
+    rng = random.Random(3)
+    user = lambda: f"user{rng.randrange(args.users)}"
+    scan_repeat = max(1, min(args.repeat, args.scan_repeat))
+    t0 = time.perf_counter()
+    table[:len(sample)]
+    decode_s = time.perf_counter() - t0
+    return {
+        "tests": args.tests,
+        "dict_bytes_per_test": round(dict_bytes / len(sample), 1),
+        "table_bytes_per_test": round(table_bytes / len(sample), 1),
+        "table_nbytes_per_test": round(table.nbytes() / args.tests, 1),
+        "json_parse_s": round(parse_s, 3),
+        "table_build_s": round(build_s, 3),
+        "round_trip_mismatches": mismatches,
+        "rows_decoded_per_s": round(len(sample) / decode_s),
+        "count_level_dicts": summarize(timed_ms(
+            lambda: sum(1 for h in history if h.get("level") == "safe"), scan_repeat)),
+        "count_level_table": summarize(timed_ms(lambda: table.count(level="safe"), args.repeat // 10)),
+        "latest_user_dicts": summarize(timed_ms(
+            lambda: [h for h in history if h.get("user") == user()][-5:], scan_repeat)),
+        "latest_user_table": summarize(timed_ms(lambda: table.latest(5, user=user()), args.repeat // 10)),
+    }
+
+
+def use_workspace(app):
+    """Re-opens app's file-backed state in the current directory (app is imported once per process)."""
+    app.history_index.update(signature=None, records=app.analysis_table(), partitions={}, end=0, last=None)
+    app.report_index.update(signature=None, reports={})
+    app.feedback_store = app.FeedbackStore(app.FEEDBACK_LOG_FILE, legacy_path=app.FEEDBACK_FILE).open()
+    app.payload_cache = app.PayloadCache()
+    app.search_state.update(reviews=app.SearchIndex(), tests=app.SearchIndex(), review_count=0,
+                            history_signature=None, history_end=0, last_test=None)
+    app.change_log = app.ChangeLog(app.CHANGE_LOG_FILE)
+    app.change_stats_cache.update(seq=None, stats=None)
+
+
+def cpu_us(fn, repeat):
+    """Mean CPU time per call in microseconds (process time, so waiting doesn't count)."""
+    t0 = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return round((time.process_time() - t0) / repeat * 1e6, 2)
+
+
+def bench_payloads(args):
+    """Per-poll CPU of the realtime endpoints: jsonify per request vs. cached pre-encoded bodies."""
+    work = prepare_workspace(args.tests, args.users, args.feedback)
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        import app, payloads
+        use_workspace(app)
+        snapshot = app.hw_snapshot()
+        live = dict(snapshot, connected=True, last_update=time.time() + 3600,
+                    data={"ph": 6.6, "sensor": 0.03, "temp": 24.1, "tds": 350, "turbidity": 4.2, "color": 3800})
+        client = app.app.test_client()
+        results = {"tests": args.tests, "encoder": "orjson" if payloads.orjson else "json"}
+        with app.app.app_context():
+            app.realtime_data_body(snapshot)             # load history once, outside the timings
+            for name, payload_fn, body_fn, snap in (
+                    ("realtime_data", app.realtime_data_payload, app.realtime_data_body, snapshot),
+                    ("sensor_stream_simulated", app.sensor_stream_payload, app.sensor_stream_body, snapshot),
+                    ("sensor_stream_hardware", app.sensor_stream_payload, app.sensor_stream_body, live)):
+                per_call = cpu_us(lambda: app.app.json.response(payload_fn(snap)), args.repeat)
+                cached = cpu_us(lambda: app.json_body_response(body_fn(snap)), args.repeat)
+                results[name] = {"jsonify_us": per_call, "cached_us": cached,
+                                 "speedup": round(per_call / cached, 1) if cached else None}
+        for path in ("/api/realtime-data", "/api/sensor-stream"):
+            results["request " + path] = {"cpu_us": cpu_us(lambda: client.get(path), max(1, args.repeat // 10))}
+        return results
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workspace:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def bench_changes(args):
+    """Idle dashboard traffic: re-fetching /api/realtime-data every 3 s vs. /api/changes deltas."""
+    work = prepare_workspace(args.tests, args.users, args.feedback)
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        import app
+        use_workspace(app)
+        client = app.app.test_client()
+        repeat = max(1, args.repeat // 10)
+        app.history_records()
+        t0 = time.perf_counter()
+        seq = app.sync_changes()                       # numbers the seeded history once
+        results = {"tests": args.tests, "first_sync_ms": round((time.perf_counter() - t0) * 1000, 1)}
+        for name, path in (("realtime_data", "/api/realtime-data"),
+                           ("changes_idle", f"/api/changes?since={seq}"),
+                           ("changes_one", f"/api/changes?since={seq - 1}")):
+            body = client.get(path).data
+            results[name] = {"bytes": len(body), "cpu_us": cpu_us(lambda: client.get(path), repeat)}
+        idle = results["changes_idle"]["bytes"]
+        results["bytes_per_idle_dashboard_minute"] = {
+            "realtime_data_every_3s": results["realtime_data"]["bytes"] * 20,
+            "changes_every_3s": idle * 20,
+            "changes_long_poll_25s": round(idle * 60 / 25),
+        }
+        return results
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workspace:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def bench_rollups(args):
+    """30-day trend from rollup buckets vs. scanning and aggregating raw history."""
+    import app
+    from rollups import Rollups, parse_timestamp
+    history = synthetic_history(args.tests, args.users)
+    workdir = tempfile.mkdtemp(prefix="pyexpo_rollups_")
+    try:
+        rollups = Rollups(os.path.join(workdir, "rollups.sqlite3"), app.SAFE_LIMITS)
+        t0 = time.perf_counter()
+        rollups.update(lambda: history)
+        build_s = time.perf_counter() - t0
+
+        end = parse_timestamp(history[-1]["timestamp"])
+        start = end - 30 * 86400
+        extra = synthetic_history(1, args.users, seed=99)
+        t0 = time.perf_counter()
+        rollups.update(lambda: history + extra)
+        incremental_s = time.perf_counter() - t0
+
+        def from_rollups():
+            rollups.query("tests:milk", start, end, max_points=500)
+
+        def from_raw():
+            vals = [h["detected_level"] for h in history
+                    if h.get("sample_type") == "milk" and start <= parse_timestamp(h["timestamp"]) <= end]
+            if vals:
+                min(vals), max(vals), sum(vals) / len(vals)
+
+        result = rollups.query("tests:milk", start, end, max_points=500)
+        return {
+            "tests": args.tests,
+            "initial_build_s": round(build_s, 3),
+            "incremental_update_s": round(incremental_s, 3),
+            "db_bytes": os.path.getsize(rollups.path),
+            "resolution_30d": result["resolution"],
+            "points_30d": len(result["points"]),
+            "rollup_query_30d": summarize(timed_ms(from_rollups, min(args.repeat, 1000))),
+            "raw_scan_30d": summarize(timed_ms(from_raw, max(1, min(args.repeat, args.scan_repeat)))),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ── endpoint scenario ─────────────────────────────────────
+
+class TestClientTarget:
+    """Drives the app in-process through Flask's test client."""
+    def __init__(self):
+        import app
+        self.app = app.app
+
+    def client(self):
+        c = self.app.test_client()
+        c.post("/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+        return c
+
+    @staticmethod
+    def call(c, method, path, data=None):
+        r = c.open(path, method=method, data=data)
+        body = r.data
+        r.close()
+        return r.status_code, len(body)
+
+
+class HttpTarget:
+    """Drives a running server (e.g. local gunicorn) over keep-alive HTTP."""
+    def __init__(self, url):
+        u = urllib.parse.urlsplit(url)
+        self.host, self.port = u.hostname, u.port or 80
+
+    def client(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        conn.cookie = ""
+        self.call(conn, "POST", "/login", {"username": BENCH_USER, "password": BENCH_PASSWORD})
+        return conn
+
+    @staticmethod
+    def call(conn, method, path, data=None):
+        headers = {"Cookie": conn.cookie} if conn.cookie else {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn.request(method, path, body=body, headers=headers)
+        r = conn.getresponse()
+        payload = r.read()
+        cookie = r.getheader("Set-Cookie")
+        if cookie:
+            conn.cookie = cookie.split(";", 1)[0]
+        return r.status, len(payload)
+
+
+def detection_form(rng):
+    return {"sample_type": rng.choice(SAMPLE_TYPES), "sensor": f"{rng.uniform(0.0, 0.1):.3f}",
+            "weight": "1.0", "latitude": "11.0809615", "longitude": "76.9983231"}
+
+
+ENDPOINTS = [
+    # (name, method, path, heavy)  — heavy endpoints get --post-requests iterations
+    ("detection_post",   "POST", "/detection-testing", True),
+    ("sensor_stream",    "GET",  "/api/sensor-stream", False),
+    ("realtime_data",    "GET",  "/api/realtime-data", False),
+    ("download_report",  "GET",  "/download_report", True),
+    ("community_reviews", "GET", "/community-reviews", False),
+]
+
+
+def run_endpoint(target, method, path, requests, concurrency, seed):
+    """Runs requests calls spread over concurrency clients; returns latency + throughput."""
+    per_client = max(1, requests // concurrency)
+    statuses = {}
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        c = target.client()
+        samples = []
+        for _ in range(per_client):
+            data = detection_form(rng) if method == "POST" else None
+            t0 = time.perf_counter()
+            status, _ = target.call(c, method, path, data)
+            samples.append((time.perf_counter() - t0) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+        return samples
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = [s for chunk in pool.map(worker, range(concurrency)) for s in chunk]
+    wall = time.perf_counter() - t0
+    if any(not 200 <= status < 400 for status in statuses):
+        raise SystemExit(f"{method} {path} answered {statuses}")      # latencies of errors aren't results
+    result = summarize(samples)
+    result["throughput_rps"] = round(len(samples) / wall, 2) if wall else None
+    result["statuses"] = {str(k): v for k, v in sorted(statuses.items())}
+    return result
+
+
+def unthrottle(app, concurrency):
+    """Lifts limit_expensive in-process, where every request shares one client address and user."""
+    app.RATE_CLIENT_BURST = app.RATE_USER_BURST = 1e9
+    app.render_slots = app.RenderSlots("ratelimit_slots", max(concurrency, app.RENDER_CONCURRENCY))
+
+
+def bench_endpoints(args):
+    """Latency/throughput of the main endpoints at several history sizes."""
+    results = {}
+    if args.url:
+        target = HttpTarget(args.url)
+        sizes = ["server"]
+    else:
+        sizes = [int(x) for x in args.sizes.split(",")]
+    cwd = os.getcwd()
+    for size in sizes:
+        work = None
+        if size != "server":
+            print(f"  seeding {size} tests ...", flush=True)
+            work = prepare_workspace(size, args.users, args.feedback)
+            os.chdir(work)
+            target = TestClientTarget()
+            import app
+            use_workspace(app)
+            unthrottle(app, args.concurrency)
+        try:
+            per_size = {}
+            for name, method, path, heavy in ENDPOINTS:
+                n = args.post_requests if heavy else args.requests
+                per_size[name] = run_endpoint(target, method, path, n, args.concurrency, args.seed)
+                print(f"    {size:>9} {name:<18} p50={per_size[name]['p50_ms']:.2f}ms "
+                      f"rps={per_size[name]['throughput_rps']}", flush=True)
+            results[str(size)] = per_size
+        finally:
+            os.chdir(cwd)
+            if work and not args.keep_workspace:
+                shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+# ── realtime-clients scenario ─────────────────────────────
+# Simulates open dashboards against a running server: each client polls like
+# detection_testing.html does (sensor-stream 1.5s, hardware-status 2s,
+# realtime-data 3s), or with --mode sse holds one /api/sensor-events stream.
+
+DASHBOARD_POLLS = [("/api/sensor-stream", 1.5), ("/api/hardware-status", 2.0), ("/api/realtime-data", 3.0)]
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = line.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).strip() or b"0", 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return status, True
+    return status, headers.get("connection", "").lower() == "close"
+
+
+class _Conn:
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def get(self, path, timeout):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout)
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n\r\n".encode())
+        await self.writer.drain()
+        try:
+            status, close = await asyncio.wait_for(_read_response(self.reader), timeout)
+        except BaseException:
+            self.close()
+            raise
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def _poll_client(host, port, deadline, timeout, stats):
+    conn = _Conn(host, port)
+    next_due = {path: time.monotonic() + random.uniform(0, every) for path, every in DASHBOARD_POLLS}
+    try:
+        while True:
+            path = min(next_due, key=next_due.get)
+            due = next_due[path]
+            if due > deadline:
+                break
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            every = dict(DASHBOARD_POLLS)[path]
+            next_due[path] = due + every
+            stats["expected"] += 1
+            t0 = time.perf_counter()
+            try:
+                status = await conn.get(path, timeout)
+                stats["latencies"].append((time.perf_counter() - t0) * 1000)
+                stats["ok" if status == 200 else "errors"] += 1
+            except Exception:
+                stats["errors"] += 1
+    finally:
+        conn.close()
+
+
+async def _sse_client(host, port, deadline, timeout, stats):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(f"GET /api/sensor-events HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        await writer.drain()
+        frames = 0
+        while time.monotonic() < deadline:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                break
+            if line.startswith(b"data:"):
+                frames += 1
+        writer.close()
+        stats["frames"].append(frames)
+        stats["ok"] += 1
+    except Exception:
+        stats["errors"] += 1
+
+
+async def _run_clients(host, port, clients, duration, mode, timeout):
+    stats = {"expected": 0, "ok": 0, "errors": 0, "latencies": [], "frames": []}
+    deadline = time.monotonic() + duration
+    client = _sse_client if mode == "sse" else _poll_client
+    await asyncio.gather(*(client(host, port, deadline, timeout, stats) for _ in range(clients)))
+    return stats
+
+
+def bench_realtime_clients(args):
+    """How many concurrent dashboards one server process keeps responsive."""
+    if not args.url:
+        print("    skipped: realtime-clients needs --url of a running server (gunicorn or realtime_server.py)")
+        return {"skipped": "needs --url"}
+    u = urllib.parse.urlsplit(args.url)
+    results = {"url": args.url, "mode": args.mode, "duration_s": args.duration}
+    for n in [int(x) for x in args.clients.split(",")]:
+        stats = asyncio.run(_run_clients(u.hostname, u.port or 80, n, args.duration, args.mode, args.timeout))
+        row = {"clients": n, "ok": stats["ok"], "errors": stats["errors"]}
+        if args.mode == "sse":
+            frames = stats["frames"]
+            row["held"] = sum(1 for f in frames if f >= args.duration * 0.5)
+            row["frames_per_client_s"] = round(statistics.fmean(frames) / args.duration, 2) if frames else 0
+        else:
+            row["expected"] = stats["expected"]
+            row["success_ratio"] = round(stats["ok"] / stats["expected"], 3) if stats["expected"] else 0
+            if stats["latencies"]:
+                row.update(summarize(stats["latencies"]))
+        results[str(n)] = row
+        print(f"    {n:>6} clients  {row}", flush=True)
+    return results
+
+
+def compare(old, new, threshold):
+    """Prints p50 ratios new/old for every shared measurement; returns regressions."""
+    regressions = []
+    def walk(a, b, path):
+        if isinstance(a, dict) and isinstance(b, dict):
+            if "p50_ms" in a and "p50_ms" in b:
+                ratio = b["p50_ms"] / a["p50_ms"] if a["p50_ms"] else float("inf")
+                flag = "  ⚠️ REGRESSION" if ratio > threshold else ""
+                print(f"  {'/'.join(path):<55} {a['p50_ms']:>9.3f} → {b['p50_ms']:>9.3f} ms  x{ratio:.2f}{flag}")
+                if flag:
+                    regressions.append("/".join(path))
+                return
+            for k in a:
+                if k in b:
+                    walk(a[k], b[k], path + [k])
+    walk(old.get("scenarios", {}), new.get("scenarios", {}), [])
+    return regressions
+
+
+# ── warm-up scenario ──────────────────────────────────────
+
+def first_requests(warm, posts=6):
+    """Runs in a fresh interpreter inside a workspace: first and later detection POST latency."""
+    t0 = time.perf_counter()
+    import app
+    result = {"import_s": round(time.perf_counter() - t0, 3)}
+    if warm:
+        result["warmup_s"] = app.warm_up()["seconds"]
+    client = TestClientTarget().client()
+    rng = random.Random(1)
+    statuses = []
+
+    def post():
+        r = client.post("/detection-testing", data=detection_form(rng))
+        statuses.append(r.status_code)
+        r.close()
+    samples = timed_ms(post, posts)
+    if set(statuses) != {200}:
+        raise SystemExit(f"detection POST answered {statuses}")
+    result["first_ms"] = round(samples[0], 1)
+    result["steady_ms"] = round(statistics.median(samples[1:]), 1)
+    print(json.dumps(result))
+
+
+def bench_warmup(args):
+    """First detection POST of a fresh process, without and with warm_up() (as gunicorn.conf.py runs it)."""
+    work = prepare_workspace(args.tests, args.users, args.feedback)
+    env = dict(os.environ, WARM_UP_ON_START="0", PYTHONPATH=HERE,
+               RATE_LIMIT_CLIENT_BURST="1000", RATE_LIMIT_USER_BURST="1000")
+    results = {}
+    try:
+        for mode in ("cold", "warm"):
+            runs = []
+            for _ in range(args.runs):
+                code = f"import benchmark; benchmark.first_requests({mode == 'warm'})"
+                out = subprocess.run([sys.executable, "-c", code], cwd=work, env=env,
+                                     capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads(out.strip().splitlines()[-1]))
+                print(f"    {mode:<5} {runs[-1]}", flush=True)
+            results[mode] = {key: round(statistics.median(r[key] for r in runs), 3) for key in runs[0]}
+        results["first_request_speedup"] = round(results["cold"]["first_ms"] / results["warm"]["first_ms"], 1)
+    finally:
+        if not args.keep_workspace:
+            shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+SCENARIOS = {
+    "history-index": bench_history_index,
+    "endpoints": bench_endpoints,
+    "realtime-clients": bench_realtime_clients,
+    "rollups": bench_rollups,
+    "records": bench_records,
+    "payloads": bench_payloads,
+    "warmup": bench_warmup,
+    "changes": bench_changes,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS) + ["all"])
+    parser.add_argument("--tests", type=int, default=1_000_000, help="synthetic tests in history")
+    parser.add_argument("--users", type=int, default=10_000, help="distinct synthetic users")
+    parser.add_argument("--repeat", type=int, default=10_000, help="iterations per measurement")
+    parser.add_argument("--scan-repeat", type=int, default=5, help="iterations for slow baselines")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="history sizes for endpoints")
+    parser.add_argument("--feedback", type=int, default=1000, help="synthetic reviews for endpoints")
+    parser.add_argument("--requests", type=int, default=500, help="requests per cheap endpoint")
+    parser.add_argument("--post-requests", type=int, default=20, help="requests per render/PDF endpoint")
+    parser.add_argument("--concurrency", type=int, default=1, help="parallel clients")
+    parser.add_argument("--url", help="benchmark a running server instead of the test client")
+    parser.add_argument("--keep-workspace", action="store_true", help="don't delete seeded workspaces")
+    parser.add_argument("--seed", type=int, default=1, help="RNG seed for request payloads")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per mode for warmup")
+    parser.add_argument("--clients", default="10,100,1000", help="concurrent dashboards for realtime-clients")
+    parser.add_argument("--mode", choices=["poll", "sse"], default="poll", help="realtime-clients behaviour")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per realtime-clients level")
+    parser.add_argument("--timeout", type=float, default=5.0, help="per-request timeout in seconds")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="p50 ratio counted as regression")
+    parser.add_argument("--out", default="bench_results.json", help="JSON results file")
+    args = parser.parse_args(argv)
+    args.out = os.path.abspath(args.out)
+    os.environ.setdefault("ARTIFACT_SWEEP_SECONDS", "0")   # keep the sweeper out of the timings
+    os.environ.setdefault("ROLLUP_INTERVAL_SECONDS", "0")
+    os.environ.setdefault("SEARCH_WARM_ON_START", "0")
+    os.environ.setdefault("WARM_UP_ON_START", "0")
+
+    names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = {
+        "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "scenarios": {},
+    }
+    for name in names:
+        print(f"▶ {name} ...", flush=True)
+        results["scenarios"][name] = SCENARIOS[name](args)
+        print(json.dumps(results["scenarios"][name], indent=2))
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"Comparing p50 against {args.compare}:")
+        if compare(previous, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
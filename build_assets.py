@@ -0,0 +1,259 @@
+"""
+build_assets.py  —  Fingerprints, optimizes and precompresses static assets.
+
+    python build_assets.py              # static/ -> static/dist/ + manifest.json
+    python build_assets.py --vendor     # first download the CDN fonts/icons/leaflet
+                                        # into static/vendor/ (commit that directory
+                                        # so offline lab installs have them)
+
+Every file under static/ (except runtime output such as plots/ and
+reports/) is copied to static/dist/<name>.<hash><ext>, so its URL changes
+whenever its content does and it can be served with an immutable
+Cache-Control. url(...) references inside CSS are rewritten to the
+fingerprinted names first, so a changed font or image also changes the
+stylesheet's hash. PNG/JPEG copies are re-encoded losslessly when that
+makes them smaller and get a .webp sibling (lossy for large backgrounds,
+where it is ~30x smaller); text assets get .gz (and .br when the brotli
+module is installed) siblings. app.py serves each variant at the same URL
+to clients that accept it. dist/manifest.json maps each source path to its
+fingerprinted path; templates look names up through asset_url() /
+vendor_url() in app.py and fall back to the plain files (or the CDN) when
+no build has been run.
+"""
+import argparse, gzip, hashlib, io, json, logging, os, posixpath, re, sys, urllib.parse, urllib.request
+
+try:
+    import brotli        # optional — gzip alone is fine
+except ImportError:
+    brotli = None
+
+log = logging.getLogger("pyexpo.assets")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(HERE, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_FILE = os.path.join(DIST_DIR, "manifest.json")
+SKIP_DIRS = {"dist", "plots", "reports", "arduino"}     # generated at runtime / not web assets
+COMPRESSIBLE = {".css", ".js", ".json", ".svg", ".txt", ".map", ".ttf", ".otf", ".eot"}
+MIN_COMPRESS_BYTES = 512
+WEBP_LOSSY_MIN_BYTES = 64 * 1024   # large backgrounds get lossy WebP; charts/icons stay lossless
+WEBP_QUALITY = 85
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# CDN assets the templates use; --vendor mirrors them under static/vendor/.
+# integrity only applies to the CDN copy (local CSS gets its url()s rewritten).
+VENDOR_ASSETS = {
+    "fontawesome": {
+        "url": "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css",
+        "path": "vendor/fontawesome/css/all.min.css",
+    },
+    "poppins": {
+        "url": "https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600;700&display=swap",
+        "path": "vendor/poppins/poppins.css",
+    },
+    "leaflet_css": {
+        "url": "https://unpkg.com/leaflet@1.9.4/dist/leaflet.css",
+        "path": "vendor/leaflet/leaflet.css",
+        "integrity": "sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY=",
+    },
+    "leaflet_js": {
+        "url": "https://unpkg.com/leaflet@1.9.4/dist/leaflet.js",
+        "path": "vendor/leaflet/leaflet.js",
+        "integrity": "sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=",
+    },
+}
+# Google Fonts only serves woff2 to browsers it recognises
+FETCH_HEADERS = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                               "Chrome/120.0 Safari/537.36"}
+
+
+# ── vendoring ────────────────────────────────────────────────
+def _fetch(url):
+    req = urllib.request.Request(url, headers=FETCH_HEADERS)
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return resp.read()
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def vendor(static_dir=STATIC_DIR):
+    """Downloads VENDOR_ASSETS (and the fonts/images their CSS points at) into static/vendor/."""
+    for name, spec in VENDOR_ASSETS.items():
+        target = os.path.join(static_dir, spec["path"])
+        data = _fetch(spec["url"])
+        if target.endswith(".css"):
+            css = data.decode("utf-8")
+            css_url = urllib.parse.urlsplit(spec["url"])
+            refs = {}
+            for _, ref in CSS_URL_RE.findall(css):
+                if ref.startswith("data:") or ref in refs:
+                    continue
+                absolute = urllib.parse.urljoin(spec["url"], ref)
+                parsed = urllib.parse.urlsplit(absolute)
+                if parsed.netloc == css_url.netloc:
+                    # same CDN: keep its layout relative to the stylesheet (../webfonts/, images/)
+                    local = posixpath.relpath(parsed.path, posixpath.dirname(css_url.path))
+                else:
+                    local = posixpath.basename(parsed.path)      # e.g. fonts.gstatic.com files
+                _write(os.path.normpath(os.path.join(os.path.dirname(target), local)), _fetch(absolute))
+                refs[ref] = local
+            css = CSS_URL_RE.sub(lambda m: f"url({m.group(1)}{refs.get(m.group(2), m.group(2))}{m.group(1)})", css)
+            data = css.encode("utf-8")
+        _write(target, data)
+        log.info("msg=\"vendored\" asset=%s path=%s bytes=%d", name, spec["path"], len(data))
+
+
+# ── build ────────────────────────────────────────────────────
+def _sources(static_dir):
+    for root, dirs, files in os.walk(static_dir):
+        rel_root = os.path.relpath(root, static_dir)
+        if rel_root == ".":
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            if not name.startswith(".") and not name.endswith((".tmp", ".gz", ".br", ".webp")):
+                yield os.path.normpath(os.path.join(rel_root, name)).replace("\\", "/")
+
+
+def _optimize_image(data, ext):
+    """Lossless re-encode with Pillow; returns the smaller of the two."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            out = io.BytesIO()
+            if ext == ".png":
+                im.save(out, "PNG", optimize=True)
+            else:
+                im.save(out, "JPEG", optimize=True, progressive=True, quality="keep")
+    except Exception as e:
+        log.warning("msg=\"image not optimized\" error=%r", str(e))
+        return data
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+def _webp_variant(path, data):
+    """Writes path + ".webp" when WebP beats the (optimized) original."""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as im:
+            im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB")
+            out = io.BytesIO()
+            if len(data) >= WEBP_LOSSY_MIN_BYTES:
+                im.save(out, "WEBP", quality=WEBP_QUALITY, method=6)
+            else:
+                im.save(out, "WEBP", lossless=True, method=6)
+    except Exception as e:      # no Pillow / no WebP support
+        log.warning("msg=\"no webp variant\" path=%s error=%r", path, str(e))
+        return []
+    if out.tell() >= len(data):
+        return []
+    _write(path + ".webp", out.getvalue())
+    return [path + ".webp"]
+
+
+def _rewrite_css(css, rel_path, manifest):
+    """Points url(...) references at fingerprinted files (paths stay relative to dist/)."""
+    base = posixpath.dirname(rel_path)
+
+    def sub(m):
+        quote, ref = m.group(1), m.group(2)
+        if ref.startswith(("data:", "http:", "https:", "//", "#")):
+            return m.group(0)
+        path, suffix = re.match(r"([^?#]*)(.*)", ref).groups()     # keep ?v=... / #iefix
+        hashed = manifest.get(posixpath.normpath(posixpath.join(base, path)))
+        if hashed is None:
+            return m.group(0)
+        # the stylesheet itself ends up in dist/<base>/
+        new = posixpath.relpath(hashed, posixpath.join("dist", base))
+        return f"url({quote}{new}{suffix}{quote})"
+    return CSS_URL_RE.sub(sub, css)
+
+
+def _precompress(path, data):
+    written = []
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE or len(data) < MIN_COMPRESS_BYTES:
+        return written
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        _write(path + ".gz", gz)
+        written.append(path + ".gz")
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            _write(path + ".br", br)
+            written.append(path + ".br")
+    return written
+
+
+def build(static_dir=STATIC_DIR, prune=True):
+    """Writes dist/ and its manifest; returns the manifest dict."""
+    dist_dir = os.path.join(static_dir, "dist")
+    sources = sorted(_sources(static_dir))
+    # stylesheets last, so the files they reference already have hashed names
+    sources.sort(key=lambda p: p.endswith(".css"))
+    manifest, keep, stats = {}, set(), {"files": 0, "bytes_in": 0, "bytes_out": 0}
+    for rel in sources:
+        with open(os.path.join(static_dir, rel), "rb") as f:
+            data = f.read()
+        stats["bytes_in"] += len(data)
+        stem, ext = os.path.splitext(rel)
+        ext = ext.lower()
+        if ext in (".png", ".jpg", ".jpeg"):
+            data = _optimize_image(data, ".png" if ext == ".png" else ".jpg")
+        elif ext == ".css":
+            data = _rewrite_css(data.decode("utf-8"), rel, manifest).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        hashed = f"dist/{stem}.{digest}{ext}"
+        out = os.path.join(static_dir, hashed)
+        if not os.path.exists(out):
+            _write(out, data)
+        keep.add(os.path.normpath(out))
+        variants = _precompress(out, data)
+        if ext in (".png", ".jpg", ".jpeg"):
+            variants += _webp_variant(out, data)
+        keep.update(os.path.normpath(p) for p in variants)
+        manifest[rel] = hashed
+        stats["files"] += 1
+        stats["bytes_out"] += len(data)
+
+    os.makedirs(dist_dir, exist_ok=True)
+    _write(os.path.join(dist_dir, "manifest.json"), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    keep.add(os.path.normpath(os.path.join(dist_dir, "manifest.json")))
+    if prune:
+        for root, _, files in os.walk(dist_dir):
+            for name in files:
+                path = os.path.normpath(os.path.join(root, name))
+                if path not in keep:
+                    os.remove(path)
+    log.info("msg=\"assets built\" files=%d bytes_in=%d bytes_out=%d brotli=%s",
+             stats["files"], stats["bytes_in"], stats["bytes_out"], brotli is not None)
+    return manifest
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="ts=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].split("—")[-1].strip())
+    parser.add_argument("--vendor", action="store_true", help="download CDN assets into static/vendor/ first")
+    parser.add_argument("--static", default=STATIC_DIR, help="static directory (default: ./static)")
+    parser.add_argument("--no-prune", action="store_true", help="keep files from earlier builds in dist/")
+    args = parser.parse_args(argv)
+    if args.vendor:
+        try:
+            vendor(args.static)
+        except OSError as e:
+            log.error("msg=\"vendoring failed, templates keep using the CDN\" error=%r", str(e))
+            return 1
+    build(args.static, prune=not args.no_prune)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+bulk_reports.py  —  Bulk PDF report jobs rendered in a process pool.
+
+A job takes a list of tests and produces either
+  * zip — one PDF per test (the same files /reports/<id> serves, so they are
+          cached for later single downloads), packed into a ZIP, or
+  * pdf — one multi-page document. Pages are split into volumes rendered in
+          parallel and merged with pypdf when it is installed; without pypdf
+          a single volume is rendered (images are embedded once per
+          document, so that is still cheap per page).
+
+Rendering runs in a ProcessPoolExecutor sized to the CPUs available to this
+process (BULK_REPORT_WORKERS overrides), created on the first job and kept
+for later ones. Its processes come from a forkserver, never from a fork of
+the web process: that one runs request, sweeper and profiler threads, and a
+fork taken while one of them holds a lock would copy the lock held forever.
+Job state is a small JSON file next
+to the output, so any gunicorn worker can answer status/download requests
+for a job started by another one. The PDFs a running job packs are listed in
+<job>.inputs; protected() reads those files and the job states so the
+artifact sweeper (whichever process runs it) leaves a running job's inputs
+and a finished job's undownloaded output alone. A per-test PDF that
+disappears anyway is rendered again before it is zipped.
+"""
+import glob, json, logging, math, multiprocessing, os, threading, time, uuid, zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from fpdf import FPDF
+from pdf_report import build_pdf, add_test_page
+
+try:
+    from pypdf import PdfWriter      # optional — merges parallel volumes into one file
+except ImportError:
+    PdfWriter = None
+
+log = logging.getLogger("pyexpo.bulk")
+
+PROGRESS_SAVE_S = 0.5
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:           # Windows / macOS
+        return os.cpu_count() or 1
+
+
+def _pool_context():
+    # forkserver: the server imports __main__ (importing app starts no
+    # threads) and this module once, single-threaded, and forks every worker
+    # from there, so workers start with pdf_report imported and don't re-run
+    # the main module each. spawn where there is no forkserver (Windows).
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["__main__", __name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+# ── runs inside pool processes ─────────────────────────────
+def render_batch(jobs, public_url):
+    """Renders [(entry, path)] as single-test PDFs; returns the paths written."""
+    written = []
+    for entry, path in jobs:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        build_pdf(entry, entry.get("user") or "Guest", public_url=public_url).output(tmp)
+        os.replace(tmp, path)
+        written.append(path)
+    return written
+
+
+def render_volume(entries, public_url, path):
+    """Renders entries as consecutive pages of one PDF; returns the page count."""
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False, margin=0)
+    for entry in entries:
+        add_test_page(pdf, entry, entry.get("user") or "Guest", public_url=public_url)
+    pdf.output(path)
+    return len(entries)
+
+
+# ── job management (web process) ───────────────────────────
+class BulkReports:
+    def __init__(self, out_dir, workers=None, batch_size=16, volume_pages=250, on_rendered=None):
+        self.out_dir = out_dir
+        self.workers = workers or available_cpus()
+        self.batch_size = batch_size
+        self.volume_pages = volume_pages
+        self.on_rendered = on_rendered       # fn([(aid, user, path)]) for freshly rendered PDFs
+        self._last_save = {}
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+            return self._pool
+
+    def _discard_executor(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:       # a worker died; the next job starts a fresh pool
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _job_file(self, job_id):
+        return os.path.join(self.out_dir, f"{job_id}.json")
+
+    def _save(self, job, force=True):
+        now = time.monotonic()
+        if not force and now - self._last_save.get(job["id"], 0) < PROGRESS_SAVE_S:
+            return
+        self._last_save[job["id"]] = now
+        tmp = self._job_file(job["id"]) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._job_file(job["id"]))
+
+    def _inputs_file(self, job_id):
+        return os.path.join(self.out_dir, f"{job_id}.inputs")
+
+    def protected(self, keep_s=86400):
+        """Paths the sweeper must keep: running jobs' inputs, undownloaded outputs (for keep_s)."""
+        now = time.time()
+        paths = []
+        for job_file in glob.glob(os.path.join(self.out_dir, "*.json")):
+            job = self.load(os.path.basename(job_file)[:-len(".json")])
+            if not job or now - job["created"] > keep_s:
+                continue                 # abandoned (e.g. its worker was killed): let it expire
+            if job["status"] in ("queued", "running"):
+                paths.append(job_file)
+                try:
+                    with open(self._inputs_file(job["id"])) as f:
+                        paths.extend(line.rstrip("\n") for line in f)
+                except FileNotFoundError:
+                    pass
+            elif job["status"] == "done" and not job.get("downloaded") and job["output"]:
+                paths += [job_file, job["output"]]
+        return paths
+
+    def mark_downloaded(self, job):
+        """Lets the sweeper expire the job's output like any other artifact."""
+        if not job.get("downloaded"):
+            job["downloaded"] = time.time()
+            self._save(job)
+
+    def load(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._job_file(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def submit(self, items, fmt, owner, public_url=None, filters=None):
+        """items: [(aid, entry, cached_path or None, target_path)], oldest first."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        job = {
+            "id": uuid.uuid4().hex[:16],
+            "owner": owner,
+            "format": fmt,
+            "filters": filters or {},
+            "status": "queued",
+            "total": len(items),
+            "done": 0,
+            "workers": self.workers,
+            "created": time.time(),
+            "finished": None,
+            "output": None,
+            "bytes": None,
+            "error": None,
+        }
+        if fmt == "zip":
+            with open(self._inputs_file(job["id"]), "w") as f:
+                f.writelines(f"{cached or target}\n" for _, _, cached, target in items)
+        self._save(job)
+        threading.Thread(target=self._run, args=(job, items, public_url),
+                         name=f"bulk-{job['id']}", daemon=True).start()
+        return job
+
+    def _run(self, job, items, public_url):
+        job["status"] = "running"
+        job["started"] = time.time()
+        self._save(job)
+        try:
+            if not items:
+                raise ValueError("no tests match the filter")
+            pool = self._executor()
+            try:
+                if job["format"] == "zip":
+                    output = self._run_zip(pool, job, items, public_url)
+                else:
+                    output = self._run_pdf(pool, job, items, public_url)
+            except BrokenProcessPool:
+                self._discard_executor(pool)
+                raise
+            job.update(status="done", output=output, bytes=os.path.getsize(output))
+            log.info("msg=\"bulk report done\" job=%s tests=%d seconds=%.2f",
+                     job["id"], job["total"], time.time() - job["started"])
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            log.error("msg=\"bulk report failed\" job=%s error=%r", job["id"], str(e))
+        job["finished"] = time.time()
+        self._save(job)
+        self._last_save.pop(job["id"], None)
+        try:
+            os.remove(self._inputs_file(job["id"]))
+        except FileNotFoundError:
+            pass
+
+    def _render_batches(self, pool, todo, public_url, job=None):
+        futures = {}
+        for i in range(0, len(todo), self.batch_size):
+            batch = todo[i:i + self.batch_size]
+            futures[pool.submit(render_batch, [(entry, target) for _, entry, target in batch], public_url)] = batch
+        for future in as_completed(futures):
+            future.result()
+            batch = futures[future]
+            if self.on_rendered:
+                self.on_rendered([(aid, entry.get("user"), target) for aid, entry, target in batch])
+            if job is not None:
+                job["done"] += len(batch)
+                self._save(job, force=False)
+
+    def _run_zip(self, pool, job, items, public_url):
+        todo = [(aid, entry, target) for aid, entry, cached, target in items if not cached]
+        job["done"] = len(items) - len(todo)
+        self._render_batches(pool, todo, public_url, job)
+
+        # Cached PDFs may have been removed since submit (by hand, or by a sweep
+        # that predates the inputs file): render those again rather than fail.
+        sources = [(aid, entry, cached if cached and os.path.exists(cached) else target)
+                   for aid, entry, cached, target in items]
+        missing = [(aid, entry, target) for aid, entry, target in sources if not os.path.exists(target)]
+        if missing:
+            log.warning("msg=\"bulk inputs re-rendered\" job=%s count=%d", job["id"], len(missing))
+            self._render_batches(pool, missing, public_url)
+
+        output = os.path.join(self.out_dir, f"{job['id']}.zip")
+        tmp = output + ".tmp"
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:   # PDFs are already deflated
+            for aid, entry, source in sources:
+                stamp = (entry.get("timestamp") or "")[:10] or "undated"
+                zf.write(source, f"{stamp}_{entry.get('sample_type', 'sample')}_{aid}.pdf")
+        os.replace(tmp, output)
+        return output
+
+    def _run_pdf(self, pool, job, items, public_url):
+        entries = [entry for _, entry, _, _ in items]
+        output = os.path.join(self.out_dir, f"{job['id']}.pdf")
+        if PdfWriter is None:
+            volumes = [entries]
+        else:
+            per_volume = min(self.volume_pages, math.ceil(len(entries) / self.workers))
+            volumes = [entries[i:i + per_volume] for i in range(0, len(entries), per_volume)]
+        if len(volumes) == 1:
+            job["done"] += pool.submit(render_volume, entries, public_url, output + ".tmp").result()
+            os.replace(output + ".tmp", output)
+            return output
+
+        paths = [os.path.join(self.out_dir, f"{job['id']}_part{i:04d}.pdf") for i in range(len(volumes))]
+        futures = [pool.submit(render_volume, vol, public_url, path) for vol, path in zip(volumes, paths)]
+        for future in as_completed(futures):
+            job["done"] += future.result()
+            self._save(job, force=False)
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        with open(output + ".tmp", "wb") as f:
+            writer.write(f)
+        os.replace(output + ".tmp", output)
+        for path in paths:
+            os.remove(path)
+        return output
@@ -0,0 +1,162 @@
+"""
+changefeed.py  —  Sequence numbers for history and review writes, shared by all workers.
+
+    changes.log     one 13-byte record per change: kind, key, check
+
+Every test added to the analysis history and every review added to the
+feedback log gets the next sequence number (its record's 1-based position in
+changes.log). A dashboard that has applied everything up to N asks for the
+changes after N and gets only what was written since, so its traffic
+follows the write rate instead of the size of the history.
+
+Records are written by sync(): the caller says how many tests and reviews
+exist now, and the log numbers the ones it has not seen yet under an
+exclusive flock. That makes sync() idempotent — every gunicorn worker may
+call it whenever it notices new data, and tests written by another process
+(or by hand) are still numbered exactly once. As in feedback_store, each
+process keeps the log in memory and only reads the tail other workers
+appended.
+
+The check of the newest numbered test is a CRC of its id. When the history
+file has been rewritten instead of appended to, that test no longer matches
+and sync() writes a RESET record before numbering every test again; a
+client whose cursor is older than a reset reloads rather than applying
+deltas.
+"""
+import os, struct, threading, zlib
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RECORD = struct.Struct("<BQI")        # kind, key (test row / review id / reset kind), check
+RESET, TEST, REVIEW = 0, 1, 2
+
+
+def check_of(text):
+    """Nonzero CRC of a test id (0 marks records that carry no check)."""
+    return zlib.crc32(text.encode("utf-8")) or 1
+
+
+class ChangeLog:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._reset()
+
+    def _reset(self):
+        self._kinds = bytearray()
+        self._keys = array("Q")
+        self._size = 0
+        self._last_test = None        # (row, check) of the newest numbered test
+        self._last_review = 0         # id of the newest numbered review
+        self._last_reset = 0          # sequence number of the newest RESET record
+
+    def _add(self, kind, key, check):
+        self._kinds.append(kind)
+        self._keys.append(key)
+        if kind == TEST:
+            if check:
+                self._last_test = (key, check)
+        elif kind == REVIEW:
+            self._last_review = key
+        else:
+            self._last_reset = len(self._kinds)
+            if key == TEST:
+                self._last_test = None
+            else:
+                self._last_review = 0
+
+    def _refresh(self):
+        """Loads records other processes appended since the last call."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._size:
+            self._reset()                 # log deleted or replaced: every cursor is stale
+        if size == self._size:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._size)
+            tail = f.read(size - self._size)
+        whole = len(tail) - len(tail) % RECORD.size      # ignore a record still being written
+        for rec in RECORD.iter_unpack(tail[:whole]):
+            self._add(*rec)
+        self._size += whole
+
+    def _pending(self, tests, test_check, reviews):
+        """Records needed to number every test row < tests and review id <= reviews."""
+        records = []
+        start = 0
+        if self._last_test is not None:
+            row, check = self._last_test
+            if row >= tests or test_check(row) != check:
+                records.append((RESET, TEST, 0))
+            else:
+                start = row + 1
+        if start < tests:
+            # only the newest test of a batch carries a check; it is the one sync() compares
+            records.extend((TEST, row, 0) for row in range(start, tests - 1))
+            records.append((TEST, tests - 1, test_check(tests - 1)))
+        start = self._last_review + 1
+        if self._last_review > reviews:
+            records.append((RESET, REVIEW, 0))
+            start = 1
+        records.extend((REVIEW, rid, 0) for rid in range(start, reviews + 1))
+        return records
+
+    # ── writing ──────────────────────────────────────────────
+    def sync(self, tests, test_check, reviews):
+        """Numbers tests (rows 0..tests-1) and reviews (ids 1..reviews) not numbered yet.
+
+        test_check(row) returns check_of() the test's id. Returns the latest sequence number.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._pending(tests, test_check, reviews):
+                return len(self._kinds)
+            with open(self.path, "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self._refresh()               # another worker may have numbered them meanwhile
+                    records = self._pending(tests, test_check, reviews)
+                    f.write(b"".join(RECORD.pack(*r) for r in records))
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            for r in records:
+                self._add(*r)
+            self._size += len(records) * RECORD.size
+            self._changed.notify_all()
+            return len(self._kinds)
+
+    # ── reading ──────────────────────────────────────────────
+    def latest(self):
+        with self._lock:
+            self._refresh()
+            return len(self._kinds)
+
+    def since(self, seq, limit):
+        """(changes, reset) after sequence number seq: up to limit (seq, kind, key) tuples.
+
+        reset is True when seq predates a RESET record (or the log itself was replaced),
+        i.e. the caller's copy can't be patched and has to be reloaded.
+        """
+        with self._lock:
+            self._refresh()
+            total = len(self._kinds)
+            if seq > total or seq < self._last_reset:
+                return [], True
+            end = min(total, seq + limit)
+            return [(i + 1, self._kinds[i], self._keys[i]) for i in range(seq, end)], False
+
+    def wait(self, seq, timeout):
+        """Waits up to timeout for this process to number a change after seq; True if it did."""
+        with self._lock:
+            return self._changed.wait_for(lambda: len(self._kinds) > seq, timeout)
@@ -0,0 +1,34 @@
+"""
+conftest.py  —  Shared pytest fixtures for the focused test_*.py modules.
+
+The older test_post.py / test_live.py / test_pdf.py / test_email.py are
+scripts against a running server; run the pytest modules by name, e.g.
+python -m pytest -q test_rollups.py test_summary_report.py
+"""
+import importlib, os, sys
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def webapp(tmp_path_factory):
+    """app imported in a scratch working directory (its data files are cwd-relative)."""
+    os.environ["WARM_UP_ON_START"] = "0"
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("webapp"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        module = importlib.import_module("app")
+        module.RATE_CLIENT_BURST = module.RATE_USER_BURST = 1e9
+        yield module
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(webapp):
+    """Test client logged in as alice."""
+    c = webapp.app.test_client()
+    with c.session_transaction() as s:
+        s["user"] = "alice"
+    return c
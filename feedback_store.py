@@ -0,0 +1,257 @@
+"""
+feedback_store.py  —  Append-only review log with a fixed-width offset index.
+
+    feedback.jsonl        one review per line, oldest first (ids are 1-based line numbers)
+    feedback.jsonl.idx    one 14-byte record per review: offset, length, rating, sentiment
+
+Appending a review writes one line and one index record under an exclusive
+flock, so it costs the same with ten reviews or ten million, and gunicorn
+workers never interleave writes. Each process keeps the index in memory
+(offsets plus per-rating / per-sentiment id lists) and only reads the tail
+of the .idx file that other workers added since its last look. A page of
+reviews is then a bisect into an id list and one pread per review shown;
+stats() is answered from the list lengths without touching the log.
+
+A legacy feedback_data.json (a JSON list) is imported once, ordered by
+timestamp, when the log does not exist yet.
+"""
+import json, logging, os, struct, threading
+from array import array
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger("pyexpo.feedback")
+
+RECORD = struct.Struct("<QIBB")           # offset, length, rating (1-5), sentiment code
+SENTIMENTS = ("Neutral", "Positive", "Negative")
+_SENTIMENT_CODES = {name: code for code, name in enumerate(SENTIMENTS)}
+
+
+def _rating(value):
+    try:
+        return min(5, max(1, int(value)))
+    except (TypeError, ValueError):
+        return 5                          # older reviews without a rating counted as 5
+
+
+def _sentiment(value):
+    return _SENTIMENT_CODES.get(value, 0)
+
+
+class FeedbackStore:
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.legacy_path = legacy_path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._ratings = bytearray()
+        self._sentiments = bytearray()
+        self._by_rating = {r: array("I") for r in range(1, 6)}
+        self._by_sentiment = {c: array("I") for c in range(len(SENTIMENTS))}
+        self._rating_sum = 0
+        self._index_size = 0
+
+    # ── index maintenance ────────────────────────────────────
+    def _add_to_memory(self, offset, length, rating, sentiment):
+        rid = len(self._offsets) + 1
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._ratings.append(rating)
+        self._sentiments.append(sentiment)
+        self._by_rating[rating].append(rid)
+        self._by_sentiment[sentiment].append(rid)
+        self._rating_sum += rating
+
+    def _refresh(self):
+        """Loads index records other processes appended since the last call."""
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._index_size:
+            self._reset()                 # index was rebuilt elsewhere
+        if size == self._index_size:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_size)
+            tail = f.read(size - self._index_size)
+        whole = len(tail) - len(tail) % RECORD.size      # ignore a record still being written
+        for rec in RECORD.iter_unpack(tail[:whole]):
+            self._add_to_memory(*rec)
+        self._index_size += whole
+
+    def _repair_locked(self, data):
+        """Indexes log lines that have no index record (crash between the two writes)."""
+        self._refresh()
+        end = self._offsets[-1] + self._lengths[-1] if self._offsets else 0
+        data.seek(0, os.SEEK_END)
+        size = data.tell()
+        if size < end:                    # log truncated or replaced: rebuild from scratch
+            open(self.index_path, "wb").close()
+            self._reset()
+            end = 0
+        if size == end:
+            return
+        data.seek(end)
+        records = []
+        offset = end
+        for line in data:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                review = json.loads(line)
+            except ValueError:
+                review = {}
+            records.append((offset, len(line), _rating(review.get("rating")), _sentiment(review.get("sentiment"))))
+            offset += len(line)
+        with open(self.index_path, "ab") as idx:
+            idx.write(b"".join(RECORD.pack(*r) for r in records))
+        for r in records:
+            self._add_to_memory(*r)
+        self._index_size += len(records) * RECORD.size
+        if records:
+            log.info("msg=\"feedback index repaired\" records=%d", len(records))
+
+    def _open_locked(self):
+        data = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(data, fcntl.LOCK_EX)
+        return data
+
+    def _migrate_legacy(self):
+        if os.path.exists(self.path) or not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        with open(self.legacy_path) as f:
+            reviews = json.load(f)
+        reviews.sort(key=lambda r: r.get("timestamp") or "")   # stable: equal stamps keep file order
+        with self._lock:
+            data = self._open_locked()
+            try:
+                data.seek(0, os.SEEK_END)
+                if data.tell() == 0:
+                    data.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in reviews))
+                    data.flush()
+                    self._repair_locked(data)
+                    log.info("msg=\"feedback imported\" source=%s reviews=%d", self.legacy_path, len(reviews))
+            finally:
+                data.close()
+
+    def open(self):
+        """Imports legacy data if needed and loads the index."""
+        self._migrate_legacy()
+        if os.path.exists(self.path):
+            with self._lock:
+                data = self._open_locked()
+                try:
+                    self._repair_locked(data)
+                finally:
+                    data.close()
+        return self
+
+    # ── writing ──────────────────────────────────────────────
+    def append(self, review):
+        """Appends one review; returns its id."""
+        line = json.dumps(review).encode("utf-8") + b"\n"
+        rec_rating, rec_sentiment = _rating(review.get("rating")), _sentiment(review.get("sentiment"))
+        with self._lock:
+            data = self._open_locked()
+            try:
+                self._repair_locked(data)
+                data.seek(0, os.SEEK_END)
+                offset = data.tell()
+                if offset:
+                    data.seek(offset - 1)
+                    if data.read(1) != b"\n":      # torn line from a crashed writer
+                        data.write(b"\n")
+                        offset += 1
+                data.write(line)
+                data.flush()
+                record = (offset, len(line), rec_rating, rec_sentiment)
+                with open(self.index_path, "ab") as idx:
+                    idx.write(RECORD.pack(*record))
+                self._add_to_memory(*record)
+                self._index_size += RECORD.size
+                return len(self._offsets)
+            finally:
+                data.close()
+
+    # ── reading ──────────────────────────────────────────────
+    def _read(self, ids):
+        out = []
+        if not ids:
+            return out
+        with open(self.path, "rb") as f:
+            for rid in ids:
+                f.seek(self._offsets[rid - 1])
+                review = json.loads(f.read(self._lengths[rid - 1]))
+                review["id"] = rid
+                out.append(review)
+        return out
+
+    def get(self, ids):
+        """Reviews by id, in the order given (unknown ids are skipped)."""
+        with self._lock:
+            self._refresh()
+            return self._read([rid for rid in ids if 0 < rid <= len(self._offsets)])
+
+    def _page_ids(self, before, limit, rating, sentiment):
+        """Up to limit ids below before, newest first (limit + 1 are looked up to detect more)."""
+        if rating is None and sentiment is None:
+            top = min(before, len(self._offsets) + 1)
+            return list(range(top - 1, max(0, top - 2 - limit), -1))
+        # Walk the shorter id list backwards, checking the other filter per id
+        lists = []
+        if rating is not None:
+            lists.append(self._by_rating.get(rating, array("I")))
+        if sentiment is not None:
+            lists.append(self._by_sentiment.get(sentiment, array("I")))
+        candidates = min(lists, key=len)
+        ids = []
+        i = bisect_left(candidates, before) - 1
+        while i >= 0 and len(ids) <= limit:
+            rid = candidates[i]
+            if (rating is None or self._ratings[rid - 1] == rating) and \
+               (sentiment is None or self._sentiments[rid - 1] == sentiment):
+                ids.append(rid)
+            i -= 1
+        return ids
+
+    def page(self, before=None, limit=20, rating=None, sentiment=None):
+        """Newest-first page of reviews with id < before.
+
+        Returns (reviews, next_cursor); next_cursor is None on the last page.
+        rating is 1-5, sentiment one of SENTIMENTS.
+        """
+        sentiment = None if sentiment is None else _SENTIMENT_CODES.get(sentiment, -1)
+        with self._lock:
+            self._refresh()
+            before = len(self._offsets) + 1 if before is None else before
+            ids = self._page_ids(before, limit, rating, sentiment)
+            more = len(ids) > limit
+            reviews = self._read(ids[:limit])
+        return reviews, (reviews[-1]["id"] if more else None)
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            count = len(self._offsets)
+            return {
+                "count": count,
+                "avg_rating": round(self._rating_sum / count, 1) if count else 0,
+                "ratings": {r: len(ids) for r, ids in self._by_rating.items()},
+                "sentiments": {SENTIMENTS[c]: len(ids) for c, ids in self._by_sentiment.items()},
+            }
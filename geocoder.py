@@ -0,0 +1,188 @@
+"""
+geocoder.py  —  Offline reverse geocoding against the bundled GeoNames gazetteer.
+
+    describe("11.0809615", "76.9983231")  ->  "near Coimbatore, Tamil Nadu, IN"
+
+geodata/cities1000.csv.gz (every place with 1000+ inhabitants, ~145k rows;
+see geodata/README.md) is loaded on first use. The index is a two-level
+grid: 0.5° latitude bands, each sorted by longitude, so a lookup bisects
+the bands around the query into a few contiguous slices and compares only
+those points (numpy dot products of unit vectors). The search square
+doubles until the nearest candidate is provably nearer than anything
+outside it, so sparse regions cost a couple of extra steps, not a scan.
+
+Lookups are memoised on coordinates rounded to 3 decimals (~110 m), which
+is finer than the gazetteer itself: the dashboard map, the export and the
+PDF reports ask about the same few lab locations over and over. No network
+access is ever needed.
+"""
+import csv, gzip, logging, math, os, threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+log = logging.getLogger("pyexpo.geocoder")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GAZETTEER_FILE = os.path.join(HERE, "geodata", "cities1000.csv.gz")
+BAND_DEG = 0.5
+EARTH_KM = 6371.0088
+KM_PER_DEG = EARTH_KM * math.pi / 180
+MAX_DISTANCE_KM = 100.0      # farther than this from any town (sea, desert): no name
+NEAR_KM = 5.0                # beyond this the label says "near <place>"
+CACHE_SIZE = 65536
+CACHE_DECIMALS = 3
+
+Place = namedtuple("Place", "name admin1 admin2 cc distance_km label")
+
+
+def parse_coordinates(lat, lon):
+    """(lat, lon) as floats from form/JSON values, or None if missing or invalid."""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):      # also rejects NaN
+        return None
+    return lat, lon
+
+
+def _unit(lat, lon):
+    phi, lam = math.radians(lat), math.radians(lon)
+    return np.array([math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)])
+
+
+class ReverseGeocoder:
+    def __init__(self, path=GAZETTEER_FILE, cache_size=CACHE_SIZE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._nearest_cached = lru_cache(maxsize=cache_size)(self._nearest)
+
+    # ── loading ──────────────────────────────────────────────
+    def load(self):
+        """Reads and indexes the gazetteer (once; later calls return immediately)."""
+        if self._loaded:
+            return self
+        with self._lock:
+            if self._loaded:
+                return self
+            lats, lons, places = [], [], []
+            interned = {}
+            try:
+                with gzip.open(self.path, "rt", encoding="utf-8", newline="") as f:
+                    for row in csv.DictReader(f):
+                        lats.append(float(row["lat"]))
+                        lons.append(float(row["lon"]))
+                        places.append((row["name"], *(interned.setdefault(row[k], row[k])
+                                                      for k in ("admin1", "admin2", "cc"))))
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("msg=\"gazetteer not loaded, locations stay unnamed\" path=%s error=%r",
+                            self.path, str(e))
+            lat, lon = np.array(lats), np.array(lons)
+            band = np.floor((lat + 90) / BAND_DEG).astype(np.int64)
+            order = np.lexsort((lon, band))
+            phi, lam = np.radians(lat[order]), np.radians(lon[order])
+            self._xyz = np.column_stack([np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)])
+            self._lon = lon[order].tolist()      # per band ascending, bisected with lo/hi bounds
+            self._places = [places[i] for i in order.tolist()]
+            self._bands = int(math.ceil(180 / BAND_DEG)) + 1
+            self._band_start = np.searchsorted(band[order], np.arange(self._bands + 1)).tolist()
+            self._loaded = True
+            log.info("msg=\"gazetteer loaded\" places=%d", len(self._places))
+        return self
+
+    # ── lookups ──────────────────────────────────────────────
+    def _slices(self, lat, lon, steps):
+        """Index ranges of the points within steps bands of lat and the matching longitude span."""
+        band = min(int((lat + 90) // BAND_DEG), self._bands - 1)
+        lo_band, hi_band = max(0, band - steps), min(self._bands - 1, band + steps)
+        # widen the longitude span by 1/cos(latitude) so it covers as many km as the bands do
+        edge = min(89.9, abs(lat) + (steps + 1) * BAND_DEG)
+        half = steps * BAND_DEG / math.cos(math.radians(edge))
+        if half >= 180:
+            spans = [(-180.0, 180.0)]
+        else:
+            west, east = lon - half, lon + half
+            spans = [(max(west, -180.0), min(east, 180.0))]
+            if west < -180:                     # across the antimeridian
+                spans.append((west + 360, 180.0))
+            if east > 180:
+                spans.append((-180.0, east - 360))
+        slices = []
+        for b in range(lo_band, hi_band + 1):
+            start, end = self._band_start[b], self._band_start[b + 1]
+            for west, east in spans:
+                i, j = bisect_left(self._lon, west, start, end), bisect_right(self._lon, east, start, end)
+                if i < j:
+                    slices.append((i, j))
+        return slices, half >= 180 and lo_band == 0 and hi_band == self._bands - 1
+
+    def _nearest(self, lat, lon):
+        if not self._places:
+            return None
+        q = _unit(lat, lon)
+        steps = 1
+        while True:
+            slices, everything = self._slices(lat, lon, steps)
+            if slices:
+                idx = np.concatenate([np.arange(i, j) for i, j in slices]) if len(slices) > 1 else \
+                    np.arange(*slices[0])
+                dots = self._xyz[idx] @ q
+                best = int(np.argmax(dots))
+                distance = EARTH_KM * math.acos(max(-1.0, min(1.0, float(dots[best]))))
+                # everything outside the searched square is > steps bands away
+                if distance <= steps * BAND_DEG * KM_PER_DEG or everything:
+                    break
+            elif everything:
+                return None
+            if steps * BAND_DEG * KM_PER_DEG > MAX_DISTANCE_KM:
+                return None
+            steps *= 2
+        if distance > MAX_DISTANCE_KM:
+            return None
+        name, admin1, admin2, cc = self._places[int(idx[best])]
+        parts = [name]
+        if admin2 and admin2 != name:
+            parts.append(admin2)
+        parts += [p for p in (admin1, cc) if p and p not in parts]
+        label = ", ".join(parts)
+        return Place(name, admin1, admin2, cc, round(distance, 2),
+                     label if distance <= NEAR_KM else f"near {label}")
+
+    def lookup(self, lat, lon):
+        """Nearest gazetteer place to the coordinates (strings are fine), or None."""
+        coords = parse_coordinates(lat, lon)
+        if coords is None:
+            return None
+        self.load()
+        return self._nearest_cached(round(coords[0], CACHE_DECIMALS), round(coords[1], CACHE_DECIMALS))
+
+    def describe(self, lat, lon):
+        """Human-readable place for the coordinates, or None when they can't be named."""
+        place = self.lookup(lat, lon)
+        return None if place is None else place.label
+
+    def stats(self):
+        info = self._nearest_cached.cache_info()
+        return {"places": len(self._places) if self._loaded else 0,
+                "cache_hits": info.hits, "cache_misses": info.misses, "cache_size": info.currsize}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_geocoder():
+    """Process-wide geocoder over GAZETTEER_FILE."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ReverseGeocoder()
+        return _default
+
+
+def describe(lat, lon):
+    """default_geocoder().describe(lat, lon)."""
+    return default_geocoder().describe(lat, lon)
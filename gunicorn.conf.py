@@ -0,0 +1,30 @@
+"""
+gunicorn.conf.py  —  Worker settings for `gunicorn app:app` (picked up from the working directory).
+
+post_worker_init warms each worker's caches (see "WARM-UP + HEALTH CHECKS"
+in app.py) before the worker enters the accept loop, so the first
+detection POST a worker serves costs the same as every later one. While it
+waits the worker keeps heart-beating, so gunicorn's timeout doesn't kill it.
+It also offers the worker for the shared background tasks; whichever worker
+gets their lock runs them (see "BACKGROUND TASKS" in app.py).
+
+on_starting empties the shared metrics directory, so counters start from zero
+with each master instead of adding onto the previous run's totals.
+
+Worker count and binding stay on the command line / WEB_CONCURRENCY.
+"""
+
+
+def on_starting(server):
+    import glob, os
+    for path in glob.glob(os.path.join(os.environ.get("METRICS_DIR", "metrics"), "metrics_*.json")):
+        os.remove(path)
+
+
+def post_worker_init(worker):
+    import app as pyexpo
+    pyexpo.start_background_tasks()
+    if not pyexpo.WARM_UP_ON_START:
+        return
+    state = pyexpo.warm_up(progress=worker.notify)
+    worker.log.info("worker %s warm in %.2fs %s", worker.pid, state["seconds"] or 0, state["steps"])
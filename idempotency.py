@@ -0,0 +1,118 @@
+"""
+idempotency.py  —  Short-lived dedupe cache for form submissions.
+
+Every idempotency key maps to two files in one directory:
+
+    <digest>.lock   created with O_CREAT|O_EXCL by the request that owns the key
+    <digest>.json   the stored result, written when that request completes
+
+so the first request to claim a key does the work and every repeat (double
+click, browser retry, a second gunicorn worker) either gets the stored
+result or waits briefly for the in-flight original. Nothing but the owner
+ever reaches storage or the renderers. Entries expire after ttl_s.
+"""
+import hashlib, json, logging, os, time
+
+log = logging.getLogger("pyexpo.idempotency")
+
+NEW, DONE, PENDING = "new", "done", "pending"
+
+
+class IdempotencyCache:
+    def __init__(self, directory, ttl_s=600, lock_timeout_s=60):
+        self.directory = directory
+        self.ttl_s = ttl_s
+        self.lock_timeout_s = lock_timeout_s   # owner presumed dead after this long
+        self._claims = 0
+
+    def _paths(self, scope, key):
+        digest = hashlib.sha256(f"{scope}\0{key}".encode("utf-8")).hexdigest()[:32]
+        base = os.path.join(self.directory, digest)
+        return base + ".lock", base + ".json"
+
+    def _read(self, result_path):
+        try:
+            st = os.stat(result_path)
+            if time.time() - st.st_mtime > self.ttl_s:
+                return None
+            with open(result_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def claim(self, scope, key):
+        """Returns (NEW, None) if this request owns the key, else (DONE, result) or (PENDING, None)."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._claims += 1
+        if self._claims % 100 == 0:
+            self.purge()
+        lock_path, result_path = self._paths(scope, key)
+        cached = self._read(result_path)
+        if cached is not None:
+            return DONE, cached
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return NEW, None
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.stat(lock_path).st_mtime > self.lock_timeout_s:
+                os.remove(lock_path)              # stale claim from a crashed worker
+                return self.claim(scope, key)
+        except FileNotFoundError:
+            return self.claim(scope, key)         # owner just finished or released
+        cached = self._read(result_path)
+        return (DONE, cached) if cached is not None else (PENDING, None)
+
+    def wait(self, scope, key, timeout_s=30.0, interval_s=0.1):
+        """Waits for an in-flight owner; returns its result, or None if it failed or timed out."""
+        lock_path, result_path = self._paths(scope, key)
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            cached = self._read(result_path)
+            if cached is not None:
+                return cached
+            if not os.path.exists(lock_path):
+                return self._read(result_path)
+            time.sleep(interval_s)
+        return None
+
+    def complete(self, scope, key, result):
+        lock_path, result_path = self._paths(scope, key)
+        tmp = f"{result_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp, result_path)
+        self._unlock(lock_path)
+
+    def release(self, scope, key):
+        """Gives the key up without a result (the work failed and may be retried)."""
+        self._unlock(self._paths(scope, key)[0])
+
+    @staticmethod
+    def _unlock(lock_path):
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    def purge(self):
+        """Deletes expired results and stale locks."""
+        now = time.time()
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for e in entries:
+            try:
+                age = now - e.stat().st_mtime
+                limit = self.lock_timeout_s if e.name.endswith(".lock") else self.ttl_s
+                if age > limit:
+                    os.remove(e.path)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            log.debug("msg=\"idempotency purge\" removed=%d", removed)
+        return removed
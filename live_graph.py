@@ -1,107 +1,277 @@
 """
 live_graph.py  —  Real-time terminal graph for the PureCheck and Quality Analysis
-Run in a SEPARATE terminal while python app.py is running.
+Run in a SEPARATE terminal while python app.py (or realtime_server.py) is running.
 Press Ctrl+C to stop.
-"""
-import time, urllib.request, json, os, shutil, sys
 
-URL   = "http://localhost:5000/api/sensor-stream"
-DELAY = 1.5          # seconds between polls
-MAX_H = 18           # chart height in rows
-COLS  = 55           # chart width in chars (data bars)
-history = []         # list of dicts from API
+    python live_graph.py                                   # sensor channel, 10 fps
+    python live_graph.py --channels sensor_reading,ph_value,temperature --fps 20
+
+Readings arrive over ONE persistent HTTP connection: the /api/sensor-events
+push stream when the server offers it (realtime_server.py), otherwise
+keep-alive polling of /api/sensor-stream. The screen is drawn once and then
+only the cells that changed are rewritten with ANSI cursor moves, so higher
+refresh rates and several channels don't flicker.
+"""
+import argparse, http.client, json, os, shutil, sys, threading, time, urllib.parse
+from collections import deque
 
-STATUS_ICONS = {"safe": "✅", "caution": "⚠️ ", "danger": "❌"}
 STATUS_COLOR = {"safe": "\033[92m", "caution": "\033[93m", "danger": "\033[91m"}
 RESET  = "\033[0m"
 BOLD   = "\033[1m"
 CYAN   = "\033[96m"
 YELLOW = "\033[93m"
 WHITE  = "\033[97m"
+DIM    = "\033[2m"
+
+# channel -> (label, unit, fixed display range or None for auto-scale)
+CHANNELS = {
+    "sensor_reading": ("Sensor", "mg/L", (0.0, 4.0)),
+    "detected_level": ("Detected", "mg/L", (0.0, 4.0)),
+    "ph_value":       ("pH", "", (0.0, 14.0)),
+    "temperature":    ("Temp", "°C", None),
+    "tds":            ("TDS", "ppm", None),
+    "turbidity":      ("Turbidity", "NTU", None),
+    "color":          ("Color", "", None),
+}
 
-def clear():
-    os.system('cls' if os.name == 'nt' else 'clear')
 
 def bar_char(status):
     return {"safe": "█", "caution": "▓", "danger": "▒"}.get(status, "░")
 
+
 def color(status):
     return STATUS_COLOR.get(status, WHITE)
 
-def draw(history, latest):
-    term_w = shutil.get_terminal_size((80, 24)).columns
-    max_val = 4.0   # sensor max display range
 
-    clear()
-    w = min(term_w - 2, 78)
-    print(BOLD + CYAN + "═" * w + RESET)
-    print(BOLD + CYAN + "  📊 LIVE SENSOR GRAPH  —  PureCheck and Quality Analysis" + RESET)
-    print(BOLD + CYAN + "═" * w + RESET)
+# =============================================
+# DATA SOURCE (background thread, one connection)
+# =============================================
+class SensorFeed:
+    """Keeps the newest readings in a ring buffer; fed by SSE or keep-alive polling."""
+
+    def __init__(self, base_url, size, poll_interval):
+        u = urllib.parse.urlsplit(base_url)
+        self.host, self.port = u.hostname or "localhost", u.port or 80
+        self.readings = deque(maxlen=size)
+        self.poll_interval = poll_interval
+        self.mode = "connecting"
+        self.error = None
+        self.version = 0
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _push(self, data):
+        with self.lock:
+            self.readings.append(data)
+            self.version += 1
+            self.error = None
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.readings), self.version, self.mode, self.error
+
+    def _connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=10)
+
+    def _stream(self, conn):
+        """Consumes /api/sensor-events; returns False if the server has no push stream."""
+        conn.request("GET", "/api/sensor-events", headers={"Accept": "text/event-stream"})
+        r = conn.getresponse()
+        if r.status != 200 or "text/event-stream" not in (r.getheader("Content-Type") or ""):
+            r.read()
+            return False
+        self.mode = "push"
+        while not self._stop.is_set():
+            line = r.fp.readline()
+            if not line:
+                raise ConnectionError("stream closed")
+            if line.startswith(b"data:"):
+                self._push(json.loads(line[5:]))
+        return True
+
+    def _poll(self, conn):
+        self.mode = "poll"
+        while not self._stop.is_set():
+            t0 = time.monotonic()
+            conn.request("GET", "/api/sensor-stream", headers={"Connection": "keep-alive"})
+            r = conn.getresponse()
+            body = r.read()
+            if r.status == 200:
+                self._push(json.loads(body))
+            if (r.getheader("Connection") or "").lower() == "close":
+                conn.close()     # sync gunicorn workers close after each response
+            self._stop.wait(max(0.0, self.poll_interval - (time.monotonic() - t0)))
+
+    def run(self):
+        push_supported = True
+        while not self._stop.is_set():
+            conn = self._connect()
+            try:
+                if push_supported and self._stream(conn):
+                    continue
+                push_supported = False
+                self._poll(conn)
+            except Exception as e:
+                with self.lock:
+                    self.error = str(e)
+                    self.mode = "reconnecting"
+                self._stop.wait(1.0)
+            finally:
+                conn.close()
+
+    def start(self):
+        threading.Thread(target=self.run, name="sensor-feed", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# =============================================
+# INCREMENTAL SCREEN
+# =============================================
+class Screen:
+    """Cell grid that writes only the cells that differ from the last frame."""
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.prev = {}            # (row, col) -> (style, char)
+        self.size = None
 
-    # Show latest values
+    def begin(self):
+        if os.name == 'nt':
+            os.system("")         # one-off: enables ANSI escape handling on Windows consoles
+        self.out.write("\033[?25l\033[2J")
+        self.out.flush()
+
+    def end(self):
+        self.out.write(f"{RESET}\033[?25h\n")
+        self.out.flush()
+
+    def draw(self, cells, size):
+        """cells: {(row, col): (style, char)} with 1-based coordinates."""
+        parts = []
+        if size != self.size:       # terminal resized — start from a clean slate
+            parts.append("\033[2J")
+            self.prev = {}
+            self.size = size
+        style = None
+        cursor = None
+        for pos in sorted(set(cells) | set(self.prev)):
+            cell = cells.get(pos, ("", " "))
+            if self.prev.get(pos, ("", " ")) == cell:
+                continue
+            if cell[0] != style:
+                parts.append(RESET + cell[0])
+                style = cell[0]
+            if pos != cursor:         # adjacent changed cells need no cursor move
+                parts.append(f"\033[{pos[0]};{pos[1]}H")
+            parts.append(cell[1])
+            cursor = (pos[0], pos[1] + 1)
+        if parts:
+            self.out.write("".join(parts) + RESET)
+            self.out.flush()
+        self.prev = cells
+
+
+def put(cells, row, col, text, style=""):
+    for i, ch in enumerate(text):
+        cells[(row, col + i)] = (style, ch)
+
+
+def build_frame(readings, channels, mode, error, fps, term_w, term_h):
+    cells = {}
+    w = min(term_w - 2, 100)
+    put(cells, 1, 1, "═" * w, BOLD + CYAN)
+    put(cells, 2, 3, "LIVE SENSOR GRAPH  —  PureCheck and Quality Analysis", BOLD + CYAN)
+    put(cells, 3, 1, "═" * w, BOLD + CYAN)
+
+    latest = readings[-1] if readings else None
     if latest:
-        st   = latest.get("status", "safe")
-        icon = STATUS_ICONS.get(st, "")
-        src  = "🔌 HARDWARE" if latest.get("source") == "hardware" else "🔵 SIMULATION"
-        print(f"\n  {src}  |  {icon} {color(st)}{BOLD}{st.upper()}{RESET}")
-        print(f"  Sensor : {BOLD}{latest.get('sensor_reading','--')} mg/L{RESET}"
-              f"   pH : {BOLD}{latest.get('ph_value','--')}{RESET}"
-              f"   Temp : {BOLD}{latest.get('temperature','--')} °C{RESET}"
-              f"   Sample : {BOLD}{latest.get('sample_type','--').title()}{RESET}")
-        safe_lim = latest.get('safe_limit', 0.05)
-        print(f"  Safe limit : {safe_lim} mg/L\n")
-
-    # ASCII bar chart — vertical bars, left to right
-    if len(history) > 1:
-        n = min(len(history), COLS)
-        recent = history[-n:]
-
-        # build rows top→bottom
-        chart_lines = []
-        for row in range(MAX_H, 0, -1):
-            thresh = (row / MAX_H) * max_val
-            line = ""
-            for pt in recent:
-                v = pt.get("sensor_reading", 0)
-                st = pt.get("status", "safe")
+        st = latest.get("status", "safe")
+        src = "HARDWARE" if latest.get("source") == "hardware" else "SIMULATION"
+        put(cells, 5, 3, f"{src}  |  ", BOLD)
+        put(cells, 5, 3 + len(src) + 5, st.upper().ljust(8), color(st) + BOLD)
+        values = "   ".join(f"{CHANNELS[c][0]}: {latest.get(c, '--')} {CHANNELS[c][1]}".strip() for c in channels)
+        put(cells, 6, 3, values[:w - 2].ljust(min(w - 2, 90)))
+        put(cells, 7, 3, f"Safe limit: {latest.get('safe_limit', 0.05)} mg/L   Sample: {str(latest.get('sample_type', '--')).title()}".ljust(40))
+    else:
+        put(cells, 5, 3, (f"Waiting for server... ({error})" if error else "Connecting...")[:w - 2], YELLOW)
+
+    top = 9
+    footer_rows = 3
+    chart_cols = max(10, w - 10)
+    avail = max(len(channels) * 4, term_h - top - footer_rows)
+    per_channel = avail // len(channels)
+    chart_h = max(2, per_channel - 2)
+    recent = readings[-chart_cols:]
+
+    for ci, ch in enumerate(channels):
+        label, unit, fixed = CHANNELS[ch]
+        base = top + ci * per_channel
+        vals = [float(r.get(ch, 0) or 0) for r in recent]
+        if fixed:
+            lo, hi = fixed
+        else:
+            lo, hi = (min(vals), max(vals)) if vals else (0.0, 1.0)
+            if hi - lo < 1e-9:
+                lo, hi = lo - 1, hi + 1
+        put(cells, base, 3, f"{label} ({unit})" if unit else label, BOLD + WHITE)
+        for row in range(chart_h):
+            thresh = hi - (row / chart_h) * (hi - lo)
+            y = base + 1 + row
+            put(cells, y, 3, (f"{thresh:7.2f}│" if row % 3 == 0 else "       │"), YELLOW)
+            for x, (pt, v) in enumerate(zip(recent, vals)):
                 if v >= thresh:
-                    line += color(st) + bar_char(st) + RESET
-                else:
-                    line += " "
-            chart_lines.append(line)
-
-        # y-axis labels + chart
-        for i, row_line in enumerate(chart_lines):
-            y_val = max_val - (i / MAX_H) * max_val
-            if i % 3 == 0:
-                label = f"{y_val:5.2f}│"
-            else:
-                label = f"     │"
-            print("  " + YELLOW + label + RESET + row_line)
-
-        # x-axis
-        print("  " + YELLOW + "     └" + "─" * n + RESET)
-        print("  " + YELLOW + "      " + f"← {n} readings (newest right)" + RESET)
-
-    print("\n" + BOLD + CYAN + "═" * min(w, 78) + RESET)
-    print(f"  Polling every {DELAY}s  |  Press Ctrl+C to stop")
-    print(BOLD + CYAN + "═" * min(w, 78) + RESET)
-
-latest = None
-print("Connecting to localhost:5000 ...")
-while True:
+                    st = pt.get("status", "safe")
+                    cells[(y, 11 + x)] = (color(st), bar_char(st))
+        put(cells, base + 1 + chart_h, 3, "       └" + "─" * len(recent), YELLOW)
+
+    f = top + len(channels) * per_channel
+    put(cells, f, 1, "═" * w, BOLD + CYAN)
+    put(cells, f + 1, 3, f"{'push stream' if mode == 'push' else mode}  |  {len(readings)} readings  |  "
+                         f"{fps:g} fps  |  Ctrl+C to stop", DIM)
+    put(cells, f + 2, 1, "═" * w, BOLD + CYAN)
+    return cells
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time terminal graph for the sensor stream")
+    parser.add_argument("--url", default="http://localhost:5000", help="server base URL")
+    parser.add_argument("--channels", default="sensor_reading",
+                        help="comma-separated: " + ",".join(CHANNELS))
+    parser.add_argument("--fps", type=float, default=10.0, help="screen refresh rate")
+    parser.add_argument("--poll", type=float, default=1.5, help="poll interval when no push stream")
+    parser.add_argument("--buffer", type=int, default=240, help="readings kept in memory")
+    args = parser.parse_args(argv)
+
+    channels = [c.strip() for c in args.channels.split(",") if c.strip()]
+    unknown = [c for c in channels if c not in CHANNELS]
+    if unknown:
+        parser.error(f"unknown channel(s): {', '.join(unknown)}")
+
+    feed = SensorFeed(args.url, args.buffer, args.poll)
+    feed.start()
+    screen = Screen()
+    screen.begin()
+    frame_s = 1.0 / max(args.fps, 0.5)
+    last_key = None
     try:
-        with urllib.request.urlopen(URL, timeout=3) as r:
-            data = json.loads(r.read())
-        history.append(data)
-        if len(history) > COLS:
-            history.pop(0)
-        latest = data
-        draw(history, latest)
+        while True:
+            t0 = time.monotonic()
+            readings, version, mode, error = feed.snapshot()
+            size = tuple(shutil.get_terminal_size((80, 24)))
+            key = (version, mode, error, size)
+            if key != last_key:           # nothing new — skip building the frame
+                screen.draw(build_frame(readings, channels, mode, error, args.fps, *size), size)
+                last_key = key
+            time.sleep(max(0.0, frame_s - (time.monotonic() - t0)))
     except KeyboardInterrupt:
-        print("\n\nStopped.")
-        sys.exit(0)
-    except Exception as e:
-        clear()
-        print(f"  ⚠️  Waiting for server... ({e})")
-    time.sleep(DELAY)
+        pass
+    finally:
+        feed.stop()
+        screen.end()
+        print("Stopped.")
+
+
+if __name__ == "__main__":
+    main()
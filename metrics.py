@@ -0,0 +1,254 @@
+"""
+metrics.py  —  Tiny in-process metrics registry with Prometheus text output.
+
+Counters, gauges and fixed-bucket histograms guarded by one lock; recording a
+sample is a dict lookup, a bisect and two additions, so it is cheap enough to
+leave on in production.
+
+gunicorn serves every worker behind one port, so a scrape reaches one
+arbitrary worker. With a directory, each process writes its registry to
+<directory>/metrics_<pid>.json (from start_publishing()'s thread, at most
+every few seconds, and just before it renders a scrape), and render() adds
+up every process's file: counters and histograms are summed, gauges report
+the largest value a live process published. A dead worker's counters are
+folded into metrics_dead.json, so totals never go backwards when gunicorn
+replaces a worker. Without a directory the registry covers this process only.
+"""
+import bisect, glob, json, os, threading, time, functools
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds — covers a JSON poll (sub-ms) up to a slow SMTP send
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _key_of(labels):
+    """Label key read back from JSON ([[k, v], ...])."""
+    return tuple((k, v) for k, v in labels)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS, directory=None):
+        self.buckets = tuple(buckets)
+        self.directory = directory      # shared by all workers; None = this process only
+        self._dirty = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._help = {}         # name -> (type, help)
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [bucket counts..., sum, count]
+        self._gauge_fns = []    # callables yielding (name, labels dict, value)
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    # ── recording ────────────────────────────────────────────
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        idx = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            h[idx] += 1
+            h[-2] += seconds
+            h[-1] += 1
+            self._dirty = True
+
+    def value(self, name, **labels):
+        """Current value of a counter (0 if never incremented)."""
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator form of timer()."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def gauge_callback(self, fn):
+        """Registers fn() -> iterable of (name, labels, value), sampled at scrape time."""
+        self._gauge_fns.append(fn)
+        return fn
+
+    def _gauges(self):
+        gauges = {}
+        for fn in self._gauge_fns:
+            try:
+                for name, labels, value in fn():
+                    gauges[(name, _label_key(labels))] = value
+            except Exception:
+                continue
+        return gauges
+
+    # ── sharing between processes ────────────────────────────
+    def publish(self):
+        """Writes this process's registry to the shared directory."""
+        with self._lock:
+            counters = [[name, key, value] for (name, key), value in self._counters.items()]
+            histograms = [[name, key, list(h)] for (name, key), h in self._histograms.items()]
+            self._dirty = False
+        gauges = [[name, key, value] for (name, key), value in self._gauges().items()]
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"metrics_{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"counters": counters, "histograms": histograms, "gauges": gauges}, f)
+        os.replace(path + ".tmp", path)
+
+    def start_publishing(self, interval_s=5.0):
+        """Publishes every interval_s while something changed (once per process)."""
+        if self.directory is None or self._thread is not None:
+            return
+        def run():
+            while True:
+                time.sleep(interval_s)
+                if self._dirty:
+                    try:
+                        self.publish()
+                    except OSError:
+                        pass
+        self._thread = threading.Thread(target=run, name="metrics-publisher", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fold_dead(self):
+        """Moves the counters of exited processes into metrics_dead.json."""
+        dead = []
+        for path in glob.glob(os.path.join(self.directory, "metrics_*.json")):
+            pid = os.path.basename(path)[len("metrics_"):-len(".json")]
+            if pid.isdigit() and not _alive(int(pid)):
+                dead.append(path)
+        if not dead:
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            total_path = os.path.join(self.directory, "metrics_dead.json")
+            total = self._load(total_path) or {"counters": [], "histograms": []}
+            for path in dead:
+                data = self._load(path)
+                if data is None:
+                    continue                 # another worker folded it first
+                total["counters"] += data["counters"]
+                total["histograms"] += data["histograms"]
+            counters, histograms = self._merge([total])[:2]
+            total = {"counters": [[n, k, v] for (n, k), v in counters.items()],
+                     "histograms": [[n, k, h] for (n, k), h in histograms.items()]}
+            with open(total_path + ".tmp", "w") as f:
+                json.dump(total, f)
+            os.replace(total_path + ".tmp", total_path)
+            for path in dead:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _merge(self, snapshots):
+        counters, histograms, gauges = {}, {}, {}
+        for data in snapshots:
+            for name, key, value in data.get("counters", ()):
+                k = (name, _key_of(key))
+                counters[k] = counters.get(k, 0) + value
+            for name, key, h in data.get("histograms", ()):
+                k = (name, _key_of(key))
+                total = histograms.get(k)
+                histograms[k] = list(h) if total is None else [a + b for a, b in zip(total, h)]
+            for name, key, value in data.get("gauges", ()):
+                k = (name, _key_of(key))
+                gauges[k] = max(gauges.get(k, value), value)
+        return counters, histograms, gauges
+
+    # ── exposition ───────────────────────────────────────────
+    def render(self):
+        """Returns all metrics in Prometheus text exposition format 0.0.4."""
+        if self.directory is not None:
+            self.publish()
+            self._fold_dead()
+            snapshots = [self._load(p) for p in glob.glob(os.path.join(self.directory, "metrics_*.json"))]
+            counters, histograms, gauges = self._merge(s for s in snapshots if s)
+        else:
+            with self._lock:
+                counters = dict(self._counters)
+                histograms = {k: list(v) for k, v in self._histograms.items()}
+            gauges = self._gauges()
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            kind, text = self._help.get(name, (kind, ""))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), h in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, h):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {h[-1]}")
+            lines.append(f"{name}_sum{_format_labels(key)} {round(h[-2], 6)}")
+            lines.append(f"{name}_count{_format_labels(key)} {h[-1]}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,62 @@
+"""
+payloads.py  —  Pre-serialized JSON bodies for the endpoints dashboards poll.
+
+/api/realtime-data and /api/sensor-stream are polled every second or two by
+every open dashboard, but what they report only changes when a test, a
+review or a sensor reading arrives. PayloadCache keeps the encoded body of
+each payload keyed by a caller-supplied data version; build() runs once per
+version and every other poll reuses the same bytes.
+
+The few fields that really change per request (server clock, simulated
+jitter) are not part of the cached body: splice() writes them in front of
+it, which is a short bytes join rather than a re-encode of the whole
+payload.
+
+orjson is used when installed (several times faster than json, and it
+returns bytes directly); the json module is the fallback.
+"""
+import json, threading
+
+try:
+    import orjson        # optional — json is used without it
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    """Compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def splice(body, fields):
+    """body (an encoded JSON object) with fields added in front, without decoding it."""
+    if not fields:
+        return body
+    head = dumps(fields)
+    if body == b"{}":
+        return head
+    return head[:-1] + b"," + body[1:]
+
+
+class PayloadCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}          # name -> (version, encoded body)
+
+    def get(self, name, version, build):
+        """Returns (body, hit); build() -> dict runs only when version changed since the last call."""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1], True
+        # Built outside the lock: two polls racing on a new version both build, neither waits
+        body = dumps(build())
+        with self._lock:
+            self._entries[name] = (version, body)
+        return body, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,331 @@
+"""
+pdf_report.py  —  PDF layouts: the single-test page (downloads, email, bulk
+jobs) and the multi-page summary report with its trend chart.
+
+Kept free of Flask/app imports so process-pool workers (bulk_reports.py)
+can render pages without importing the web app and its background threads.
+"""
+import functools, hashlib, logging, os, socket, threading
+from datetime import datetime
+from fpdf import FPDF
+from PIL import Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from geocoder import describe as describe_location
+
+try:
+    import qrcode
+    QRCODE_AVAILABLE = True
+except ImportError:
+    QRCODE_AVAILABLE = False
+
+log = logging.getLogger("pyexpo.pdf")
+
+PDF_BG_PATH = os.path.join("static", "pdf_bg.png")
+QR_CACHE_DIR = os.path.join("static", "reports")
+
+
+@functools.lru_cache(maxsize=1)
+def _default_qr_url():
+    return f"http://{socket.gethostbyname(socket.gethostname())}:5000"
+
+
+def qr_image_path(url):
+    """PNG of the QR code for url, rendered once per URL and shared by all reports."""
+    path = os.path.join(QR_CACHE_DIR, f"_qr_{hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]}.png")
+    if not os.path.exists(path):
+        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=4, border=2)
+        qr.add_data(url)
+        qr.make(fit=True)
+        qr_img = qr.make_image(fill_color="#1a3a5c", back_color="white")
+        os.makedirs(QR_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        qr_img.save(tmp, format="PNG")
+        os.replace(tmp, path)      # concurrent renders never read a half-written image
+    return path
+
+
+def add_test_page(pdf, last_test, user, public_url=None, is_email=False):
+    """Appends one styled report page for a test to an existing FPDF document."""
+    pdf.add_page()
+
+    if not is_email:
+        # --- Background Image ---
+        if os.path.exists(PDF_BG_PATH):
+            # Full A4 page is 210x297mm
+            pdf.image(PDF_BG_PATH, x=0, y=0, w=210, h=297)
+
+        # --- QR Code (bottom-right corner) ---
+        if QRCODE_AVAILABLE:
+            try:
+                qr_path = qr_image_path(public_url if public_url else _default_qr_url())
+                # Place QR bottom-right: x=155, y=250, size=40x40mm
+                pdf.image(qr_path, x=155, y=252, w=40, h=40)
+                # Label under QR
+                pdf.set_xy(148, 294)
+                pdf.set_font("Arial", "", 6)
+                pdf.set_text_color(60, 90, 120)
+                pdf.cell(55, 3, "Scan to open the live app", align='C')
+            except Exception as e:
+                log.warning("msg=\"QR generation failed\" error=%r", str(e))
+
+    # --- Header ---
+    pdf.set_xy(10, 12)
+    pdf.set_font("Arial", "B", 18)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(190, 10, "PureCheck and Quality Analysis", ln=True, align='C')
+    pdf.set_font("Arial", "I", 11)
+    pdf.set_text_color(60, 90, 120)
+    pdf.cell(190, 7, "Official Analysis Report", ln=True, align='C')
+
+    # Divider line
+    pdf.set_draw_color(30, 80, 140)
+    pdf.set_line_width(0.7)
+    pdf.line(15, 32, 195, 32)
+    pdf.ln(10)
+
+    # --- User Info Box ---
+    pdf.set_fill_color(220, 235, 250)
+    pdf.set_draw_color(180, 210, 240)
+    pdf.set_line_width(0.3)
+    pdf.rect(15, 38, 180, 22, 'FD')
+    pdf.set_xy(18, 41)
+    pdf.set_font("Arial", "B", 11)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(85, 7, f"User: {user}", ln=False)
+    pdf.set_font("Arial", "", 11)
+    pdf.cell(85, 7, f"Date: {last_test.get('timestamp', 'N/A')}", ln=True)
+    pdf.set_xy(18, 50)
+    pdf.set_font("Arial", "", 10)
+    pdf.set_text_color(60, 90, 120)
+    pdf.cell(180, 6, f"Sample Type: {last_test.get('sample_type', 'N/A').title()}", ln=True)
+    pdf.ln(8)
+
+    # --- Results Section ---
+    pdf.set_xy(15, 68)
+    pdf.set_font("Arial", "B", 13)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(180, 8, "Analysis Results", ln=True)
+    pdf.set_line_width(0.3)
+    pdf.line(15, 77, 195, 77)
+    pdf.ln(3)
+
+    # Detected Level
+    pdf.set_font("Arial", "", 12)
+    pdf.set_text_color(50, 50, 80)
+    pdf.cell(90, 9, f"Detected Steroid Level:", ln=False)
+    pdf.set_font("Arial", "B", 12)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(90, 9, f"{last_test.get('detected_level', 'N/A')} mg/L", ln=True)
+
+    # pH Value
+    pdf.set_font("Arial", "", 12)
+    pdf.set_text_color(50, 50, 80)
+    ph_val = last_test.get('ph_value', 'N/A')
+    ph_status = last_test.get('ph_status', '').title()
+    pdf.cell(90, 9, f"pH Value:", ln=False)
+    pdf.set_font("Arial", "B", 12)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(90, 9, f"{ph_val} ({ph_status})", ln=True)
+
+    # Location
+    pdf.set_font("Arial", "", 12)
+    pdf.set_text_color(50, 50, 80)
+    pdf.cell(90, 9, f"Test Location:", ln=False)
+    pdf.set_font("Arial", "B", 10)
+    pdf.set_text_color(20, 60, 100)
+    lat = last_test.get('latitude')
+    lng = last_test.get('longitude')
+    if lat and lng:
+        loc_str = describe_location(lat, lng) or f"{lat}, {lng}"
+    else:
+        loc_str = "Not Captured"
+    while len(loc_str) > 4 and pdf.get_string_width(loc_str) > 88:
+        loc_str = loc_str[:-4].rstrip(", ") + "..."
+    pdf.cell(90, 9, loc_str, ln=True)
+
+    # Safety Status (colored badge)
+    status = last_test.get('level', 'unknown').upper()
+    pdf.ln(4)
+    if status == 'SAFE':
+        pdf.set_fill_color(46, 125, 50)
+    elif status == 'DANGER':
+        pdf.set_fill_color(198, 40, 40)
+    else:
+        pdf.set_fill_color(249, 168, 37)
+    pdf.set_text_color(255, 255, 255)
+    pdf.set_font("Arial", "B", 13)
+    pdf.set_x(15)
+    pdf.cell(80, 11, f"  Safety Status: {status}", fill=True, ln=True)
+    pdf.ln(12)
+
+    # --- Safe Limit Reference ---
+    pdf.set_text_color(50, 50, 80)
+    pdf.set_font("Arial", "", 10)
+    safe_limit = last_test.get('safe_dose', 0.05)
+    pdf.set_x(15)
+    pdf.cell(180, 7, f"Regulatory Safe Limit: {safe_limit} mg/kg  |  WHO Standard Reference", ln=True)
+    pdf.ln(8)
+
+    # Divider
+    pdf.set_draw_color(180, 210, 240)
+    pdf.set_line_width(0.3)
+    pdf.line(15, pdf.get_y(), 195, pdf.get_y())
+    pdf.ln(8)
+
+    # --- Footer ---
+    pdf.set_xy(10, 282)
+    pdf.set_font("Courier", "", 8)
+    pdf.set_text_color(100, 130, 160)
+    pdf.cell(135, 5, "[ Automatically generated by the AI Safety System ]", align='L')
+
+
+def build_pdf(last_test, user, public_url=None, is_email=False):
+    """Build a styled PDF report with background image and QR code."""
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False, margin=0)
+    add_test_page(pdf, last_test, user, public_url=public_url, is_email=is_email)
+    return pdf
+
+
+# =============================================
+# SUMMARY REPORT
+# =============================================
+TABLE_ROWS_PER_PAGE = 38
+
+_chart_lock = threading.Lock()
+_chart_figures = {}        # number of panels -> Figure reused across renders
+
+
+def _trend_figure(panels):
+    """A Figure built once per panel count; pyplot's global state is never touched."""
+    fig = _chart_figures.get(panels)
+    if fig is None:
+        fig = Figure(figsize=(8, 2.1 * panels), dpi=110, facecolor="#f8f9fa")
+        FigureCanvasAgg(fig)
+        fig.subplots(panels, 1, squeeze=False)
+        fig.subplots_adjust(left=0.08, right=0.98, top=0.95, bottom=0.08, hspace=0.55)
+        _chart_figures[panels] = fig
+    return fig
+
+
+def render_trend_chart(trends, path, start, end):
+    """trends: [(sample_type, safe_limit, points)] with rollup points -> PNG at path."""
+    with _chart_lock:
+        fig = _trend_figure(len(trends))
+        for ax, (sample_type, safe_limit, points) in zip(fig.axes, trends):
+            ax.clear()
+            ax.set_facecolor("#f8f9fa")
+            ax.set_title(f"{sample_type.title()} — mean / min-max per bucket", fontsize=9, color="#333333", loc="left")
+            ax.axhline(safe_limit, color="#2e7d32", linewidth=1.5, linestyle="--", label="Safe Limit")
+            if points:
+                ts = [datetime.fromtimestamp(p["t"]) for p in points]
+                ax.fill_between(ts, [p["min"] for p in points], [p["max"] for p in points],
+                                color="#1976d2", alpha=0.18, linewidth=0, step="mid")
+                ax.plot(ts, [p["mean"] for p in points], color="#1976d2", linewidth=1.4, label="Mean level")
+                over = [(t, p["max"]) for t, p in zip(ts, points) if p["over_limit_share"] > 0]
+                if over:
+                    ax.scatter(*zip(*over), color="#c62828", s=10, zorder=5, label="Over limit")
+            else:
+                ax.text(0.5, 0.5, "No tests in this range", transform=ax.transAxes,
+                        ha="center", va="center", fontsize=9, color="#777777")
+            ax.set_xlim(datetime.fromtimestamp(start), datetime.fromtimestamp(end))   # reused axes: never autoscale
+            ax.tick_params(labelsize=7, colors="#333333")
+            ax.grid(True, linestyle="--", alpha=0.5, color="#e0e0e0")
+            ax.set_ylabel("mg/L", fontsize=7)
+            ax.legend(loc="upper right", fontsize=6, facecolor="white", edgecolor="#cccccc")
+        fig.canvas.draw()
+        # fpdf 1.7 splits PNG alpha channels byte by byte in Python — hand it plain RGB
+        rgb = Image.frombuffer("RGBA", fig.canvas.get_width_height(), fig.canvas.buffer_rgba()).convert("RGB")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    rgb.save(tmp, format="PNG")
+    os.replace(tmp, path)
+    return path
+
+
+def _summary_header(pdf, title, subtitle):
+    pdf.add_page()
+    pdf.set_xy(10, 12)
+    pdf.set_font("Arial", "B", 18)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(190, 10, title, ln=True, align='C')
+    pdf.set_font("Arial", "I", 11)
+    pdf.set_text_color(60, 90, 120)
+    pdf.cell(190, 7, subtitle, ln=True, align='C')
+    pdf.set_draw_color(30, 80, 140)
+    pdf.set_line_width(0.7)
+    pdf.line(15, 32, 195, 32)
+
+
+def _summary_footer(pdf, generated):
+    pdf.set_xy(10, 285)
+    pdf.set_font("Courier", "", 8)
+    pdf.set_text_color(100, 130, 160)
+    pdf.cell(135, 5, f"[ Generated {generated} from aggregated data ]", align='L')
+    pdf.cell(55, 5, f"Page {pdf.page_no()}", align='R')
+
+
+def _table_row(pdf, widths, values, header=False, fill=None):
+    pdf.set_x(15)
+    pdf.set_font("Arial", "B" if header else "", 9)
+    if fill:
+        pdf.set_fill_color(*fill)
+    for w, v in zip(widths, values):
+        pdf.cell(w, 6, str(v), border=1, align='C', fill=bool(fill))
+    pdf.ln(6)
+
+
+def build_summary_pdf(summary, chart_path):
+    """Multi-page summary: overview + chart, then one bucket table per sample type."""
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False, margin=0)
+    generated = datetime.now().strftime("%Y-%m-%d %H:%M")
+    subtitle = f"Summary Report  |  {summary['range_label']}"
+
+    # --- Page 1: scope, overview table, trend chart ---
+    _summary_header(pdf, "PureCheck and Quality Analysis", subtitle)
+    pdf.set_fill_color(220, 235, 250)
+    pdf.set_draw_color(180, 210, 240)
+    pdf.set_line_width(0.3)
+    pdf.rect(15, 38, 180, 16, 'FD')
+    pdf.set_xy(18, 41)
+    pdf.set_font("Arial", "B", 11)
+    pdf.set_text_color(20, 60, 100)
+    pdf.cell(85, 5, f"Scope: {summary['scope_label']}", ln=False)
+    pdf.set_font("Arial", "", 10)
+    pdf.cell(85, 5, f"Resolution: {summary['resolution']} buckets", ln=True)
+    pdf.set_xy(18, 47)
+    pdf.cell(180, 5, f"Tests in range: {summary['total_tests']}", ln=True)
+
+    pdf.set_xy(15, 60)
+    pdf.set_text_color(50, 50, 80)
+    widths = (36, 24, 28, 28, 28, 36)
+    _table_row(pdf, widths, ("Sample Type", "Tests", "Mean", "Min", "Max", "Over Limit"), header=True,
+               fill=(220, 235, 250))
+    for row in summary["overview"]:
+        _table_row(pdf, widths, (row["sample_type"].title(), row["count"],
+                                 row["mean"], row["min"], row["max"], f"{row['over_limit_pct']}%"))
+    chart_top = pdf.get_y() + 6
+    pdf.image(chart_path, x=15, y=chart_top, w=180)
+    _summary_footer(pdf, generated)
+
+    # --- Following pages: bucket tables, paginated ---
+    widths = (48, 22, 26, 26, 26, 32)
+    for trend in summary["trends"]:
+        rows = [p for p in trend["points"] if p["count"]]
+        if not rows:
+            continue
+        fmt = "%Y-%m-%d" if summary["resolution"] == "1d" else "%Y-%m-%d %H:%M"
+        for start in range(0, len(rows), TABLE_ROWS_PER_PAGE):
+            _summary_header(pdf, f"{trend['sample_type'].title()} - per-{summary['resolution']} detail",
+                            f"Safe limit {trend['safe_limit']} mg/kg  |  {subtitle}")
+            pdf.set_xy(15, 38)
+            pdf.set_text_color(50, 50, 80)
+            _table_row(pdf, widths, ("Bucket start", "Tests", "Mean", "Min", "Max", "Over Limit"), header=True,
+                       fill=(220, 235, 250))
+            for p in rows[start:start + TABLE_ROWS_PER_PAGE]:
+                fill = (250, 225, 225) if p["over_limit_share"] > 0 else None
+                _table_row(pdf, widths, (datetime.fromtimestamp(p["t"]).strftime(fmt), p["count"], p["mean"],
+                                         p["min"], p["max"], f"{round(p['over_limit_share'] * 100, 1)}%"), fill=fill)
+            _summary_footer(pdf, generated)
+    return pdf
@@ -0,0 +1,239 @@
+"""
+profiling.py  —  Opt-in stack-sampling profiles of single requests, with flame graphs.
+
+    sampler = StackSampler(threading.get_ident()).start()
+    ...handle the request...
+    stacks = sampler.stop()          # {"app.py:detection_testing;...;figure.py:savefig": µs}
+
+While a request is profiled, a helper thread reads the handling thread's
+stack (sys._current_frames) every few milliseconds and adds the time since
+its previous look to that stack. Weighting by elapsed time rather than
+counting samples keeps the totals honest when the sampler could not run on
+time because C code (matplotlib's Agg renderer, FPDF, zlib) held the GIL;
+time spent waiting for a lock shows up as the frame that called acquire().
+Frames are labelled "file:function" with file paths relative to sys.path
+("matplotlib/figure.py:Figure.savefig"), so the output reads the same on
+every machine.
+
+Nothing here runs unless a request is selected for profiling: the cost of
+the feature when it is off is the caller's check of a header.
+
+ProfileStore keeps the newest profiles as JSON files in one directory,
+shared by all workers. collapsed() writes the folded "frame;frame;frame weight" format
+that flamegraph.pl, speedscope and inferno read; flamegraph_svg() renders
+a self-contained SVG so no extra tool is needed.
+"""
+import json, os, re, sys, threading, time, zlib
+from collections import Counter
+from xml.sax.saxutils import escape
+
+DEFAULT_INTERVAL_S = 0.005
+MAX_DEPTH = 128
+PROFILE_ID = re.compile(r"[0-9a-f]{12}\Z")
+
+_short_names = {}
+
+
+def _short_filename(path):
+    """path relative to the sys.path entry it was imported from (memoised)."""
+    name = _short_names.get(path)
+    if name is None:
+        best = ""
+        for root in sys.path:
+            root = os.path.join(os.path.abspath(root or "."), "")
+            if path.startswith(root) and len(root) > len(best):
+                best = root
+        name = _short_names[path] = path[len(best):] if best else os.path.basename(path)
+    return name
+
+
+def frame_label(code):
+    qualname = getattr(code, "co_qualname", code.co_name)       # co_qualname: Python 3.11+
+    return f"{_short_filename(code.co_filename)}:{qualname}".replace(";", ",")
+
+
+def stack_of(frame):
+    """Collapsed stack of frame, root first."""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread until stop()."""
+
+    def __init__(self, thread_id, interval_s=DEFAULT_INTERVAL_S):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks = Counter()          # collapsed stack -> microseconds
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        last = self._started
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            self.stacks[stack_of(frame)] += int((now - last) * 1e6)
+            self.samples += 1
+            last = now
+            del frame
+
+    def stop(self):
+        """Stops sampling; returns {collapsed stack: microseconds}."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed_s = time.perf_counter() - self._started
+        return dict(self.stacks)
+
+
+# ── storage ──────────────────────────────────────────────────
+class ProfileStore:
+    """Newest `keep` profiles as profile_<id>.json files in one directory."""
+
+    def __init__(self, directory, keep=200):
+        self.directory = directory
+        self.keep = keep
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"profile_{profile_id}.json")
+
+    def save(self, profile):
+        """Writes profile (a dict with "id" and "stacks") and drops the oldest beyond keep."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(profile["id"])
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(profile, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        self._prune()
+        return path
+
+    def _entries(self):
+        """(mtime, path) of stored profiles, newest first."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if name.startswith("profile_") and name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.stat(path).st_mtime_ns, path))
+                except FileNotFoundError:
+                    pass
+        entries.sort(reverse=True)
+        return entries
+
+    def _prune(self):
+        for _, path in self._entries()[self.keep:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def load(self, profile_id):
+        """The stored profile, or None for an unknown or malformed id."""
+        if not PROFILE_ID.match(profile_id or ""):
+            return None
+        try:
+            with open(self._path(profile_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def recent(self, limit=50):
+        """Metadata (everything but the stacks) of the newest profiles."""
+        out = []
+        for _, path in self._entries()[:limit]:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    profile = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            profile.pop("stacks", None)
+            out.append(profile)
+        return out
+
+
+# ── output ───────────────────────────────────────────────────
+def collapsed(stacks):
+    """Folded-stack text ("frame;frame;frame weight" per line) for flamegraph.pl / speedscope."""
+    return "".join(f"{stack} {weight}\n" for stack, weight in sorted(stacks.items()) if weight > 0)
+
+
+def _tree(stacks):
+    root = {"name": "all", "value": 0, "children": {}}
+    for stack, weight in stacks.items():
+        if weight <= 0:
+            continue
+        root["value"] += weight
+        node = root
+        for label in stack.split(";") if stack else ():
+            child = node["children"].get(label)
+            if child is None:
+                child = node["children"][label] = {"name": label, "value": 0, "children": {}}
+            child["value"] += weight
+            node = child
+    return root
+
+
+def _color(name):
+    """Warm flame colour, stable per function name."""
+    h = zlib.crc32(name.encode("utf-8"))
+    return f"rgb({205 + h % 50},{(h >> 8) % 230},{(h >> 16) % 55})"
+
+
+def flamegraph_svg(stacks, title="Flame graph", width=1200, frame_height=16, min_width_px=0.5):
+    """Self-contained SVG flame graph (root at the bottom; hover a frame for its time)."""
+    root = _tree(stacks)
+    total = root["value"] or 1
+    scale = (width - 20) / total
+    rects, depth_max = [], 0
+    todo = [(root, 0, 10.0)]
+    while todo:
+        node, depth, x = todo.pop()
+        w = node["value"] * scale
+        if w < min_width_px:
+            continue
+        depth_max = max(depth_max, depth)
+        rects.append((node, depth, x, w))
+        child_x = x
+        for child in sorted(node["children"].values(), key=lambda c: c["name"]):
+            todo.append((child, depth + 1, child_x))
+            child_x += child["value"] * scale
+    header = 40
+    height = header + (depth_max + 1) * frame_height + 10
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="Verdana,sans-serif" font-size="11">',
+        f'<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{width / 2}" y="22" text-anchor="middle" font-size="15">{escape(title)}</text>',
+    ]
+    for node, depth, x, w in rects:
+        y = height - 10 - (depth + 1) * frame_height
+        ms, share = node["value"] / 1000, 100 * node["value"] / total
+        tip = escape(f"{node['name']} ({ms:.1f} ms, {share:.1f}%)")
+        out.append(f'<g><title>{tip}</title>'
+                   f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{frame_height - 1}" '
+                   f'fill="{_color(node["name"])}" rx="2"/>')
+        chars = int((w - 6) / 7)
+        if chars >= 3:
+            label = node["name"] if len(node["name"]) <= chars else node["name"][:chars - 2] + ".."
+            out.append(f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}">{escape(label)}</text>')
+        out.append("</g>")
+    out.append("</svg>")
+    return "\n".join(out)
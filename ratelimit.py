@@ -0,0 +1,124 @@
+"""
+ratelimit.py  —  Token buckets and a render-slot cap shared by all workers.
+
+TokenBuckets keeps one row per key (client IP, user, ...) in SQLite; a take()
+is one short BEGIN IMMEDIATE transaction, so gunicorn workers see the same
+buckets and never double-spend a token.
+
+RenderSlots caps how many expensive requests run at once across every
+worker. Each slot is a file locked with flock(); the kernel drops the lock
+if a worker dies, so a crashed render can never leak a slot. Without fcntl
+(Windows dev server, one process) a semaphore does the same job.
+"""
+import math, os, sqlite3, threading, time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+
+
+class TokenBuckets:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._takes = 0
+
+    def _db(self):
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")     # losing a few tokens on power loss is fine
+            conn.execute(SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def take(self, key, rate_per_s, burst, cost=1.0):
+        """Spends cost tokens from key's bucket. Returns (allowed, retry_after_seconds)."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate_per_s)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                           (key, tokens, now))
+                self._takes += 1
+                if self._takes % 1000 == 0:    # forget idle clients (a full bucket needs no row)
+                    db.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return allowed, 0.0 if allowed else (cost - tokens) / rate_per_s
+
+
+class RenderSlots:
+    def __init__(self, directory, slots):
+        self.directory = directory
+        self.slots = max(1, int(slots))
+        self._local = threading.Semaphore(self.slots) if fcntl is None else None
+
+    def _try_acquire(self):
+        if self._local is not None:
+            return self._local if self._local.acquire(blocking=False) else None
+        os.makedirs(self.directory, exist_ok=True)
+        for i in range(self.slots):
+            f = open(os.path.join(self.directory, f"slot_{i}"), "a+")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        return None
+
+    def _release(self, handle):
+        if self._local is not None:
+            handle.release()
+        else:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    @contextmanager
+    def acquire(self, wait_s=0.0, poll_s=0.05):
+        """Yields True holding a slot, or False if none freed up within wait_s."""
+        deadline = time.monotonic() + wait_s
+        handle = self._try_acquire()
+        while handle is None and time.monotonic() < deadline:
+            time.sleep(poll_s)
+            handle = self._try_acquire()
+        try:
+            yield handle is not None
+        finally:
+            if handle is not None:
+                self._release(handle)
+
+    def in_use(self):
+        """Slots currently held by any worker (for /metrics)."""
+        if self._local is not None:
+            return self.slots - self._local._value
+        busy = 0
+        for i in range(self.slots):
+            path = os.path.join(self.directory, f"slot_{i}")
+            if not os.path.exists(path):
+                continue
+            with open(path, "a+") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                except BlockingIOError:
+                    busy += 1
+        return busy
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
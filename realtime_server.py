@@ -0,0 +1,196 @@
+"""
+realtime_server.py  —  asyncio serving mode for the realtime / hardware endpoints
+
+    python realtime_server.py --port 5000 [--threads 8]
+
+Runs on Tornado's asyncio loop (tornado is already in requirements.txt):
+
+  /api/sensor-stream, /api/hardware-status, /api/realtime-data
+        answered on the event loop, so thousands of polling dashboards cost
+        a coroutine each instead of a gunicorn worker slot
+  /api/sensor-events
+        Server-Sent Events push stream — one long-lived connection per
+        client, a frame per new reading (and a heartbeat frame every second)
+  /api/changes?since=N&wait=S
+        the change feed, long-polled on the loop for up to CHANGES_MAX_WAIT_S
+        (the Flask app's own limit, CHANGES_MAX_WAIT_SECONDS, doesn't apply)
+  everything else
+        the regular Flask app, run in a thread pool via WSGIContainer
+
+Hardware state reaches the loop through SensorChannel: the serial reader
+thread publishes snapshots with loop.call_soon_threadsafe(), so handlers never
+touch hw_lock. The Flask pages keep working exactly as under gunicorn.
+"""
+import argparse, asyncio, json, logging, time
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.web
+import tornado.iostream
+from tornado.wsgi import WSGIContainer
+
+import app as webapp
+
+log = logging.getLogger("pyexpo.realtime")
+
+HEARTBEAT_S = 1.0
+CHANGES_MAX_WAIT_S = 25.0
+
+
+class SensorChannel:
+    """Latest hardware snapshot plus fan-out to asyncio subscribers."""
+
+    def __init__(self, loop, snapshot):
+        self.loop = loop
+        self.snapshot = snapshot
+        self.version = 0
+        self._subscribers = set()
+
+    # called from any thread (serial reader, Flask routes in the pool)
+    def publish_threadsafe(self, snapshot):
+        self.loop.call_soon_threadsafe(self._publish, snapshot)
+
+    def _publish(self, snapshot):
+        self.snapshot = snapshot
+        self.version += 1
+        for q in self._subscribers:
+            if q.full():           # slow client: keep only the newest snapshot
+                q.get_nowait()
+            q.put_nowait(snapshot)
+
+    def subscribe(self):
+        q = asyncio.Queue(maxsize=1)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        self._subscribers.discard(q)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+class JsonHandler(tornado.web.RequestHandler):
+    def initialize(self, channel):
+        self.channel = channel
+
+    def write_json(self, payload):
+        """payload: a dict, or JSON bytes already encoded by webapp's payload cache."""
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Cache-Control", "no-store")
+        self.finish(payload if isinstance(payload, bytes) else json.dumps(payload))
+
+
+class SensorStreamHandler(JsonHandler):
+    def get(self):
+        self.write_json(webapp.sensor_stream_body(self.channel.snapshot))
+
+
+class HardwareStatusHandler(JsonHandler):
+    def get(self):
+        self.write_json(webapp.hardware_status_payload(self.channel.snapshot))
+
+
+class RealtimeDataHandler(JsonHandler):
+    async def get(self):
+        # Reads history/feedback files — keep that blocking I/O off the loop
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, webapp.realtime_data_body, self.channel.snapshot)
+        self.write_json(payload)
+
+
+def _number_arg(handler, name, default, kind):
+    try:
+        return kind(handler.get_query_argument(name, default))
+    except ValueError:
+        return default
+
+
+class ChangesHandler(JsonHandler):
+    """Long-poll of the change feed: a sleeping coroutine per waiting dashboard, no thread."""
+
+    async def get(self):
+        since = max(0, _number_arg(self, "since", 0, int))
+        limit = max(1, min(_number_arg(self, "limit", 200, int), webapp.CHANGES_MAX_LIMIT))
+        wait = max(0.0, min(_number_arg(self, "wait", 0.0, float), CHANGES_MAX_WAIT_S))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            payload = await loop.run_in_executor(None, webapp.changes_payload, since, limit)
+            if payload["seq"] > since or payload["reset"] or loop.time() >= deadline:
+                break
+            await asyncio.sleep(min(webapp.CHANGES_RECHECK_S, deadline - loop.time()))
+        if wait > 0:
+            payload["poll_after_ms"] = 0
+        self.write_json(webapp.dumps(payload))
+
+
+class SensorEventsHandler(JsonHandler):
+    """text/event-stream of sensor payloads; pushes on new readings, heartbeats otherwise."""
+
+    async def get(self):
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-store")
+        self.set_header("X-Accel-Buffering", "no")
+        q = self.channel.subscribe()
+        try:
+            snapshot = self.channel.snapshot
+            while True:
+                body = webapp.sensor_stream_body(snapshot)
+                self.write(b"id: %d\ndata: %s\n\n" % (self.channel.version, body))
+                await self.flush()
+                try:
+                    snapshot = await asyncio.wait_for(q.get(), timeout=HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    snapshot = self.channel.snapshot
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            self.channel.unsubscribe(q)
+
+
+class ChannelStatsHandler(JsonHandler):
+    def get(self):
+        self.write_json({"subscribers": self.channel.subscriber_count, "version": self.channel.version,
+                         "time": time.time()})
+
+
+def make_app(channel, threads):
+    flask_app = WSGIContainer(webapp.app.wsgi_app, executor=ThreadPoolExecutor(max_workers=threads))
+    kw = {"channel": channel}
+    return tornado.web.Application([
+        (r"/api/sensor-stream", SensorStreamHandler, kw),
+        (r"/api/hardware-status", HardwareStatusHandler, kw),
+        (r"/api/realtime-data", RealtimeDataHandler, kw),
+        (r"/api/sensor-events", SensorEventsHandler, kw),
+        (r"/api/changes", ChangesHandler, kw),
+        (r"/api/realtime-stats", ChannelStatsHandler, kw),
+        (r".*", tornado.web.FallbackHandler, {"fallback": flask_app}),
+    ], xheaders=True)
+
+
+async def serve(host, port, threads):
+    loop = asyncio.get_running_loop()
+    channel = SensorChannel(loop, webapp.hw_snapshot())
+    webapp.add_hw_listener(channel.publish_threadsafe)
+    webapp.start_background_tasks()
+    if webapp.WARM_UP_ON_START:
+        # before listening: Flask requests run in the pool and must not meet a half-warm worker
+        await loop.run_in_executor(None, webapp.warm_up)
+    application = make_app(channel, threads)
+    application.listen(port, address=host)
+    log.info("msg=\"realtime server listening\" host=%s port=%s flask_threads=%s", host, port, threads)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio serving mode for realtime endpoints")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8, help="thread pool size for Flask pages")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.host, args.port, args.threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+records.py  —  Column-oriented, compact in-memory table of analysis records.
+
+A history entry parsed into a dict costs ~800 bytes (eleven string keys,
+the repeated "milk" / "safe" / "neutral" strings, a timestamp string, two
+coordinate strings). RecordTable stores the same entries as parallel
+arrays, ~60 bytes each:
+
+    categorical fields  interned; one small code per row (uint8, widened to
+                        uint16/uint32 only when a column needs more values)
+    timestamps          "YYYY-MM-DD HH:MM:SS" as epoch seconds (int64)
+    readings            float32, decoded to their shortest repr (0.04 stays 0.04)
+    coordinates         float64, decoded back to the browser's text ("11.0809615")
+    ids / plot urls     the hex or numeric part only
+
+Nothing is lossy: a value a column cannot encode exactly (an int reading,
+a hand-edited timestamp, an unknown key) is kept as-is in a per-row
+overflow dict, and each row remembers its key order, so table[i] is equal
+to, and json.dumps-identical with, the entry that was appended.
+
+Counting and filtering run on the code arrays with numpy (count(level=
+"safe") over a million rows takes ~0.3 ms); table[i] / table[a:b] rebuild
+plain dicts for code that expects them.
+"""
+import re, sys, threading
+from array import array
+from datetime import date
+from functools import lru_cache
+import numpy as np
+
+_MISSING = object()          # key absent from the entry (vs. present with value None)
+_WIDER = {"B": ("H", 0xFF), "H": ("I", 0xFFFF), "I": ("Q", 0xFFFFFFFF)}
+
+
+class Column:
+    """One field: encode() returns the stored value, or _MISSING if it can't be stored exactly."""
+    typecode = "q"
+    placeholder = 0
+
+    def __init__(self):
+        self.data = array(self.typecode)
+
+    def extend(self, values):
+        """Stores values; returns the positions the caller must keep in the rows' overflow."""
+        encode, placeholder, rejected = self.encode, self.placeholder, []
+        stored = [placeholder if v is _MISSING else encode(v) for v in values]
+        if _MISSING in stored:
+            for i, s in enumerate(stored):
+                if s is _MISSING:
+                    stored[i] = placeholder
+                    rejected.append(i)
+        self.data.extend(stored)
+        return rejected
+
+    def get(self, i):
+        return self.decode(self.data[i])
+
+    def nbytes(self):
+        return self.data.itemsize * len(self.data)
+
+
+class Category(Column):
+    """Interned strings (and None); code 0 means "not stored in this column"."""
+    typecode = "B"
+    accepts = (str, type(None))
+
+    def __init__(self):
+        super().__init__()
+        self.values = [_MISSING]
+        self.codes = {}
+
+    def encode(self, value):
+        if not isinstance(value, self.accepts):
+            return _MISSING
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            wider = _WIDER.get(self.data.typecode)
+            if wider and code > wider[1]:
+                self.data = array(wider[0], self.data)
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+    def code_of(self, value):
+        return self.codes.get(value)
+
+    def nbytes(self):
+        return super().nbytes() + sys.getsizeof(self.values) + sys.getsizeof(self.codes) + \
+            sum(sys.getsizeof(v) for v in self.values[1:])
+
+
+class Shape(Category):
+    """Key tuple of each row, so rows come back with the original keys in the original order."""
+    accepts = tuple
+
+
+@lru_cache(maxsize=65536)
+def _f32_text(stored):
+    return float(str(np.float32(stored)))
+
+
+class Float32(Column):
+    """Float readings kept as float32 when their shortest float32 repr gives the same value."""
+    typecode = "f"
+    placeholder = float("nan")
+
+    def __init__(self, blank=None):
+        super().__init__()
+        self.blank = blank
+
+    def encode(self, value):
+        if value is self.blank:
+            return self.placeholder
+        if type(value) is not float or value != value or _f32_text(value) != value:
+            return _MISSING
+        return value
+
+    def decode(self, stored):
+        return self.blank if stored != stored else _f32_text(stored)
+
+
+class FloatText(Column):
+    """Numbers sent as text (form fields): float64 plus a check that repr() gives the text back."""
+    typecode = "d"
+    placeholder = float("nan")
+
+    def __init__(self, blank=""):
+        super().__init__()
+        self.blank = blank
+
+    def encode(self, value):
+        if value == self.blank and type(value) is type(self.blank):
+            return self.placeholder
+        if type(value) is not str:
+            return _MISSING
+        try:
+            number = float(value)
+        except ValueError:
+            return _MISSING
+        if number != number or number in (float("inf"), float("-inf")) or repr(number) != value:
+            return _MISSING
+        return number
+
+    def decode(self, stored):
+        return self.blank if stored != stored else repr(stored)
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def _day_number(text):
+    try:
+        return date.fromisoformat(text).toordinal() - _EPOCH_ORDINAL if len(text) == 10 else None
+    except ValueError:            # e.g. Feb 30
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _day_text(number):
+    return date.fromordinal(number + _EPOCH_ORDINAL).isoformat()
+
+
+class Timestamp(Column):
+    """"YYYY-MM-DD HH:MM:SS" as epoch seconds (the text is naive local time; UTC is only the encoding)."""
+    typecode = "q"
+    pattern = re.compile(r"(\d{4}-\d\d-\d\d) ([01]\d|2[0-3]):([0-5]\d):([0-5]\d)\Z")
+
+    def encode(self, value):
+        m = self.pattern.match(value) if type(value) is str else None
+        day = None if m is None else _day_number(m.group(1))
+        if day is None:
+            return _MISSING
+        return day * 86400 + int(m.group(2)) * 3600 + int(m.group(3)) * 60 + int(m.group(4))
+
+    def decode(self, stored):
+        day, seconds = divmod(stored, 86400)
+        return f"{_day_text(day)} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class HexId(Column):
+    """Fixed-width lowercase hex ids (uuid4().hex[:12]) as one integer."""
+    typecode = "Q"
+
+    def __init__(self, width=12):
+        super().__init__()
+        self.width = width
+        self.pattern = re.compile(r"[0-9a-f]{%d}\Z" % width)
+
+    def encode(self, value):
+        if type(value) is not str or not self.pattern.match(value):
+            return _MISSING
+        return int(value, 16)
+
+    def decode(self, stored):
+        return format(stored, f"0{self.width}x")
+
+
+class Numbered(Column):
+    """Strings like prefix + <non-negative int> + suffix (e.g. plot urls) as the int."""
+    typecode = "q"
+
+    def __init__(self, prefix, suffix=""):
+        super().__init__()
+        self.prefix, self.suffix = prefix, suffix
+        self.pattern = re.compile(re.escape(prefix) + r"(0|[1-9][0-9]{0,17})" + re.escape(suffix) + r"\Z")
+
+    def encode(self, value):
+        m = self.pattern.match(value) if type(value) is str else None
+        return _MISSING if m is None else int(m.group(1))
+
+    def decode(self, stored):
+        return f"{self.prefix}{stored}{self.suffix}"
+
+
+class RecordTable:
+    """Append-only table of dict records stored column by column (see module docstring)."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._shapes = Shape()
+        self._overflow = {}        # row -> {key: value} the columns could not hold
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._shapes.data)
+
+    def append(self, entry):
+        """Appends one record; returns its row number."""
+        return self.extend([entry])
+
+    def extend(self, entries):
+        """Appends records column by column; returns the row number of the last one."""
+        entries = entries if isinstance(entries, list) else list(entries)
+        with self._lock:
+            first = len(self)
+            for key, column in self.columns.items():
+                for i in column.extend([entry.get(key, _MISSING) for entry in entries]):
+                    self._overflow.setdefault(first + i, {})[key] = entries[i][key]
+            known = self.columns.keys()
+            for i, entry in enumerate(entries):
+                if not known >= entry.keys():
+                    extra = self._overflow.setdefault(first + i, {})
+                    extra.update((key, value) for key, value in entry.items() if key not in known)
+            # shapes go last: readers never see a half-written row
+            self._shapes.extend([tuple(entry) for entry in entries])
+            return len(self) - 1
+
+    def row(self, i):
+        """Record i as a plain dict, equal to the one appended."""
+        keys = self._shapes.get(i)
+        extra = self._overflow.get(i)
+        if extra is None:
+            return {key: self.columns[key].get(i) for key in keys}
+        return {key: extra[key] if key in extra else self.columns[key].get(i) for key in keys}
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(n))]
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("record index out of range")
+        return self.row(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    # ── column scans ─────────────────────────────────────────
+    # numpy views pin the arrays' buffers, so they only live under the lock
+    def _mask(self, n, criteria):
+        mask = np.ones(n, dtype=bool)
+        for key, value in criteria.items():
+            column = self.columns[key]
+            code = column.code_of(value)
+            if code is None:
+                return None
+            mask &= np.frombuffer(column.data, dtype=column.data.typecode, count=n) == code
+        return mask
+
+    def count(self, **criteria):
+        """Rows whose categorical columns equal the given values, e.g. count(level="safe")."""
+        with self._lock:
+            n = len(self)
+            if not criteria:
+                return n
+            mask = self._mask(n, criteria)
+            return 0 if mask is None else int(np.count_nonzero(mask))
+
+    def value_counts(self, key):
+        """{value: rows} for one categorical column."""
+        with self._lock:
+            column = self.columns[key]
+            counts = np.bincount(np.frombuffer(column.data, dtype=column.data.typecode, count=len(self)),
+                                 minlength=len(column.values))
+            return {column.values[code]: int(c) for code, c in enumerate(counts.tolist()) if code and c}
+
+    def latest(self, n, **criteria):
+        """Row numbers of the newest n matching rows, newest first."""
+        with self._lock:
+            total = len(self)
+            if not criteria:
+                return list(range(total - 1, max(-1, total - 1 - n), -1))
+            mask = self._mask(total, criteria)
+            return [] if mask is None else np.flatnonzero(mask)[::-1][:n].tolist()
+
+    def nbytes(self):
+        """Approximate memory held by the table (arrays, intern tables, overflow)."""
+        with self._lock:
+            total = self._shapes.nbytes() + sum(c.nbytes() for c in self.columns.values())
+            total += sys.getsizeof(self._overflow) + sum(
+                sys.getsizeof(extra) + sum(sys.getsizeof(v) for v in extra.values())
+                for extra in self._overflow.values())
+            return total
+
+
+def analysis_table():
+    """Empty table with the columns of an analysis history entry."""
+    return RecordTable({
+        "id":             HexId(12),
+        "timestamp":      Timestamp(),
+        "sample_type":    Category(),
+        "detected_level": Float32(),
+        "level":          Category(),
+        "ph_value":       Float32(),
+        "ph_status":      Category(),
+        "plot_url":       Numbered("/static/plots/plot_", ".png"),
+        "user":           Category(),
+        "latitude":       FloatText(),
+        "longitude":      FloatText(),
+    })
@@ -0,0 +1,263 @@
+"""
+rollups.py  —  Incrementally maintained 1-minute / 1-hour / 1-day rollups.
+
+Each series ("tests:milk", "tests:milk:alice", "sensor:dev_ttyUSB0:ph", ...)
+keeps, per resolution, one row per bucket in a small SQLite table
+
+    (series, resolution, bucket_start_epoch) -> count, min, max, sum, over_limit
+
+Ingestion is incremental: the database remembers how many history entries
+and up to which timestamp per sensor device have been folded in, so a pass
+only touches new data and upserts the buckets it changed. With test_check,
+the check of the newest folded entry is stored next to the tests cursor (like
+changefeed.py does); if the entry at that position changed, history was
+rewritten and the tests series are rebuilt from scratch. Several gunicorn
+workers may run the background pass; BEGIN IMMEDIATE serialises them and the
+cursors are re-read inside the transaction, so every sample is counted once.
+Queries choose the finest resolution whose bucket count over the requested
+range still fits in max_points, so a 30-day chart reads ~30 daily rows
+through the primary key instead of scanning raw samples.
+
+Buckets are aligned to UTC epoch boundaries.
+"""
+import logging, math, os, sqlite3, threading, time
+from datetime import datetime
+import numpy as np
+from sensor_store import CHANNELS
+
+log = logging.getLogger("pyexpo.rollups")
+
+RESOLUTIONS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+# How long each resolution is kept; None keeps it forever
+RETENTION_S = {"1m": 2 * 86400, "1h": 90 * 86400, "1d": None}
+SENSOR_WINDOW_S = 86400       # sensor rows are folded in a day at a time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    series TEXT NOT NULL, res TEXT NOT NULL, bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL, min REAL NOT NULL, max REAL NOT NULL,
+    sum REAL NOT NULL, over INTEGER NOT NULL,
+    PRIMARY KEY (series, res, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+UPSERT = """
+INSERT INTO buckets (series, res, bucket, count, min, max, sum, over) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (series, res, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    min   = min(min, excluded.min),
+    max   = max(max, excluded.max),
+    sum   = sum + excluded.sum,
+    over  = over + excluded.over
+"""
+
+
+def parse_timestamp(value):
+    """Epoch seconds for a history timestamp ("%Y-%m-%d %H:%M:%S", local time)."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _merge(pending, key, count, lo, hi, total, over):
+    row = pending.get(key)
+    if row is None:
+        pending[key] = [count, lo, hi, total, over]
+    else:
+        row[0] += count
+        row[1] = min(row[1], lo)
+        row[2] = max(row[2], hi)
+        row[3] += total
+        row[4] += over
+
+
+class Rollups:
+    def __init__(self, path, sample_limits, channel_limits=None, test_check=None):
+        self.path = path
+        self.sample_limits = sample_limits            # sample_type -> safe limit
+        self.channel_limits = channel_limits or {}    # sensor channel -> limit (optional)
+        self.test_check = test_check                  # history entry -> nonzero int (optional)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _db(self):
+        """One connection per process (gunicorn forks after import)."""
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _cursor(self, db, name, default=None):
+        row = db.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_cursor(self, db, name, value):
+        db.execute("INSERT OR REPLACE INTO cursors (name, value) VALUES (?, ?)", (name, value))
+
+    # ── ingestion ────────────────────────────────────────────
+    def _add_sample(self, pending, series, t, value, limit, now):
+        over = 1 if limit is not None and value > limit else 0
+        for res, width in RESOLUTIONS:
+            if RETENTION_S[res] is not None and t < now - RETENTION_S[res]:
+                continue        # already past retention (e.g. first backfill of old history)
+            _merge(pending, (series, res, int(t // width) * width), 1, value, value, value, over)
+
+    def _add_array(self, pending, series, times, values, limit, now):
+        mask = ~np.isnan(values)
+        all_times, all_values = times[mask], values[mask].astype(np.float64)
+        for res, width in RESOLUTIONS:
+            times, values = all_times, all_values
+            if RETENTION_S[res] is not None:
+                keep = times >= now - RETENTION_S[res]
+                times, values = times[keep], values[keep]
+            if not len(times):
+                continue
+            buckets, inverse = np.unique((times // width).astype(np.int64) * width, return_inverse=True)
+            counts = np.bincount(inverse)
+            sums = np.bincount(inverse, weights=values)
+            mins = np.full(len(buckets), np.inf)
+            maxs = np.full(len(buckets), -np.inf)
+            np.minimum.at(mins, inverse, values)
+            np.maximum.at(maxs, inverse, values)
+            overs = np.bincount(inverse, weights=values > limit) if limit is not None else np.zeros(len(buckets))
+            for i, b in enumerate(buckets.tolist()):
+                _merge(pending, (series, res, b), int(counts[i]), float(mins[i]), float(maxs[i]),
+                       float(sums[i]), int(overs[i]))
+
+    def _ingest_tests(self, db, pending, history, now):
+        cursor = int(self._cursor(db, "tests", 0))
+        check = self._cursor(db, "tests_check", 0)
+        if cursor > len(history) or (cursor and check and self.test_check
+                                     and self.test_check(history[cursor - 1]) != check):
+            # History was truncated or replaced — rebuild the test series from scratch
+            db.execute("DELETE FROM buckets WHERE series LIKE 'tests:%'")
+            cursor = 0
+        for entry in history[cursor:]:
+            t = parse_timestamp(entry.get("timestamp"))
+            value = entry.get("detected_level")
+            if t is None or not isinstance(value, (int, float)):
+                continue
+            sample_type = entry.get("sample_type", "milk")
+            limit = self.sample_limits.get(sample_type, self.sample_limits.get("default"))
+            self._add_sample(pending, f"tests:{sample_type}", t, float(value), limit, now)
+            if entry.get("user"):
+                self._add_sample(pending, f"tests:{sample_type}:{entry['user']}", t, float(value), limit, now)
+        self._set_cursor(db, "tests", len(history))
+        if self.test_check and history:
+            self._set_cursor(db, "tests_check", self.test_check(history[-1]))
+        return len(history) - cursor
+
+    def _ingest_sensor(self, db, pending, store, now):
+        added = 0
+        for device in store.devices():
+            cursor = self._cursor(db, "sensor:" + device)
+            if cursor is None:
+                first = (store.stats().get(device) or {}).get("first")
+                if first is None:
+                    continue
+                cursor = first - 1e-3
+            window = cursor
+            while window < now:
+                end = min(window + SENSOR_WINDOW_S, now)
+                cols = store.read_range(device, np.nextafter(window, np.inf), end, CHANNELS)
+                if len(cols["time"]):
+                    for ch in CHANNELS:
+                        self._add_array(pending, f"sensor:{device}:{ch}", cols["time"], cols[ch],
+                                        self.channel_limits.get(ch), now)
+                    added += len(cols["time"])
+                    cursor = float(cols["time"][-1])
+                window = end
+            self._set_cursor(db, "sensor:" + device, cursor)
+        return added
+
+    def update(self, history_loader, sensor_store=None, history_count=None, now=None):
+        """One incremental pass over new tests and new sensor rows.
+
+        history_count (if known cheaply) lets the pass skip loading an
+        unchanged history file.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                pending = {}
+                tests = 0
+                if history_count is None or history_count != self._cursor(db, "tests", 0):
+                    tests = self._ingest_tests(db, pending, history_loader(), now)
+                readings = self._ingest_sensor(db, pending, sensor_store, now) if sensor_store is not None else 0
+                db.executemany(UPSERT, ((s, r, b, *row) for (s, r, b), row in pending.items()))
+                if pending:
+                    for res, width in RESOLUTIONS:
+                        if RETENTION_S[res] is not None:
+                            db.execute("DELETE FROM buckets WHERE res = ? AND bucket < ?",
+                                       (res, now - RETENTION_S[res] - width))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return {"tests": tests, "readings": readings, "buckets_written": len(pending)}
+
+    # ── queries ──────────────────────────────────────────────
+    def series_names(self, prefix=""):
+        with self._lock:
+            rows = self._db().execute("SELECT DISTINCT series FROM buckets WHERE series >= ? AND series < ?",
+                                      (prefix, prefix + "\uffff")).fetchall()
+        return sorted(r[0] for r in rows)
+
+    def pick_resolution(self, start, end, max_points, now=None):
+        """Finest resolution that keeps the range within max_points and retention."""
+        now = time.time() if now is None else now
+        span = max(end - start, 1)
+        for res, width in RESOLUTIONS:
+            keep = RETENTION_S[res]
+            if span / width <= max_points and (keep is None or start >= now - keep):
+                return res, width
+        return RESOLUTIONS[-1]
+
+    def query(self, series, start, end, max_points=500, resolution=None):
+        if not (math.isfinite(start) and math.isfinite(end)):
+            raise ValueError("start and end must be finite")
+        res, width = (resolution, dict(RESOLUTIONS)[resolution]) if resolution else \
+            self.pick_resolution(start, end, max_points)
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT bucket, count, min, max, sum, over FROM buckets "
+                "WHERE series = ? AND res = ? AND bucket BETWEEN ? AND ? ORDER BY bucket",
+                (series, res, int(start // width) * width, end)).fetchall()
+        points = [{
+            "t": b,
+            "count": count,
+            "min": round(lo, 4),
+            "max": round(hi, 4),
+            "mean": round(total / count, 4),
+            "over_limit_share": round(over / count, 4),
+        } for b, count, lo, hi, total, over in rows if count]
+        return {"series": series, "resolution": res, "bucket_seconds": width, "points": points}
+
+    # ── background pass ──────────────────────────────────────
+    def start(self, interval_s, history_loader, sensor_store=None, history_count=None):
+        """Runs update() every interval_s; history_count is an optional callable."""
+        if self._thread is not None:
+            return
+        def run():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.update(history_loader, sensor_store,
+                                history_count() if history_count else None)
+                except Exception as e:
+                    log.warning("msg=\"rollup pass failed\" error=%r", str(e))
+        self._thread = threading.Thread(target=run, name="rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
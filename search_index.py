@@ -0,0 +1,166 @@
+"""
+search_index.py  —  In-memory inverted index with BM25 ranking and prefix terms.
+
+Documents are added incrementally and never re-tokenised: every term keeps
+a postings list (doc numbers, ascending, plus term frequencies) in compact
+arrays, and per-document length / owner / caller reference live in parallel
+arrays. A query
+
+    "sour milk"     every token must match (AND), ranked by BM25
+    "ali*"          prefix token: all terms starting with "ali" (bisect over
+                    the sorted vocabulary)
+
+intersects postings starting from the shortest list (numpy searchsorted, so
+a common term with a million postings costs a few milliseconds), scores
+only the surviving documents and keeps the top k with argpartition. Ties
+(e.g. every "safe" test scores the same) go to the newest document.
+
+The index itself is not persisted: callers rebuild it from their source of
+truth at start-up and feed it new documents as they appear.
+"""
+import math, re, threading
+from array import array
+from bisect import bisect_left
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+\*?")
+K1, B = 1.2, 0.75
+MAX_PREFIX_TERMS = 200        # expansions per prefix token (alphabetical); keeps "a*" bounded
+SCORE_CACHE_TOKENS = 32       # per-token (docs, BM25) vectors kept until the next add()
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}        # term -> (doc numbers array('I'), term frequencies array('H'))
+        self._vocab = []           # sorted terms, rebuilt lazily for prefix lookups
+        self._vocab_dirty = False
+        self._lengths = array("I")
+        self._refs = array("Q")
+        self._owners = array("I")
+        self._owner_codes = {None: 0}
+        self._total_length = 0
+        self._score_cache = {}     # query token -> (docs, scores), valid until the next add()
+
+    def __len__(self):
+        return len(self._refs)
+
+    def add(self, ref, texts, owner=None):
+        """Indexes one document; ref is any unsigned int the caller uses to fetch it."""
+        counts = {}
+        for text in texts:
+            for term in tokenize(text):
+                counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            self._score_cache.clear()          # N and avgdl change; cached views must go before arrays grow
+            doc = len(self._refs)
+            for term, tf in counts.items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    posting = self._postings[term] = (array("I"), array("H"))
+                    self._vocab_dirty = True
+                posting[0].append(doc)
+                posting[1].append(min(tf, 65535))
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._total_length += length
+            self._refs.append(ref)
+            self._owners.append(self._owner_codes.setdefault(owner, len(self._owner_codes)))
+        return doc
+
+    def _expand(self, token):
+        if not token.endswith("*"):
+            return [token] if token in self._postings else []
+        prefix = token[:-1]
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        i = bisect_left(self._vocab, prefix)
+        terms = []
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix) and len(terms) < MAX_PREFIX_TERMS:
+            terms.append(self._vocab[i])
+            i += 1
+        return terms
+
+    def _token_scores(self, terms, n_docs, lengths, avgdl):
+        """(docs, scores) for one query token, summed over its term expansions."""
+        docs_parts, score_parts = [], []
+        for term in terms:
+            doc_arr, tf_arr = self._postings[term]
+            docs = np.frombuffer(doc_arr, dtype=np.uint32, count=len(doc_arr))
+            tf = np.frombuffer(tf_arr, dtype=np.uint16, count=len(doc_arr)).astype(np.float64)
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = K1 * (1 - B + B * lengths[docs] / avgdl)
+            docs_parts.append(docs)
+            score_parts.append(idf * tf * (K1 + 1) / (tf + norm))
+        if len(docs_parts) == 1:
+            return docs_parts[0], score_parts[0]
+        docs, inverse = np.unique(np.concatenate(docs_parts), return_inverse=True)
+        return docs, np.bincount(inverse, weights=np.concatenate(score_parts))
+
+    def search(self, query, limit=20, owner=None):
+        """Returns (total_matches, [(ref, score)]) best first."""
+        tokens = TOKEN_RE.findall(str(query).lower())
+        if not tokens:
+            return 0, []
+        with self._lock:
+            # Runs under the lock: numpy views into the arrays must be gone
+            # before add() may grow them again
+            return self._search_locked(tokens, limit, owner)
+
+    def _search_locked(self, tokens, limit, owner):
+        n_docs = len(self._refs)
+        if not n_docs:
+            return 0, []
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32, count=n_docs)
+        avgdl = max(self._total_length / n_docs, 1.0)
+        per_token = []
+        for token in tokens:
+            cached = self._score_cache.get(token)
+            if cached is None:
+                terms = self._expand(token)
+                if not terms:
+                    return 0, []
+                cached = self._token_scores(terms, n_docs, lengths, avgdl)
+                if len(self._score_cache) >= SCORE_CACHE_TOKENS:
+                    self._score_cache.pop(next(iter(self._score_cache)))
+                self._score_cache[token] = cached
+            per_token.append(cached)
+        per_token.sort(key=lambda ds: len(ds[0]))
+        docs, scores = per_token[0]
+        for other_docs, other_scores in per_token[1:]:
+            if len(docs) * 32 < len(other_docs):
+                # few candidates left: binary-search them in the long list
+                pos = np.minimum(np.searchsorted(other_docs, docs), len(other_docs) - 1)
+                hit = other_docs[pos] == docs
+                docs, scores = docs[hit], scores[hit] + other_scores[pos[hit]]
+            else:
+                # comparable sizes: scatter into a dense array (every BM25 score is > 0)
+                dense = np.zeros(n_docs)
+                dense[other_docs] = other_scores
+                extra = dense[docs]
+                hit = extra > 0
+                docs, scores = docs[hit], scores[hit] + extra[hit]
+        if owner is not None:
+            owners = np.frombuffer(self._owners, dtype=np.uint32, count=n_docs)
+            keep = owners[docs] == self._owner_codes.get(owner, -1)
+            docs, scores = docs[keep], scores[keep]
+
+        total = len(docs)
+        if total > limit:
+            cut = np.partition(scores, total - limit)[total - limit]
+            above = np.flatnonzero(scores > cut)
+            ties = np.flatnonzero(scores == cut)[::-1][:limit - len(above)]     # newest docs win ties
+            pick = np.concatenate([above, ties])
+            docs, scores = docs[pick], scores[pick]
+        order = np.lexsort((-docs.astype(np.int64), -scores))
+        return total, [(self._refs[int(d)], round(float(s), 4)) for d, s in zip(docs[order], scores[order])]
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._refs), "terms": len(self._postings),
+                    "postings": sum(len(p[0]) for p in self._postings.values())}
@@ -0,0 +1,244 @@
+"""
+sensor_replay.py  —  Offline replay / load generator for the ESP32 serial path
+
+Creates a pseudo-terminal, points app.serial_reader_thread at it and writes
+sensor lines into the other end — recorded or synthetic — at a configurable
+rate and pattern. No hardware or COM port needed (POSIX only: uses os.openpty).
+
+    python sensor_replay.py --rate 50 --duration 20
+    python sensor_replay.py --pattern burst --rate 20 --burst-rate 2000 --malformed 0.05
+    python sensor_replay.py --input recorded.jsonl --rate 0        # recorded timing
+    python sensor_replay.py --record captured.jsonl --duration 60  # save what was sent
+
+Recorded files are JSON lines; either raw ESP32 objects, or
+{"t": seconds_since_start, "line": "<raw serial line>"} to keep original timing.
+
+At the end it prints (and with --out writes) ingestion stats: lines written,
+parsed / malformed / ignored as counted by app.metrics, end-to-end latency from
+write to hw listener, and how many callbacks (push fan-out) each listener
+actually received.
+"""
+import argparse, json, math, os, random, threading, time
+
+PATTERNS = ("steady", "burst", "sine", "ramp")
+
+
+# =============================================
+# LINE SOURCES
+# =============================================
+def synthetic_reading(rng, t, danger_ratio):
+    """One ESP32-style reading (same keys as esp32_steroid_sensor.ino)."""
+    danger = rng.random() < danger_ratio
+    return {
+        "ph":        round(rng.uniform(6.4, 6.9) - (0.6 if danger else 0), 2),
+        "temp":      round(24 + math.sin(t / 30) * 1.5 + rng.uniform(-0.2, 0.2), 1),
+        "tds":       round(rng.uniform(340, 380)),
+        "turbidity": round(rng.uniform(2000, 2200)),
+        "color":     round(rng.uniform(3750, 3850)),
+        "sensor":    round(rng.uniform(0.06, 0.2) if danger else rng.uniform(0.01, 0.04), 2),
+        "raw_ph":    rng.randint(1800, 2200),
+        "status":    "ok",
+    }
+
+
+MALFORMED = [      # (line, rng) -> line; draw only from rng so --seed reproduces a run
+    lambda line, rng: line[: len(line) // 2],                 # truncated mid-object
+    lambda line, rng: line.replace(":", "", 1),                # broken JSON
+    lambda line, rng: "\x00\xff" + line,                       # line noise before the object
+    lambda line, rng: "[DEBUG] adc=" + str(rng.randint(0, 4095)),   # firmware debug print
+    lambda line, rng: "",                                       # blank line
+]
+
+
+def synthetic_lines(args):
+    """Yields (due_offset_s, line) forever according to --pattern and --rate."""
+    rng = random.Random(args.seed)
+    t = 0.0
+    seq = 0
+    yield 0.0, json.dumps({"status": "boot", "msg": "Sensor Node Ready"})
+    while True:
+        if args.pattern == "steady":
+            rate = args.rate
+        elif args.pattern == "burst":
+            in_burst = (t % args.burst_every) < args.burst_length
+            rate = args.burst_rate if in_burst else args.rate
+        elif args.pattern == "sine":
+            rate = args.rate * (1 + 0.9 * math.sin(2 * math.pi * t / args.period))
+        else:   # ramp: linearly from --rate to --burst-rate over the run
+            rate = args.rate + (args.burst_rate - args.rate) * min(1.0, t / max(args.duration, 1e-9))
+        t += 1.0 / max(rate, 0.1)
+        reading = synthetic_reading(rng, t, args.danger)
+        reading["seq"] = seq
+        seq += 1
+        line = json.dumps(reading, separators=(",", ":"))
+        if rng.random() < args.malformed:
+            line = rng.choice(MALFORMED)(line, rng)
+        yield t, line
+
+
+def recorded_lines(args):
+    """Yields (due_offset_s, line) from a JSONL recording; --rate 0 keeps recorded timing."""
+    offset = 0.0
+    while True:
+        last = 0.0
+        with open(args.input) as f:
+            for i, raw in enumerate(l for l in f if l.strip()):
+                e = json.loads(raw)
+                if isinstance(e, dict) and "line" in e:
+                    line, t = e["line"], e.get("t")
+                else:
+                    line, t = json.dumps(e, separators=(",", ":")), None
+                if args.rate > 0 or t is None:
+                    t = i / (args.rate if args.rate > 0 else 10.0)
+                last = float(t)
+                yield offset + last, line
+        if not args.loop:
+            return
+        offset += last + 0.1
+
+
+# =============================================
+# REPLAY
+# =============================================
+class Collector:
+    """hw listener measuring write→ingest latency and fan-out callbacks."""
+
+    def __init__(self, sent_at):
+        self.sent_at = sent_at        # seq -> monotonic time written
+        self.latencies = []
+        self.callbacks = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, snapshot):
+        now = time.monotonic()
+        data = snapshot.get("data") or {}
+        with self.lock:
+            self.callbacks += 1
+            seq = data.get("seq")
+            if seq is not None and seq in self.sent_at:
+                self.latencies.append((now - self.sent_at.pop(seq)) * 1000)
+
+
+class CallbackCounter:
+    """Extra hw listener that only counts the snapshots pushed to it."""
+
+    def __init__(self):
+        self.callbacks = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, snapshot):
+        with self.lock:
+            self.callbacks += 1
+
+
+def percentile(sorted_vals, p):
+    return sorted_vals[min(len(sorted_vals) - 1, int(len(sorted_vals) * p))] if sorted_vals else None
+
+
+def run(args):
+    if os.name == "nt":
+        raise SystemExit("sensor_replay.py needs a POSIX pseudo-terminal (Linux/macOS/WSL)")
+    import tty
+    import app
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    port = os.ttyname(slave)
+
+    sent_at = {}
+    collector = Collector(sent_at)
+    listeners = [collector] + [CallbackCounter() for _ in range(args.listeners - 1)]   # extras exercise fan-out
+    for listener in listeners:
+        app.add_hw_listener(listener)
+
+    before = {r: app.metrics.value("pyexpo_serial_lines_total", result=r) for r in ("parsed", "malformed", "ignored")}
+    app.start_serial_reader(port, args.baud)
+    time.sleep(0.2)
+
+    source = recorded_lines(args) if args.input else synthetic_lines(args)
+    record = open(args.record, "w") if args.record else None
+    written = bytes_written = 0
+    start = time.monotonic()
+    print(f"▶ Replaying into {port} ({'recording ' + args.input if args.input else args.pattern}) "
+          f"for {args.duration}s ...", flush=True)
+    try:
+        for due, line in source:
+            if due > args.duration:
+                break
+            delay = start + due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            payload = (line + "\n").encode("utf-8", errors="replace")
+            if '"seq":' in line:
+                try:
+                    sent_at[json.loads(line)["seq"]] = time.monotonic()
+                except (ValueError, KeyError):
+                    pass
+            os.write(master, payload)
+            written += 1
+            bytes_written += len(payload)
+            if record:
+                record.write(json.dumps({"t": round(due, 4), "line": line}) + "\n")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.monotonic() - start
+        time.sleep(0.5)                          # let the reader drain the pty
+        app.stop_serial_reader(timeout=3)
+        os.close(master)
+        if record:
+            record.close()
+
+    after = {r: app.metrics.value("pyexpo_serial_lines_total", result=r) for r in before}
+    lat = sorted(collector.latencies)
+    result = {
+        "port": port,
+        "pattern": "recorded" if args.input else args.pattern,
+        "duration_s": round(elapsed, 3),
+        "lines_written": written,
+        "bytes_written": bytes_written,
+        "write_rate_lps": round(written / elapsed, 1) if elapsed else None,
+        "parsed": after["parsed"] - before["parsed"],
+        "malformed": after["malformed"] - before["malformed"],
+        "ignored": after["ignored"] - before["ignored"],
+        "listener_callbacks": sum(l.callbacks for l in listeners),
+        "listener_callbacks_each": [l.callbacks for l in listeners],
+        "ingest_latency_ms": {
+            "n": len(lat),
+            "p50": round(percentile(lat, 0.5), 3) if lat else None,
+            "p99": round(percentile(lat, 0.99), 3) if lat else None,
+            "max": round(lat[-1], 3) if lat else None,
+        },
+        "reader_error": app.hw_snapshot()["error"],
+    }
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="JSONL recording to replay instead of synthetic data")
+    parser.add_argument("--loop", action="store_true", help="loop the recording until --duration")
+    parser.add_argument("--record", help="also write every line sent to this JSONL file")
+    parser.add_argument("--pattern", choices=PATTERNS, default="steady")
+    parser.add_argument("--rate", type=float, default=10.0, help="lines per second (base rate)")
+    parser.add_argument("--burst-rate", type=float, default=500.0, help="lines/s during bursts / end of ramp")
+    parser.add_argument("--burst-every", type=float, default=5.0, help="seconds between burst starts")
+    parser.add_argument("--burst-length", type=float, default=0.5, help="seconds per burst")
+    parser.add_argument("--period", type=float, default=10.0, help="sine pattern period in seconds")
+    parser.add_argument("--malformed", type=float, default=0.0, help="fraction of corrupted lines")
+    parser.add_argument("--danger", type=float, default=0.05, help="fraction of over-limit readings")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--listeners", type=int, default=1, help="hw listeners to fan out to")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the stats as JSON")
+    args = parser.parse_args(argv)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
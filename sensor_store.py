@@ -0,0 +1,309 @@
+"""
+sensor_store.py  —  Append-only columnar storage for raw sensor streams.
+
+Layout (one directory per device):
+
+    sensor_data/<device>/seg_<t0_ms>_<t1_ms>/time.npy      float64 epoch seconds
+                                            /ph.npy        float32, one file per channel
+                                            /...
+    sensor_data/<device>/seg_<t0_ms>_<t1_ms>.npz           same columns, compressed (cold)
+
+Readings are buffered in memory and flushed as a new segment every
+chunk_rows rows or flush_interval seconds, so appends never rewrite existing
+files. Hot segments are plain .npy columns and are memory-mapped on read: a
+range query binary-searches the time column and slices only the rows it
+needs. Segment time bounds live in the directory name, so whole segments
+outside the range are skipped without opening anything. A maintenance pass
+merges small segments into full chunks and packs segments older than
+compress_after into compressed .npz files (decompressed only when a query
+actually touches them).
+
+Maintenance runs under an exclusive flock on <root>/.maintain.lock, so two
+processes never merge the same run. It writes a replacement before removing
+what it replaces, and a merged segment lists its parts in merged_from.txt;
+readers that catch both (or lose a segment to the removal) still see every
+row exactly once.
+"""
+import logging, os, re, shutil, threading, time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger("pyexpo.sensor_store")
+
+CHANNELS = ("ph", "sensor", "temp", "tds", "turbidity", "color")
+_SEG_RE = re.compile(r"^seg_(\d+)_(\d+)(\.npz)?$")
+MERGED_FROM = "merged_from.txt"
+READ_ATTEMPTS = 3
+
+
+def device_key(name):
+    """Filesystem-safe device name ("COM3", "/dev/ttyUSB0" -> "dev_ttyUSB0")."""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(name or "unknown")).strip("_") or "unknown"
+
+
+class SensorStore:
+    def __init__(self, root, chunk_rows=4096, flush_interval=10.0, compress_after_s=86400):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.compress_after_s = compress_after_s
+        self._lock = threading.Lock()
+        self._buffers = {}        # device -> {"time": [...], channel: [...]}
+        self._thread = None
+        self._maintain_s = None   # set by start(maintain=True) in the one process that maintains
+        self._stop = threading.Event()
+
+    # ── writing ──────────────────────────────────────────────
+    def append(self, device, t, reading):
+        """Buffers one reading; flushes a segment when the chunk is full or old enough."""
+        device = device_key(device)
+        with self._lock:
+            buf = self._buffers.get(device)
+            if buf is None:
+                buf = self._buffers[device] = {"time": [], **{c: [] for c in CHANNELS}}
+            buf["time"].append(float(t))
+            for c in CHANNELS:
+                v = reading.get(c)
+                try:
+                    buf[c].append(float(v) if v is not None else np.nan)
+                except (TypeError, ValueError):
+                    buf[c].append(np.nan)
+            if len(buf["time"]) >= self.chunk_rows or t - buf["time"][0] >= self.flush_interval:
+                self._flush_locked(device)
+
+    def _flush_locked(self, device):
+        buf = self._buffers.get(device)
+        if not buf or not buf["time"]:
+            return
+        self._buffers[device] = {"time": [], **{c: [] for c in CHANNELS}}
+        columns = {"time": np.asarray(buf["time"], dtype=np.float64)}
+        for c in CHANNELS:
+            columns[c] = np.asarray(buf[c], dtype=np.float32)
+        self._write_segment(device, columns)
+
+    def _write_segment(self, device, columns, merged_from=()):
+        order = np.argsort(columns["time"], kind="stable")
+        if not np.all(order[:-1] <= order[1:]):
+            columns = {k: v[order] for k, v in columns.items()}
+        t0, t1 = columns["time"][0], columns["time"][-1]
+        dev_dir = os.path.join(self.root, device)
+        os.makedirs(dev_dir, exist_ok=True)
+        name = f"seg_{int(t0 * 1000):015d}_{int(t1 * 1000):015d}"
+        final = os.path.join(dev_dir, name)
+        n = 0
+        while os.path.exists(final) or os.path.exists(final + ".npz"):
+            n += 1                       # same-millisecond bounds: bump t1 to keep names unique
+            name = f"seg_{int(t0 * 1000):015d}_{int(t1 * 1000) + n:015d}"
+            final = os.path.join(dev_dir, name)
+        tmp = os.path.join(dev_dir, "." + name + ".tmp")
+        os.makedirs(tmp, exist_ok=True)
+        for k, v in columns.items():
+            np.save(os.path.join(tmp, k + ".npy"), v)
+        if merged_from:
+            with open(os.path.join(tmp, MERGED_FROM), "w") as f:
+                f.write("\n".join(merged_from))
+        os.rename(tmp, final)            # readers only ever see complete segments
+        return final
+
+    def flush(self):
+        with self._lock:
+            for device in list(self._buffers):
+                self._flush_locked(device)
+
+    # ── segment catalogue ────────────────────────────────────
+    def devices(self):
+        try:
+            return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+        except FileNotFoundError:
+            return []
+
+    def _segments(self, device):
+        """[(t0, t1, path, compressed)] sorted by start time."""
+        dev_dir = os.path.join(self.root, device_key(device))
+        segs = []
+        try:
+            names = os.listdir(dev_dir)
+        except FileNotFoundError:
+            return segs
+        for name in names:
+            m = _SEG_RE.match(name)
+            if m:
+                segs.append((int(m.group(1)) / 1000, int(m.group(2)) / 1000,
+                             os.path.join(dev_dir, name), bool(m.group(3))))
+        segs.sort()
+        return segs
+
+    def _live(self, segs):
+        """segs without those a merge or compression already replaced (removal still pending)."""
+        packed = {path for _, _, path, compressed in segs if compressed}
+        segs = [s for s in segs if s[3] or s[2] + ".npz" not in packed]
+        overlap, last_t1 = False, float("-inf")
+        for t0, t1, _, _ in segs:
+            overlap = overlap or t0 <= last_t1
+            last_t1 = max(last_t1, t1)
+        if not overlap:                  # a merged segment always overlaps its parts
+            return segs
+        replaced = set()
+        for _, _, path, compressed in segs:
+            if not compressed:
+                try:
+                    with open(os.path.join(path, MERGED_FROM)) as f:
+                        replaced.update(f.read().split())
+                except FileNotFoundError:
+                    pass
+        return [s for s in segs if os.path.basename(s[2]) not in replaced]
+
+    # ── reading ──────────────────────────────────────────────
+    def read_range(self, device, start, end, channels=CHANNELS):
+        """Returns {"time": ..., channel: ...} numpy arrays for start <= t <= end."""
+        device = device_key(device)
+        keys = ("time",) + tuple(channels)
+        for _ in range(READ_ATTEMPTS):
+            parts = {k: [] for k in keys}
+            vanished = False
+            for t0, t1, path, compressed in self._live(self._segments(device)):
+                if t1 < start or t0 > end:
+                    continue
+                try:
+                    if compressed:
+                        with np.load(path) as z:
+                            cols = {k: z[k] for k in keys}
+                    else:
+                        cols = {k: np.load(os.path.join(path, k + ".npy"), mmap_mode="r") for k in keys}
+                except FileNotFoundError:
+                    vanished = True      # maintain() replaced it since we listed: list again
+                    continue
+                tcol = cols["time"]
+                i0 = np.searchsorted(tcol, start, side="left")
+                i1 = np.searchsorted(tcol, end, side="right")
+                if i1 > i0:
+                    for k in keys:
+                        parts[k].append(np.array(cols[k][i0:i1]))
+            if not vanished:
+                break
+
+        with self._lock:                 # readings not flushed yet
+            buf = self._buffers.get(device)
+            if buf and buf["time"]:
+                tcol = np.asarray(buf["time"])
+                mask = (tcol >= start) & (tcol <= end)
+                if mask.any():
+                    parts["time"].append(tcol[mask])
+                    for k in channels:
+                        parts[k].append(np.asarray(buf[k], dtype=np.float32)[mask])
+
+        out = {}
+        for k in keys:
+            dtype = np.float64 if k == "time" else np.float32
+            out[k] = np.concatenate(parts[k]).astype(dtype, copy=False) if parts[k] else np.empty(0, dtype)
+        if len(parts["time"]) > 1:       # segments may overlap after a clock change
+            order = np.argsort(out["time"], kind="stable")
+            out = {k: v[order] for k, v in out.items()}
+        return out
+
+    # ── maintenance ──────────────────────────────────────────
+    def _load_segment(self, path, compressed):
+        keys = ("time",) + CHANNELS
+        if compressed:
+            with np.load(path) as z:
+                return {k: z[k] for k in keys}
+        return {k: np.load(os.path.join(path, k + ".npy")) for k in keys}
+
+    def _remove_segment(self, path, compressed):
+        if compressed:
+            os.remove(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def maintain(self, now=None):
+        """Merges small hot segments into full chunks and compresses cold ones (one process at a time)."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".maintain.lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            return self._maintain(time.time() if now is None else now)
+
+    def _maintain(self, now):
+        merged = compressed = 0
+        for device in self.devices():
+            # 1. merge runs of small uncompressed segments
+            run, run_rows = [], 0
+            hot = [s for s in self._segments(device) if not s[3]]
+            for seg in hot + [None]:
+                rows = 0
+                if seg is not None:
+                    rows = len(np.load(os.path.join(seg[2], "time.npy"), mmap_mode="r"))
+                if seg is None or rows >= self.chunk_rows or run_rows + rows > self.chunk_rows:
+                    if len(run) > 1:
+                        cols = [self._load_segment(p, False) for _, _, p, _ in run]
+                        self._write_segment(device, {k: np.concatenate([c[k] for c in cols]) for k in cols[0]},
+                                            merged_from=[os.path.basename(p) for _, _, p, _ in run])
+                        for _, _, p, _ in run:
+                            self._remove_segment(p, False)
+                        merged += len(run)
+                    run, run_rows = [], 0
+                    if seg is None or rows >= self.chunk_rows:
+                        continue
+                run.append(seg)
+                run_rows += rows
+            # 2. compress cold segments
+            if self.compress_after_s is None:
+                continue
+            for t0, t1, path, is_npz in self._segments(device):
+                if is_npz or t1 > now - self.compress_after_s:
+                    continue
+                cols = self._load_segment(path, False)
+                tmp = path + ".tmp.npz"
+                np.savez_compressed(tmp, **cols)
+                os.rename(tmp, path + ".npz")
+                self._remove_segment(path, False)
+                compressed += 1
+        return {"merged_segments": merged, "compressed_segments": compressed}
+
+    def stats(self):
+        out = {}
+        for device in self.devices():
+            segs = self._segments(device)
+            size = 0
+            for _, _, path, is_npz in segs:
+                try:
+                    if is_npz:
+                        size += os.path.getsize(path)
+                    else:
+                        size += sum(e.stat().st_size for e in os.scandir(path))
+                except FileNotFoundError:
+                    pass         # replaced by maintain() since it was listed
+            out[device] = {"segments": len(segs), "bytes": size,
+                           "first": segs[0][0] if segs else None, "last": segs[-1][1] if segs else None}
+        return out
+
+    def start(self, interval_s, maintain=True):
+        """Background flush, plus maintain() every interval_s when maintain (one thread per process)."""
+        if maintain:
+            self._maintain_s = interval_s
+        if self._thread is not None:
+            return
+        def run():
+            last_maintain = time.monotonic()
+            while not self._stop.wait(min(interval_s, self.flush_interval)):
+                try:
+                    with self._lock:
+                        now = time.time()
+                        for device, buf in list(self._buffers.items()):
+                            if buf["time"] and now - buf["time"][0] >= self.flush_interval:
+                                self._flush_locked(device)
+                    if self._maintain_s and time.monotonic() - last_maintain >= self._maintain_s:
+                        last_maintain = time.monotonic()
+                        self.maintain()
+                except Exception as e:
+                    log.warning("msg=\"sensor store maintenance failed\" error=%r", str(e))
+        self._thread = threading.Thread(target=run, name="sensor-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
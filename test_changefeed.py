@@ -0,0 +1,88 @@
+"""
+test_changefeed.py  —  Change feed: numbering, idempotent sync, RESET records, /api/changes.
+
+Run with: python -m pytest -q test_changefeed.py
+"""
+from changefeed import ChangeLog, check_of, RECORD, TEST, REVIEW
+
+
+def _sync(log, ids, reviews=0):
+    return log.sync(len(ids), lambda row: check_of(ids[row]), reviews)
+
+
+def test_sync_numbers_each_write_once(tmp_path):
+    log = ChangeLog(str(tmp_path / "changes.log"))
+    ids = ["a", "b"]
+    assert _sync(log, ids, reviews=1) == 3
+    assert _sync(log, ids, reviews=1) == 3              # nothing new: idempotent
+    ids.append("c")
+    assert _sync(log, ids, reviews=2) == 5
+    changes, reset = log.since(3, 10)
+    assert not reset
+    assert [(kind, key) for _, kind, key in changes] == [(TEST, 2), (REVIEW, 2)]
+
+
+def test_other_processes_see_the_same_numbers(tmp_path):
+    path = str(tmp_path / "changes.log")
+    one, two = ChangeLog(path), ChangeLog(path)
+    _sync(one, ["a"])
+    assert _sync(two, ["a", "b"]) == 2                   # "a" is not numbered twice
+    assert one.latest() == 2
+    assert [key for _, _, key in one.since(0, 10)[0]] == [0, 1]
+
+
+def test_rewritten_history_writes_a_reset(tmp_path):
+    log = ChangeLog(str(tmp_path / "changes.log"))
+    _sync(log, ["a", "b"])
+    latest = _sync(log, ["x", "y"])                       # same length, different tests
+    assert latest == 5                                    # RESET + both tests again
+    assert log.since(2, 10) == ([], True)
+    changes, reset = log.since(3, 10)
+    assert not reset and [key for _, _, key in changes] == [0, 1]
+
+
+def test_truncated_reviews_write_a_reset(tmp_path):
+    log = ChangeLog(str(tmp_path / "changes.log"))
+    _sync(log, [], reviews=3)
+    _sync(log, [], reviews=1)
+    assert log.since(3, 10) == ([], True)
+
+
+def test_replaced_log_resets_every_cursor(tmp_path):
+    path = tmp_path / "changes.log"
+    log = ChangeLog(str(path))
+    _sync(log, ["a", "b", "c"])
+    path.write_bytes(b"")
+    assert log.since(3, 10) == ([], True)
+
+
+def test_partial_record_is_ignored_until_complete(tmp_path):
+    path = tmp_path / "changes.log"
+    log = ChangeLog(str(path))
+    _sync(log, ["a"])
+    with open(path, "ab") as f:
+        f.write(RECORD.pack(REVIEW, 1, 0)[:5])
+    assert ChangeLog(str(path)).latest() == 1
+
+
+LOCATED_TEST = {"sample_type": "milk", "sensor": "2.0", "weight": "1.0", "latitude": "11.08", "longitude": "76.99"}
+
+
+def test_changes_route_delivers_new_tests(webapp, client):
+    seq = client.get("/api/changes?since=0").get_json()["seq"]
+    assert client.post("/detection-testing", data=LOCATED_TEST).status_code == 200
+
+    body = client.get(f"/api/changes?since={seq}").get_json()
+    assert body["reset"] is False
+    assert [t["seq"] for t in body["tests"]] == [seq + 1]
+    assert body["seq"] == seq + 1
+    assert client.get(f"/api/changes?since={seq + 1}").get_json()["tests"] == []
+
+
+def test_map_markers_page_backwards(webapp, client):
+    assert client.post("/detection-testing", data=LOCATED_TEST).status_code == 200
+    rows = len(webapp.history_records())
+    body = client.get(f"/api/map-markers?before={rows}&limit=1").get_json()
+    assert body["before"] == rows - 1
+    assert [m["id"] for m in body["markers"]] == [webapp.analysis_id(webapp.history_records()[-1])]
+    assert client.get("/api/map-markers?before=0").get_json() == {"markers": [], "before": 0}
@@ -0,0 +1,98 @@
+"""
+test_feedback_store.py  —  Review log + offset index: paging, filters, repair, legacy import.
+
+Run with: python -m pytest -q test_feedback_store.py
+"""
+import json
+
+from feedback_store import FeedbackStore, RECORD
+
+
+def _review(i, rating=5, sentiment="Positive"):
+    return {"name": f"r{i}", "message": f"review {i}", "rating": str(rating), "sentiment": sentiment,
+            "timestamp": f"2025-01-01 00:00:{i:02d}"}
+
+
+def _store(tmp_path, n=0, **kw):
+    store = FeedbackStore(str(tmp_path / "feedback.jsonl"), **kw).open()
+    for i in range(n):
+        store.append(_review(i, rating=i % 5 + 1, sentiment=("Positive", "Negative")[i % 2]))
+    return store
+
+
+def test_pages_walk_newest_first(tmp_path):
+    store = _store(tmp_path, 25)
+    seen, cursor = [], None
+    while True:
+        reviews, cursor = store.page(cursor, limit=10)
+        seen += [r["id"] for r in reviews]
+        if cursor is None:
+            break
+    assert seen == list(range(25, 0, -1))
+
+
+def test_filters_combine(tmp_path):
+    store = _store(tmp_path, 30)
+    reviews, _ = store.page(rating=1, sentiment="Negative", limit=50)
+    assert reviews and all(r["rating"] == "1" and r["sentiment"] == "Negative" for r in reviews)
+    assert [r["id"] for r in reviews] == sorted((r["id"] for r in reviews), reverse=True)
+    assert store.page(sentiment="Bogus")[0] == []
+
+
+def test_stats_from_the_index(tmp_path):
+    store = _store(tmp_path, 10)
+    stats = store.stats()
+    assert stats["count"] == 10
+    assert stats["ratings"] == {1: 2, 2: 2, 3: 2, 4: 2, 5: 2}
+    assert stats["sentiments"]["Positive"] == stats["sentiments"]["Negative"] == 5
+    assert stats["avg_rating"] == 3.0
+
+
+def test_lines_without_index_records_are_repaired(tmp_path):
+    store = _store(tmp_path, 3)
+    with open(store.path, "ab") as f:    # crash between the log write and the index write
+        f.write(json.dumps(_review(3, rating=2)).encode("utf-8") + b"\n")
+    reopened = FeedbackStore(store.path).open()
+    assert reopened.count() == 4
+    assert reopened.get([4])[0]["rating"] == "2"
+    assert reopened.append(_review(4)) == 5
+    assert len(open(store.index_path, "rb").read()) == 5 * RECORD.size
+
+
+def test_truncated_index_record_is_ignored(tmp_path):
+    store = _store(tmp_path, 3)
+    with open(store.index_path, "ab") as idx:   # a record still being written by another worker
+        idx.write(b"\0" * (RECORD.size // 2))
+    assert FeedbackStore(store.path).count() == 3
+
+
+def test_replaced_log_rebuilds_the_index(tmp_path):
+    store = _store(tmp_path, 5)
+    with open(store.path, "wb") as f:
+        f.write(json.dumps(_review(0, rating=4)).encode("utf-8") + b"\n")
+    reopened = FeedbackStore(store.path).open()
+    assert reopened.count() == 1
+    assert reopened.stats()["ratings"][4] == 1
+
+
+def test_torn_line_does_not_merge_with_the_next_review(tmp_path):
+    store = _store(tmp_path, 2)
+    with open(store.path, "ab") as f:
+        f.write(b'{"name": "half')
+    rid = store.append(_review(9))
+    assert store.get([rid])[0]["name"] == "r9"
+
+
+def test_other_workers_appends_are_picked_up(tmp_path):
+    one = _store(tmp_path, 2)
+    two = FeedbackStore(one.path).open()
+    two.append(_review(7))
+    assert one.count() == 3
+    assert one.page(limit=1)[0][0]["name"] == "r7"
+
+
+def test_legacy_json_is_imported_in_timestamp_order(tmp_path):
+    legacy = tmp_path / "feedback_data.json"
+    legacy.write_text(json.dumps([_review(2), _review(0), _review(1)]))
+    store = _store(tmp_path, legacy_path=str(legacy))
+    assert [r["name"] for r in store.get([1, 2, 3])] == ["r0", "r1", "r2"]
@@ -0,0 +1,90 @@
+"""
+test_idempotency.py  —  Submission dedupe: claims, replays, takeovers and the detection form.
+
+Run with: python -m pytest -q test_idempotency.py
+"""
+import os, threading, time, uuid
+
+from idempotency import IdempotencyCache, NEW, DONE, PENDING
+
+
+def test_first_claim_owns_the_key_and_repeats_replay(tmp_path):
+    cache = IdempotencyCache(str(tmp_path))
+    assert cache.claim("detection:alice", "k1") == (NEW, None)
+    assert cache.claim("detection:alice", "k1") == (PENDING, None)
+    cache.complete("detection:alice", "k1", {"result": 1})
+    assert cache.claim("detection:alice", "k1") == (DONE, {"result": 1})
+    assert cache.wait("detection:alice", "k1", timeout_s=0.1) == {"result": 1}
+
+
+def test_keys_never_match_across_scopes(tmp_path):
+    cache = IdempotencyCache(str(tmp_path))
+    cache.claim("detection:alice", "k1")
+    cache.complete("detection:alice", "k1", {"result": 1})
+    assert cache.claim("detection:bob", "k1") == (NEW, None)
+
+
+def test_released_key_can_be_claimed_again(tmp_path):
+    cache = IdempotencyCache(str(tmp_path))
+    cache.claim("s", "k")
+    cache.release("s", "k")
+    assert cache.wait("s", "k", timeout_s=0.1) is None
+    assert cache.claim("s", "k") == (NEW, None)
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    cache = IdempotencyCache(str(tmp_path), lock_timeout_s=60)
+    cache.claim("s", "k")
+    lock_path = cache._paths("s", "k")[0]
+    old = time.time() - 120
+    os.utime(lock_path, (old, old))
+    assert cache.claim("s", "k") == (NEW, None)
+
+
+def test_expired_results_are_not_replayed(tmp_path):
+    cache = IdempotencyCache(str(tmp_path), ttl_s=60)
+    cache.claim("s", "k")
+    cache.complete("s", "k", {"result": 1})
+    result_path = cache._paths("s", "k")[1]
+    old = time.time() - 120
+    os.utime(result_path, (old, old))
+    assert cache.purge() == 1
+    assert not os.path.exists(result_path)
+    assert cache.claim("s", "k") == (NEW, None)
+
+
+def test_concurrent_claims_have_one_owner(tmp_path):
+    cache = IdempotencyCache(str(tmp_path))
+    barrier = threading.Barrier(8)
+    states = []
+    def claim():
+        barrier.wait()
+        states.append(cache.claim("s", "k")[0])
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert states.count(NEW) == 1
+
+
+def test_repeated_detection_post_is_stored_once(webapp, client):
+    key = uuid.uuid4().hex
+    before = len(webapp.history_records())
+    form = {"sample_type": "milk", "sensor": "2.0", "weight": "1.0", "idempotency_key": key}
+    first = client.post("/detection-testing", data=form)
+    second = client.post("/detection-testing", data=form)
+    assert first.status_code == second.status_code == 200
+    assert len(webapp.history_records()) == before + 1
+
+    other = client.post("/detection-testing", data=dict(form, idempotency_key=uuid.uuid4().hex))
+    assert other.status_code == 200
+    assert len(webapp.history_records()) == before + 2
+
+
+def test_invalid_submission_stores_nothing(webapp, client):
+    before = len(webapp.history_records())
+    response = client.post("/detection-testing",
+                           data={"sensor": "x", "weight": "1", "idempotency_key": uuid.uuid4().hex})
+    assert response.status_code == 200
+    assert len(webapp.history_records()) == before
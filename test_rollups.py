@@ -0,0 +1,104 @@
+"""
+test_rollups.py  —  Incremental rollups: ingestion cursors, rebuilds, resolutions, bad ranges.
+
+Run with: python -m pytest -q test_rollups.py
+"""
+import time
+
+import pytest
+
+from changefeed import check_of
+from rollups import Rollups
+from sensor_store import SensorStore
+
+NOW = 1_700_000_000.0
+
+
+def _test(i, level, sample_type="milk", user="alice", age_s=600):
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(NOW - age_s))
+    return {"id": f"t{i}", "timestamp": stamp, "sample_type": sample_type, "detected_level": level, "user": user}
+
+
+def _rollups(tmp_path):
+    return Rollups(str(tmp_path / "rollups.sqlite3"), {"milk": 1.0, "default": 1.0},
+                   test_check=lambda entry: check_of(entry["id"]))
+
+
+def _counts(r, series):
+    return [p["count"] for p in r.query(series, NOW - 3600, NOW, resolution="1m")["points"]]
+
+
+def test_update_only_folds_new_tests(tmp_path):
+    r = _rollups(tmp_path)
+    history = [_test(0, 0.5), _test(1, 2.0)]
+    assert r.update(lambda: history, now=NOW)["tests"] == 2
+    history.append(_test(2, 0.1))
+    assert r.update(lambda: history, now=NOW)["tests"] == 1
+
+    point = r.query("tests:milk", NOW - 3600, NOW, resolution="1m")["points"][0]
+    assert point["count"] == 3
+    assert point["max"] == 2.0
+    assert point["over_limit_share"] == round(1 / 3, 4)
+    assert _counts(r, "tests:milk:alice") == [3]
+
+
+def test_unchanged_count_skips_loading_history(tmp_path):
+    r = _rollups(tmp_path)
+    history = [_test(0, 0.5)]
+    r.update(lambda: history, now=NOW)
+    def loader():
+        raise AssertionError("history loaded although its count is unchanged")
+    assert r.update(loader, history_count=1, now=NOW)["tests"] == 0
+
+
+def test_truncated_history_is_rebuilt(tmp_path):
+    r = _rollups(tmp_path)
+    r.update(lambda: [_test(i, 0.5) for i in range(4)], now=NOW)
+    r.update(lambda: [_test(9, 0.5)], now=NOW)
+    assert _counts(r, "tests:milk") == [1]
+
+
+def test_rewritten_history_is_rebuilt(tmp_path):
+    r = _rollups(tmp_path)
+    r.update(lambda: [_test(0, 0.5), _test(1, 0.5)], now=NOW)
+    # same prefix length, different rows: the cursor alone can't tell
+    rewritten = [_test(5, 3.0), _test(6, 3.0), _test(7, 3.0)]
+    assert r.update(lambda: rewritten, now=NOW)["tests"] == 3
+    point = r.query("tests:milk", NOW - 3600, NOW, resolution="1m")["points"][0]
+    assert (point["count"], point["min"]) == (3, 3.0)
+
+
+def test_sensor_rows_are_folded_once(tmp_path):
+    store = SensorStore(str(tmp_path / "sensor"), chunk_rows=100, flush_interval=1e9)
+    for i in range(120):
+        store.append("dev", NOW - 7200 + i * 30, {"ph": 7.0})
+    store.flush()
+    r = _rollups(tmp_path)
+    assert r.update(lambda: [], store, now=NOW)["readings"] == 120
+    assert r.update(lambda: [], store, now=NOW)["readings"] == 0
+    points = r.query("sensor:dev:ph", NOW - 7200, NOW, resolution="1h")["points"]
+    assert sum(p["count"] for p in points) == 120
+
+
+def test_pick_resolution_respects_points_and_retention(tmp_path):
+    r = _rollups(tmp_path)
+    assert r.pick_resolution(NOW - 3600, NOW, 500, now=NOW)[0] == "1m"
+    assert r.pick_resolution(NOW - 7 * 86400, NOW, 500, now=NOW)[0] == "1h"
+    assert r.pick_resolution(NOW - 365 * 86400, NOW, 500, now=NOW)[0] == "1d"
+
+
+@pytest.mark.parametrize("start,end", [(float("nan"), NOW), (0.0, float("inf")), (float("-inf"), NOW)])
+def test_query_rejects_non_finite_bounds(tmp_path, start, end):
+    with pytest.raises(ValueError):
+        _rollups(tmp_path).query("tests:milk", start, end)
+
+
+@pytest.mark.parametrize("query", ["start=nan", "end=inf", "start=-inf&end=10", "end=1e309", "start=x"])
+def test_trends_rejects_bad_bounds(client, query):
+    assert client.get("/api/trends?" + query).status_code == 400
+
+
+def test_trends_answers_from_rollups(client):
+    response = client.get("/api/trends?sample_type=milk")
+    assert response.status_code == 200
+    assert response.get_json()["series"] == "tests:milk:alice"
@@ -0,0 +1,73 @@
+"""
+test_search_index.py  —  BM25 index: AND queries, prefixes, owners, ties and the /api/search route.
+
+Run with: python -m pytest -q test_search_index.py
+"""
+from search_index import SearchIndex, tokenize
+
+
+def _index(docs):
+    index = SearchIndex()
+    for ref, (text, owner) in enumerate(docs, start=100):
+        index.add(ref, [text], owner=owner)
+    return index
+
+
+DOCS = [
+    ("fresh milk tasted sour", "alice"),
+    ("milk sample safe", "bob"),
+    ("sour milk sour smell", "alice"),
+    ("water sample safe", "bob"),
+    ("alicante honey", None),
+]
+
+
+def test_tokenize_lowercases_and_drops_punctuation():
+    assert tokenize("Sour MILK, ali*!") == ["sour", "milk", "ali"]
+
+
+def test_every_token_must_match():
+    total, hits = _index(DOCS).search("sour milk")
+    assert total == 2
+    assert [ref for ref, _ in hits] == [102, 100]       # two "sour"s rank first
+
+
+def test_unknown_token_matches_nothing():
+    assert _index(DOCS).search("milk zebra") == (0, [])
+    assert _index(DOCS).search("  ") == (0, [])
+
+
+def test_prefix_tokens_expand_over_the_vocabulary():
+    total, hits = _index(DOCS).search("ali*")
+    assert total == 1 and hits[0][0] == 104
+    assert _index(DOCS).search("sa* milk")[0] == 1
+
+
+def test_owner_filter():
+    total, hits = _index(DOCS).search("milk", owner="alice")
+    assert total == 2 and {ref for ref, _ in hits} == {100, 102}
+    assert _index(DOCS).search("milk", owner="nobody") == (0, [])
+
+
+def test_limit_keeps_total_and_newest_ties():
+    index = _index([("safe", None)] * 10)
+    total, hits = index.search("safe", limit=3)
+    assert total == 10
+    assert [ref for ref, _ in hits] == [109, 108, 107]
+
+
+def test_documents_added_after_a_search_are_found():
+    index = _index(DOCS)
+    assert index.search("honey")[0] == 1
+    index.add(200, ["raw honey"])
+    assert index.search("honey")[0] == 2
+    assert index.stats()["documents"] == 6
+
+
+def test_search_route_finds_new_tests(client):
+    form = {"sample_type": "honey", "sensor": "2.0", "weight": "1.0"}
+    assert client.post("/detection-testing", data=form).status_code == 200
+    body = client.get("/api/search?q=honey&kind=tests").get_json()
+    assert body["total"]["tests"] >= 1
+    assert client.get("/api/search?q=milk&kind=bogus").status_code == 400
+    assert client.get("/api/search").status_code == 400
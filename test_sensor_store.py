@@ -0,0 +1,91 @@
+"""
+test_sensor_store.py  —  Columnar sensor segments: round trips, merges, compression, read races.
+
+Run with: python -m pytest -q test_sensor_store.py
+"""
+import os
+
+import numpy as np
+
+from sensor_store import SensorStore, MERGED_FROM
+
+
+def _fill(store, device, n, t0=1_000_000.0):
+    for i in range(n):
+        store.append(device, t0 + i, {"ph": 7.0 + i / 100, "temp": 20 + i})
+    store.flush()
+
+
+def _segment_names(store, device):
+    return sorted(n for n in os.listdir(os.path.join(store.root, device)) if n.startswith("seg_"))
+
+
+def test_read_range_returns_every_row_once(tmp_path):
+    store = SensorStore(str(tmp_path), chunk_rows=10, flush_interval=1e9)
+    _fill(store, "dev", 35)
+    cols = store.read_range("dev", 1_000_000.0, 1_000_034.0, ("ph", "temp"))
+    assert len(cols["time"]) == 35
+    assert np.all(np.diff(cols["time"]) > 0)
+    assert cols["temp"][-1] == 54
+
+    cols = store.read_range("dev", 1_000_005.0, 1_000_012.0, ("ph",))
+    assert cols["time"].tolist() == [1_000_000.0 + i for i in range(5, 13)]
+
+
+def test_unflushed_readings_are_readable(tmp_path):
+    store = SensorStore(str(tmp_path), chunk_rows=100, flush_interval=1e9)
+    store.append("dev", 5.0, {"ph": 6.5})
+    assert store.read_range("dev", 0, 10, ("ph",))["ph"].tolist() == [6.5]
+
+
+def test_maintain_merges_small_segments(tmp_path):
+    store = SensorStore(str(tmp_path), chunk_rows=8, flush_interval=1e9, compress_after_s=None)
+    for start in range(0, 12, 3):            # four 3-row segments
+        _fill(store, "dev", 3, t0=1_000_000.0 + start)
+    assert len(_segment_names(store, "dev")) == 4
+
+    assert store.maintain()["merged_segments"] >= 2
+    names = _segment_names(store, "dev")
+    assert len(names) < 4
+    assert any(os.path.exists(os.path.join(store.root, "dev", n, MERGED_FROM)) for n in names)
+    assert len(store.read_range("dev", 0, 2e6, ("ph",))["time"]) == 12
+
+
+def test_reader_that_sees_merged_and_parts_counts_rows_once(tmp_path):
+    store = SensorStore(str(tmp_path), chunk_rows=100, flush_interval=1e9)
+    _fill(store, "dev", 3, t0=1_000_000.0)
+    _fill(store, "dev", 3, t0=1_000_010.0)
+    parts = [os.path.join(store.root, "dev", n) for n in _segment_names(store, "dev")]
+    # maintain() stopped between writing the replacement and removing its parts
+    cols = [store._load_segment(p, False) for p in parts]
+    store._write_segment("dev", {k: np.concatenate([c[k] for c in cols]) for k in cols[0]},
+                         merged_from=[os.path.basename(p) for p in parts])
+
+    assert len(store.read_range("dev", 0, 2e6, ("ph",))["time"]) == 6
+
+
+def test_segment_removed_during_read_is_retried(tmp_path, monkeypatch):
+    store = SensorStore(str(tmp_path), chunk_rows=4, flush_interval=1e9, compress_after_s=None)
+    _fill(store, "dev", 4, t0=1_000_000.0)
+    _fill(store, "dev", 2, t0=1_000_010.0)
+    _fill(store, "dev", 2, t0=1_000_020.0)
+    stale = store._live(store._segments("dev"))
+    store.maintain()                         # replaces the two small segments
+
+    live = store._live
+    calls = []
+    def listing_from_before_maintain(segs):
+        calls.append(1)
+        return stale if len(calls) == 1 else live(segs)
+    monkeypatch.setattr(store, "_live", listing_from_before_maintain)
+
+    assert len(store.read_range("dev", 0, 2e6, ("ph",))["time"]) == 8
+    assert len(calls) == 2
+
+
+def test_cold_segments_are_compressed_and_still_readable(tmp_path):
+    store = SensorStore(str(tmp_path), chunk_rows=5, flush_interval=1e9, compress_after_s=60)
+    _fill(store, "dev", 10, t0=1_000_000.0)
+    assert store.maintain(now=1_000_000.0 + 3600)["compressed_segments"] == 2
+    assert all(n.endswith(".npz") for n in _segment_names(store, "dev"))
+    assert store.read_range("dev", 0, 2e6, ("temp",))["temp"].tolist() == list(range(20, 30))
@@ -0,0 +1,38 @@
+"""
+test_summary_report.py  —  /reports/summary: range parsing, clamping and the per-bucket cache.
+
+Run with: python -m pytest -q test_summary_report.py
+"""
+import pytest
+
+
+@pytest.mark.parametrize("query", ["days=nan", "days=inf", "days=-inf", "days=abc",
+                                   "start=2025-13-01", "start=2025-02-01&end=2025-01-01"])
+def test_bad_ranges_are_rejected(client, query):
+    assert client.get("/reports/summary?" + query).status_code == 400
+
+
+@pytest.mark.parametrize("days", ["1e308", "-5", "0"])
+def test_out_of_range_days_are_clamped(client, days):
+    response = client.get("/reports/summary?days=" + days)
+    assert response.status_code == 200
+    assert response.mimetype == "application/pdf"
+    response.close()
+
+
+def test_repeat_within_a_bucket_is_served_from_cache(webapp, client):
+    hits = lambda: webapp.metrics.value("pyexpo_cache_total", cache="summary_report", result="hit")
+    first = client.get("/reports/summary?days=30")
+    assert first.status_code == 200
+    first.close()
+    before = hits()
+    second = client.get("/reports/summary?days=30")
+    assert second.status_code == 200
+    second.close()
+    assert hits() == before + 1
+
+
+def test_explicit_dates(client):
+    response = client.get("/reports/summary?start=2025-01-01&end=2025-01-31")
+    assert response.status_code == 200
+    response.close()